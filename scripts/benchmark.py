@@ -0,0 +1,297 @@
+#离线端到端评估与延迟基准：运行 work.py 的流程图，输出准确率、分阶段耗时与调用次数
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+CURRENT_DIR = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
+SRC_DIR = os.path.join(PROJECT_ROOT, "src")
+for p in (SRC_DIR, PROJECT_ROOT, CURRENT_DIR):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+DEFAULT_JSONL = os.path.join(PROJECT_ROOT, "data", "CDrugRed_test-A.jsonl")
+DEFAULT_CANDIDATES = os.path.join(PROJECT_ROOT, "data", "候选药物列表.json")
+DEFAULT_DRUG_JSON = os.path.join(PROJECT_ROOT, "merged_20250923_195353.json")
+
+ACCURACY_KEYS = ("jaccard", "precision", "recall", "f1")
+TIMING_KEYS = ("elapsed_s", "records_per_s", "latency_p50_s", "latency_p95_s")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="离线评估与延迟基准")
+    parser.add_argument("--jsonl", default=DEFAULT_JSONL, help="病历 JSONL")
+    parser.add_argument("--txt", default=None, help="可选：每行作为 ask 的输入；缺省时使用 JSONL 行本身")
+    parser.add_argument("--gold", default=None,
+                        help="真实标签：病历 JSONL（出院带药列表）或提交格式 JSON；缺省读取 --jsonl")
+    parser.add_argument("--limit", type=int, default=0, help="只评估前 N 条（0 表示全部）")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--staged", action="store_true", help="使用分阶段批处理（批量检索）")
+    parser.add_argument("--retrieval", choices=("vector", "graph", "both"), default="vector",
+                        help="检索来源（graph/both 需要可用的 Neo4j）")
+    parser.add_argument("--query-mode", choices=("llm", "lexical"), default="llm",
+                        help="检索 query 来源：LLM 生成 / 本地词法生成")
+    parser.add_argument("--stage-batch", type=int, default=64, help="分阶段模式下每批的病历数（0 表示全部）")
+    parser.add_argument("--advice-batch", type=int, default=1,
+                        help="每次推荐调用合并的病历数（>1 时自动使用分阶段批处理）")
+    parser.add_argument("--group-threshold", type=float, default=0.0,
+                        help="相似病历复用阈值（同一患者的 MinHash 估计 Jaccard 相似度，0 表示关闭）")
+    parser.add_argument("--backend", choices=("standin", "live"), default="standin",
+                        help="standin：本地确定性替身服务；live：使用已配置的真实 LLM/嵌入服务")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="替身 LLM 每次调用的模拟延迟")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="替身嵌入每次请求的模拟延迟")
+    parser.add_argument("--drug-json", default=DEFAULT_DRUG_JSON,
+                        help="standin 模式下用于构建临时向量库的药物知识 JSON")
+    parser.add_argument("--vector-db-path", default=None, help="向量库路径（standin 默认使用临时目录）")
+    parser.add_argument("--vector-backend", choices=("chroma", "numpy"), default=None,
+                        help="向量库后端（缺省取环境变量 VECTOR_BACKEND，默认 chroma）")
+    parser.add_argument("--search-mode", choices=("dense", "bm25", "hybrid"), default="dense",
+                        help="向量库检索方式：稠密 / BM25 / 两者 RRF 融合")
+    parser.add_argument("--use-caches", action="store_true", help="保留嵌入与 LLM 响应缓存（默认关闭以测量真实开销）")
+    parser.add_argument("--label", default="", help="写入结果文件的运行标签")
+    parser.add_argument("--out", default=os.path.join(PROJECT_ROOT, "outputs", "benchmark.json"))
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="对比两个结果文件后退出")
+    return parser.parse_args(argv)
+
+
+def iter_benchmark_records(jsonl_path: str, txt_path: Optional[str], limit: int) -> Iterator[Tuple[int, str, str]]:
+    """产出 (行号, query_src, json_text)；未提供 TXT 时以 JSONL 行作为 query_src。"""
+    ft = open(txt_path, "r", encoding="utf-8") if txt_path else None
+    count = 0
+    try:
+        with open(jsonl_path, "r", encoding="utf-8") as fj:
+            for idx, j_line in enumerate(fj, start=1):
+                t_line = next(ft, "") if ft else j_line
+                t_line, j_line = t_line.strip(), j_line.strip()
+                if not t_line or not j_line:
+                    continue
+                yield idx, t_line, j_line
+                count += 1
+                if limit and count >= limit:
+                    break
+    finally:
+        if ft:
+            ft.close()
+
+
+def stage_summary(durations: Dict[str, List[float]]) -> Dict[str, dict]:
+    from work import percentile
+    return {
+        name: {
+            "calls": len(vals),
+            "total_s": round(sum(vals), 3),
+            "mean_ms": round(1000 * sum(vals) / len(vals), 2) if vals else 0.0,
+            "p50_ms": round(1000 * percentile(vals, 50), 2),
+            "p95_ms": round(1000 * percentile(vals, 95), 2),
+        }
+        for name, vals in durations.items()
+    }
+
+
+def setup_standin(args: argparse.Namespace, work) -> "StandInBackend":
+    """启动替身服务，并把流程中的 LLM 与向量检索指向它。"""
+    from standin_server import StandInBackend
+    from qianwen_class import QianwenEmbedding, QianwenLLM
+    from embedding_cache import get_embedding_cache
+    from retriever_registry import RetrieverRegistry
+    from wap.vector_retriver import build_drug_documents
+
+    with open(DEFAULT_CANDIDATES, "r", encoding="utf-8") as f:
+        candidates = json.load(f)
+    backend = StandInBackend(candidates,
+                             llm_latency=args.llm_latency_ms / 1000.0,
+                             embed_latency=args.embed_latency_ms / 1000.0)
+    base_url = backend.start()
+    print(f"🧪 替身服务已启动: {base_url}")
+
+    work.dg.llm = QianwenLLM(api_base=f"{base_url}/v1", response_cache=work.dg.llm.response_cache,
+                             context_window=work.dg.llm.context_window)
+    manager = work.dg.neo4j_manager
+    manager.registry = RetrieverRegistry(
+        embeddings_factory=lambda key: QianwenEmbedding(api_base=base_url, cache=get_embedding_cache())
+    )
+
+    # 构建（或复用）向量库；入库阶段的调用不计入基准
+    vector_db = manager.registry.get(manager.retriever_key)
+    if vector_db.get_stats().get("documents_count", 0) == 0 and os.path.isfile(args.drug_json):
+        with open(args.drug_json, "r", encoding="utf-8") as f:
+            vector_db.add_documents(build_drug_documents(json.load(f)))
+        manager.registry.refresh_stats(manager.retriever_key)
+    backend.reset_counters()
+    return backend
+
+
+async def run(args: argparse.Namespace) -> dict:
+    if not args.use_caches:
+        os.environ["LLM_CACHE"] = "0"
+        os.environ["EMBEDDING_CACHE"] = "0"
+    if args.backend == "standin":
+        os.environ["VECTOR_DB_PATH"] = args.vector_db_path or tempfile.mkdtemp(prefix="bench_chroma_")
+    elif args.vector_db_path:
+        os.environ["VECTOR_DB_PATH"] = args.vector_db_path
+    if args.vector_backend:
+        os.environ["VECTOR_BACKEND"] = args.vector_backend
+    os.environ["SEARCH_MODE"] = args.search_mode
+
+    import work  # 延迟导入：环境变量需在创建 DrugGraph 之前设置
+    from evaluation import evaluate, load_gold
+    from tracing import get_tracer
+
+    backend = setup_standin(args, work) if args.backend == "standin" else None
+    get_tracer().reset()  # 入库阶段的 span 不计入结果
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=max(4, args.concurrency)))
+
+    durations: Dict[str, List[float]] = {}
+
+    def timed(name, fn):
+        async def wrapper(state):
+            start = time.perf_counter()
+            try:
+                return await fn(state)
+            finally:
+                durations.setdefault(name, []).append(time.perf_counter() - start)
+        return wrapper
+
+    work.dg.retrieval_mode = args.retrieval
+    work.dg.query_mode = args.query_mode
+    if args.query_mode == "lexical":
+        # 语料统计只在内存中计算，不写缓存文件
+        work.dg.query_builder = work.load_query_builder([args.jsonl], work.dg.candidate_names, stats_path=None)
+    graph = work.build_graph(node_wrapper=timed)
+    work.dg.warm_up()
+
+    predictions: Dict[str, List[str]] = {}
+    failed = 0
+
+    def on_result(res: dict) -> None:
+        nonlocal failed
+        predictions[str(res["ID"])] = res["prediction"]
+        failed += 1 if res["error"] else 0
+
+    if args.advice_batch > 1:
+        args.staged = True
+    records = list(iter_benchmark_records(args.jsonl, args.txt, args.limit))
+    if args.group_threshold > 0:
+        # 分组为预处理，不计入耗时
+        work.record_reuse = work.RecordReuse(work.RecordGrouper(threshold=args.group_threshold))
+        records = list(work.group_records(iter(records), work.record_reuse))
+    order = [str(work.case_id_of(idx, j_line)) for idx, _, j_line in records]
+    start = time.perf_counter()
+    if args.staged:
+        latencies = await work.run_staged(iter(records), args.concurrency, args.stage_batch, on_result,
+                                          node_wrapper=timed, advice_batch=args.advice_batch)
+    else:
+        latencies = await work.run_batch(graph, iter(records), args.concurrency, on_result)
+    elapsed = time.perf_counter() - start
+    await work.dg.aclose()
+    timing = work.report(latencies, failed, elapsed)
+    reuse = work.report_reuse(work.record_reuse) if work.record_reuse is not None else None
+
+    gold = load_gold(args.gold or args.jsonl)
+    if not gold:
+        print("⚠️ 未找到非空的出院带药列表，准确率指标不可用；请通过 --gold 提供标注文件")
+    accuracy = evaluate(predictions, gold, order)
+    scores_by_id = {r["ID"]: r for r in accuracy.pop("per_record")}
+
+    result = {
+        "label": args.label,
+        "config": {
+            "backend": args.backend,
+            "jsonl": args.jsonl,
+            "gold": args.gold or args.jsonl,
+            "records": len(records),
+            "concurrency": args.concurrency,
+            "staged": args.staged,
+            "retrieval": args.retrieval,
+            "query_mode": args.query_mode,
+            "stage_batch": args.stage_batch,
+            "advice_batch": args.advice_batch,
+            "llm_latency_ms": args.llm_latency_ms,
+            "embed_latency_ms": args.embed_latency_ms,
+            "use_caches": args.use_caches,
+            "vector_backend": os.getenv("VECTOR_BACKEND", "chroma"),
+            "search_mode": args.search_mode,
+            "group_threshold": args.group_threshold,
+        },
+        "reuse": reuse,
+        "accuracy": accuracy,
+        "timing": {**timing, "stages": stage_summary(durations)},
+        "calls": dict(backend.counters) if backend else None,
+        "spans": get_tracer().summary(),
+        "per_record": [
+            {**scores_by_id.get(rid, {}), "ID": rid, "prediction": predictions.get(rid, [])}
+            for rid in order
+        ],
+    }
+    if backend:
+        backend.stop()
+    return result
+
+
+def print_summary(result: dict) -> None:
+    acc, timing = result["accuracy"], result["timing"]
+    print(f"📊 准确率（{acc['labeled']} 条有标注）: " + ", ".join(f"{k}={acc[k]}" for k in ACCURACY_KEYS))
+    for name, st in timing["stages"].items():
+        print(f"   阶段 {name}: 共 {st['total_s']}s，均值 {st['mean_ms']}ms，p95 {st['p95_ms']}ms")
+    if result.get("calls"):
+        print(f"   调用次数: {result['calls']}")
+
+
+def compare(base_path: str, new_path: str) -> None:
+    """并排打印两次运行的关键指标及差值。"""
+    with open(base_path, "r", encoding="utf-8") as f:
+        base = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+
+    def row(name, a, b):
+        if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+            print(f"{name:<28}{a:>14}{b:>14}{round(b - a, 4):>+14}")
+        else:
+            print(f"{name:<28}{str(a):>14}{str(b):>14}")
+
+    print(f"{'指标':<28}{base.get('label') or 'BASE':>14}{new.get('label') or 'NEW':>14}{'差值':>14}")
+    for k in ("query_mode", "retrieval", "search_mode", "staged", "advice_batch", "group_threshold"):
+        row(k, base.get("config", {}).get(k), new.get("config", {}).get(k))
+    for k in ACCURACY_KEYS:
+        row(k, base["accuracy"].get(k), new["accuracy"].get(k))
+    for k in TIMING_KEYS:
+        row(k, base["timing"].get(k), new["timing"].get(k))
+    for stage in sorted(set(base["timing"]["stages"]) | set(new["timing"]["stages"])):
+        a = base["timing"]["stages"].get(stage, {}).get("mean_ms")
+        b = new["timing"]["stages"].get(stage, {}).get("mean_ms")
+        row(f"{stage}.mean_ms", a, b)
+    base_spans, new_spans = base.get("spans") or {}, new.get("spans") or {}
+    for name in sorted(set(base_spans) | set(new_spans)):
+        row(f"{name}.count", base_spans.get(name, {}).get("count"), new_spans.get(name, {}).get("count"))
+    for k in sorted(set(base.get("calls") or {}) | set(new.get("calls") or {})):
+        row(k, (base.get("calls") or {}).get(k), (new.get("calls") or {}).get(k))
+    changed = sum(
+        1 for a, b in zip(base.get("per_record", []), new.get("per_record", []))
+        if a.get("ID") == b.get("ID") and sorted(a.get("prediction", [])) != sorted(b.get("prediction", []))
+    )
+    print(f"预测结果不同的记录数: {changed}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return
+    result = asyncio.run(run(args))
+    print_summary(result)
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"✅ 结果已写入 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,8 @@
 
 import os
 import sys
+import argparse
+import asyncio
 
 # 从 src 目录导入 DrugGraph
 CURRENT_DIR = os.path.dirname(__file__)
@@ -15,7 +17,19 @@ if SRC_DIR not in sys.path:
 from raggraph import DrugGraph
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="为图数据库节点生成/写回嵌入")
+    parser.add_argument("--batch-size", type=int, default=64, help="每批嵌入并写回的节点数")
+    parser.add_argument("--workers", type=int, default=4, help="并发处理的批次数")
+    parser.add_argument("--dimension", type=int, default=1024, help="向量维度（需与嵌入模型一致）")
+    parser.add_argument("--force", action="store_true", help="忽略已有嵌入与文本哈希，全部重新生成")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="使用异步驱动与异步嵌入请求执行回填")
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
     # 可通过环境变量覆盖，或按需改成你的连接参数
     url = os.getenv("NEO4J_URL", "bolt://localhost:7687")
     username = os.getenv("NEO4J_USERNAME", "neo4j")
@@ -33,7 +47,16 @@ def main():
 
     try:
         print("[RUN] 开始为图数据库节点生成/写回嵌入...")
-        dg.add_embedding_for_graph()
+        kwargs = dict(batch_size=args.batch_size, workers=args.workers, dimension=args.dimension, force=args.force)
+        if args.use_async:
+            async def run():
+                try:
+                    await dg.aadd_embedding_for_graph(**kwargs)
+                finally:
+                    await dg.aclose()
+            asyncio.run(run())
+        else:
+            dg.add_embedding_for_graph(**kwargs)
         print("[DONE] 向量生成流程完成。")
     except Exception as e:
         print(f"[ERR] 生成嵌入过程中出错: {e}")
@@ -0,0 +1,155 @@
+#本地替身服务：确定性的 OpenAI 兼容 LLM 与嵌入接口，用于无 GPU / 无网络的基准测试
+
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+_BATCH_BLOCK_RE = re.compile(r"### 病历 (R\d+)\n")
+
+
+class StandInBackend:
+    """确定性的本地替身服务，同时提供 /v1/chat/completions 与 /v1/embeddings。
+
+    - LLM：推荐提示词返回病历中出现过的候选药物（JSON 数组；合并提示词返回按编号的 JSON 对象），
+      查询提示词返回出院诊断行；
+    - 嵌入：字符二元组哈希到固定维度并归一化，相同文本得到相同向量；
+    - 记录调用次数，可选地为每次调用增加固定延迟以模拟真实服务。
+    """
+
+    def __init__(self,
+                 candidate_names: Optional[List[str]] = None,
+                 embed_dim: int = 1024,
+                 llm_latency: float = 0.0,
+                 embed_latency: float = 0.0):
+        # 长名称优先，避免“二甲双胍”抢先匹配“二甲双胍缓释片”
+        self.candidate_names = sorted(set(candidate_names or []), key=len, reverse=True)
+        self.embed_dim = embed_dim
+        self.llm_latency = llm_latency
+        self.embed_latency = embed_latency
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self.reset_counters()
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self.counters: Dict[str, int] = {
+                "llm_calls": 0,
+                "llm_prompt_chars": 0,
+                "embedding_requests": 0,
+                "embedding_inputs": 0,
+            }
+
+    def _count(self, **deltas: int) -> None:
+        with self._lock:
+            for k, v in deltas.items():
+                self.counters[k] += v
+
+    # ---- 确定性响应 ----
+    def _mentioned_candidates(self, text: str) -> List[str]:
+        hits = []
+        for name in self.candidate_names:
+            pos = text.find(name)
+            if pos >= 0 and not any(name in other for _, other in hits):
+                hits.append((pos, name))
+        return [name for _, name in sorted(hits)]
+
+    def complete(self, prompt: str) -> str:
+        self._count(llm_calls=1, llm_prompt_chars=len(prompt))
+        if self.llm_latency:
+            time.sleep(self.llm_latency)
+        blocks = _BATCH_BLOCK_RE.split(prompt)
+        if len(blocks) > 1:
+            # 合并推荐提示词：按编号返回各病历的候选药物
+            answer = json.dumps({
+                rid: self._mentioned_candidates(
+                    block.split("病历信息：", 1)[-1].split("知识库检索内容：", 1)[0])[:15]
+                for rid, block in zip(blocks[1::2], blocks[2::2])
+            }, ensure_ascii=False)
+        elif "知识库检索内容" in prompt:
+            record = prompt.split("病历信息：", 1)[-1].split("知识库检索内容：", 1)[0]
+            answer = json.dumps(self._mentioned_candidates(record)[:15], ensure_ascii=False)
+        else:
+            m = re.search(r"出院诊断[\"']?\s*[:：]\s*(.+)", prompt)
+            answer = (m.group(1) if m else prompt.strip()[:100]).strip()[:200]
+        return f"<think>stand-in</think>{answer}"
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        self._count(embedding_requests=1, embedding_inputs=len(texts))
+        if self.embed_latency:
+            time.sleep(self.embed_latency)
+        vectors = []
+        for text in texts:
+            vec = [0.0] * self.embed_dim
+            grams = [text[i:i + 2] for i in range(max(1, len(text) - 1))]
+            for g in grams:
+                h = int.from_bytes(hashlib.md5(g.encode("utf-8")).digest()[:8], "little")
+                vec[h % self.embed_dim] += 1.0 if (h >> 32) & 1 else -1.0
+            norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+            vectors.append([v / norm for v in vec])
+        return vectors
+
+    # ---- HTTP ----
+    def _handler(self):
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, payload: dict) -> None:
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                req = json.loads(self.rfile.read(length) or b"{}")
+                if self.path.endswith("/chat/completions"):
+                    prompt = "\n".join(str(m.get("content", "")) for m in req.get("messages", []))
+                    text = backend.complete(prompt)
+                    self._send({
+                        "id": "stand-in",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": req.get("model", "stand-in"),
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": text}}],
+                        "usage": {"prompt_tokens": len(prompt), "completion_tokens": len(text),
+                                  "total_tokens": len(prompt) + len(text)},
+                    })
+                elif self.path.endswith("/embeddings"):
+                    inputs = req.get("input", [])
+                    inputs = [inputs] if isinstance(inputs, str) else list(inputs)
+                    vectors = backend.embed(inputs)
+                    self._send({
+                        "object": "list",
+                        "model": req.get("model", "stand-in"),
+                        "data": [{"object": "embedding", "index": i, "embedding": v} for i, v in enumerate(vectors)],
+                    })
+                else:
+                    self.send_error(404)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """在后台线程启动服务，返回 base url（不含 /v1）。"""
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://{host}:{self._server.server_port}"
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -2,7 +2,12 @@
 import os
 import sys
 import json
-from typing import TypedDict
+import math
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypedDict, Callable, Iterator, List, Optional, Set, Tuple, Union
 
 # 项目内部导入
 CURRENT_DIR = os.path.dirname(__file__)
@@ -10,8 +15,15 @@ PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))
 SRC_DIR = os.path.join(PROJECT_ROOT, "src")
 if SRC_DIR not in sys.path:
     sys.path.insert(0, SRC_DIR)
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(1, PROJECT_ROOT)  # wap 包位于项目根目录
 
 from raggraph import DrugGraph  # noqa: E402
+from checkpoint import CheckpointWriter, compact_checkpoint, load_completed_ids  # noqa: E402
+from tracing import get_tracer  # noqa: E402
+from query_builder import load_query_builder  # noqa: E402
+from util import batched  # noqa: E402
+from record_groups import RecordGrouper, RecordReuse  # noqa: E402
 from langgraph.graph import StateGraph, END  # noqa: E402
 
 
@@ -26,38 +38,68 @@ class MedicalState(TypedDict):
     retrieved_info: str
     # 生成的建议（JSON字符串）
     advice_json: str
+    # 相似病历分组的代表（空字符串表示不复用）
+    group_key: str
 
 
 dg = DrugGraph(url="bolt://localhost:7687", username="neo4j", password="12345678")
+# 相似病历复用（--group-threshold > 0 时创建）：同组病历共享 query 与检索结果
+record_reuse: Optional[RecordReuse] = None
 
 
-def ask_query(state: MedicalState) -> dict:
-    """使用 TXT 的内容调用 ask 函数，生成 query_text。"""
+async def shared(state: MedicalState, kind: str, compute: Callable) -> str:
+    """启用分组复用时，同组病历的同类结果只计算一次。"""
+    group = state.get("group_key", "")
+    if record_reuse is None or not group:
+        return await compute()
+    return await record_reuse.get_or_compute(kind, group, compute)
+
+
+async def ask_query(state: MedicalState) -> dict:
+    """使用 TXT 的内容调用 ask 函数（或由病历 JSON 本地生成），得到 query_text。"""
     src = state.get("query_src", "")
-    query_text = dg.ask_query_prompt(src)
+    query_text = await shared(state, "query", lambda: dg.abuild_query(src, state.get("json_text", "")))
     return {"query_text": query_text}
 
 
-def retrieve_info(state: MedicalState) -> dict:
+async def retrieve_info(state: MedicalState) -> dict:
     """使用生成的 query_text 进行向量检索。"""
     query_text = state.get("query_text", "")
-    retrieved_info = dg.retrieve_medical_info(query_text)
+    retrieved_info = await shared(state, "retrieval",
+                                  lambda: dg.aretrieve_context(query_text, state.get("json_text", "")))
     return {"retrieved_info": retrieved_info}
 
 
-def gen_advice(state: MedicalState) -> dict:
+async def gen_advice(state: MedicalState) -> dict:
     """使用 JSON 的内容和检索信息生成建议。"""
     json_text = state.get("json_text", "")
     retrieved_info = state.get("retrieved_info", "")
-    advice_json = dg.query_medical_advice(json_text, retrieved_info=retrieved_info)
+    advice_json = await dg.aquery_medical_advice(json_text, retrieved_info=retrieved_info)
     return {"advice_json": advice_json}
 
 
-def build_graph() -> StateGraph:
+def traced(name: str, fn: Callable) -> Callable:
+    """给节点加上名为 node.<name> 的追踪 span，并记录输入输出的文本长度。"""
+    async def wrapper(state: MedicalState) -> dict:
+        with get_tracer().span(f"node.{name}") as sp:
+            out = await fn(state)
+            if sp is not None:
+                sp.set(output_chars=sum(len(v) for v in out.values() if isinstance(v, str)))
+            return out
+    return wrapper
+
+
+def build_graph(node_wrapper: Optional[Callable] = None) -> StateGraph:
+    """构建流程图；各节点默认带追踪 span，node_wrapper(name, fn) 可再叠加计时等包装。"""
+    outer = node_wrapper or (lambda name, fn: fn)
+
+    def wrap(name: str, fn: Callable) -> Callable:
+        return outer(name, traced(name, fn))
+
     g = StateGraph(MedicalState)
-    g.add_node("ask_query", ask_query)
-    g.add_node("retrieve_info", retrieve_info)
-    g.add_node("gen_advice", gen_advice)
+    g.add_node("ask_query", wrap("ask_query", ask_query))
+    g.add_node("retrieve_info", wrap("retrieve_info", retrieve_info))
+    g.add_node("gen_advice", wrap("gen_advice", gen_advice))
     g.set_entry_point("ask_query")
     g.add_edge("ask_query", "retrieve_info")
     g.add_edge("retrieve_info", "gen_advice")
@@ -65,67 +107,429 @@ def build_graph() -> StateGraph:
     return g.compile()
 
 
-def main():
-    txt_path = "/home/lx/drug-ragLLM/outputs/queries.txt"  # TXT：每行作为 ask 的输入
-    jsonl_path = "/home/lx/drug-ragLLM/data/CDrugRed_test-A.jsonl"  # JSONL：每行作为 advice 的输入
-    out_path = "/home/lx/drug-ragLLM/outputs/results.txt"
-
-    if not os.path.isfile(txt_path):
-        raise FileNotFoundError(f"未找到输入文件: {txt_path}")
-    if not os.path.isfile(jsonl_path):
-        raise FileNotFoundError(f"未找到输入文件: {jsonl_path}")
-    os.makedirs(os.path.dirname(out_path), exist_ok=True)
-
-    graph = build_graph()
-
-    total = 0
-    ok = 0
-    results = []
+def iter_records(txt_path: str, jsonl_path: str) -> Iterator[Tuple[int, str, str]]:
+    """逐行读取 TXT 与 JSONL，产出 (行号, query_src, json_text)，跳过空行。"""
     with open(txt_path, "r", encoding="utf-8") as ft, open(jsonl_path, "r", encoding="utf-8") as fj:
         for idx, (t_line, j_line) in enumerate(zip(ft, fj), start=1):
             t_line = t_line.strip()
             j_line = j_line.strip()
             if not t_line or not j_line:
                 continue
-            total += 1
-            initial_state: MedicalState = {
-                "query_src": t_line,
-                "json_text": j_line,
-                "query_text": "",
-                "retrieved_info": "",
-                "advice_json": "",
-            }
+            yield idx, t_line, j_line
+
+
+def case_id_of(idx: int, j_line: str) -> str:
+    """从JSONL中提取就诊标识作为case_id。"""
+    try:
+        json_data = json.loads(j_line)
+        return json_data.get("就诊标识", f"line-{idx}")
+    except Exception:
+        return f"line-{idx}"
+
+
+def parse_drugs(advice_json: str) -> List[str]:
+    """解析药物列表，无法解析时返回空列表。"""
+    try:
+        drugs = json.loads(advice_json)
+        if not isinstance(drugs, list):
+            drugs = []
+    except Exception:
+        drugs = []
+    return drugs
+
+
+def group_records(records: Iterator[Tuple[int, str, str]], reuse: RecordReuse) -> Iterator[Tuple[int, str, str]]:
+    """预处理：按输入顺序为每条病历分组（同一患者或 MinHash 相似度达到阈值的病历共用代表）。"""
+    for idx, t_line, j_line in records:
+        reuse.assign(str(case_id_of(idx, j_line)), j_line)
+        yield idx, t_line, j_line
+
+
+def new_state(t_line: str, j_line: str, group_key: str = "") -> MedicalState:
+    return {
+        "query_src": t_line,
+        "json_text": j_line,
+        "query_text": "",
+        "retrieved_info": "",
+        "advice_json": "",
+        "group_key": group_key,
+    }
+
+
+def group_key_of(idx: int, j_line: str) -> str:
+    return record_reuse.group_of(str(case_id_of(idx, j_line))) if record_reuse is not None else ""
+
+
+def log_result(res: dict) -> None:
+    if res["error"]:
+        print(f"# 处理 {res['ID']} 失败: {res['error']}")
+    else:
+        print(f"# 处理 {res['ID']}: {len(res['prediction'])} 个药物 ({res['latency']:.2f}s)")
+
+
+async def process_record(graph, idx: int, t_line: str, j_line: str) -> dict:
+    """处理单条病历；异常只影响当前记录，返回结果中带上耗时与错误信息。"""
+    case_id = case_id_of(idx, j_line)
+    initial_state = new_state(t_line, j_line, group_key_of(idx, j_line))
+    start = time.perf_counter()
+    error: Optional[str] = None
+    try:
+        with get_tracer().span("record", case_id=str(case_id)) as sp:
+            result = await graph.ainvoke(initial_state)
+            drugs = parse_drugs(result.get("advice_json", "[]"))
+            if sp is not None:
+                sp.set(predicted=len(drugs))
+    except Exception as e:
+        drugs = []
+        error = f"{type(e).__name__}: {e}"
+    return {
+        "ID": case_id,
+        "prediction": drugs,
+        "latency": time.perf_counter() - start,
+        "error": error,
+    }
+
+
+async def run_batch(graph, records: Iterator[Tuple[int, str, str]], concurrency: int,
+                    on_result: Callable[[dict], None]) -> List[float]:
+    """并发处理病历，同时在途的记录数不超过 concurrency。
+
+    每条结果产生后立即交给 on_result（例如写入检查点），不在内存中累积；
+    返回各记录的耗时用于统计。
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    pending: Set[asyncio.Task] = set()
+    latencies: List[float] = []
+
+    async def worker(idx: int, t_line: str, j_line: str) -> None:
+        try:
+            res = await process_record(graph, idx, t_line, j_line)
+        finally:
+            semaphore.release()
+        latencies.append(res["latency"])
+        on_result(res)
+        log_result(res)
+
+    for idx, t_line, j_line in records:
+        # 先占用名额再创建任务，避免一次性为全部输入创建协程
+        await semaphore.acquire()
+        task = asyncio.create_task(worker(idx, t_line, j_line))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    if pending:
+        await asyncio.gather(*pending)
+    return latencies
+
+
+async def run_staged(records: Iterator[Tuple[int, str, str]], concurrency: int, batch_size: int,
+                     on_result: Callable[[dict], None], node_wrapper: Optional[Callable] = None,
+                     advice_batch: int = 1) -> List[float]:
+    """分阶段批处理：每批记录先并发生成全部 query，再用一次批量检索（一次嵌入、一次打分）
+    取回整批的检索结果，最后并发生成建议。batch_size<=0 时整份输入作为一批。
+    advice_batch>1 时每 advice_batch 条病历合并为一次推荐调用（共享固定提示词前缀）。
+
+    单条记录在任一阶段失败只影响该记录；记录耗时为所在批次的总耗时。
+    """
+    outer = node_wrapper or (lambda name, fn: fn)
+    ask_node = outer("ask_query", traced("ask_query", ask_query))
+    advice_node = outer("gen_advice", traced("gen_advice", gen_advice))
+
+    async def retrieve_many(states: List[MedicalState]) -> List[Union[str, BaseException]]:
+        with get_tracer().span("node.retrieve_info_many", inputs=len(states)):
+            if record_reuse is None:
+                return await dg.aretrieve_context_many([st["query_text"] for st in states],
+                                                       [st["json_text"] for st in states])
+            # 每组只有领取到计算的病历参与批量检索，其余等待同组结果
+            waiting = {}
+            own = []
+            for i, st in enumerate(states):
+                fut = record_reuse.claim("retrieval", st["group_key"])
+                if fut is None:
+                    own.append(i)
+                else:
+                    waiting[i] = fut
+            results: List[Union[str, BaseException]] = [""] * len(states)
             try:
-                result = graph.invoke(initial_state)
-                advice_json = result.get("advice_json", "[]")
-                # 解析药物列表
+                infos = await dg.aretrieve_context_many([states[i]["query_text"] for i in own],
+                                                        [states[i]["json_text"] for i in own]) if own else []
+            except BaseException as e:
+                for i in own:
+                    record_reuse.resolve("retrieval", states[i]["group_key"], error=e)
+                raise
+            for i, info in zip(own, infos):
+                results[i] = info
+                record_reuse.resolve("retrieval", states[i]["group_key"], result=info)
+            # 同组代表检索失败时各自重新检索，仍失败的只记为该条病历失败
+            for i, fut in waiting.items():
                 try:
-                    drugs = json.loads(advice_json)
-                    if not isinstance(drugs, list):
-                        drugs = []
+                    results[i] = await record_reuse.wait("retrieval", fut)
                 except Exception:
-                    drugs = []
-            except Exception:
-                drugs = []
-            
-            # 从JSONL中提取就诊标识作为case_id
+                    try:
+                        results[i] = await dg.aretrieve_context(states[i]["query_text"], states[i]["json_text"])
+                    except Exception as e:
+                        results[i] = e
+            return results
+
+    retrieve_node = outer("retrieve_info", retrieve_many)
+
+    async def advice_many(states: List[MedicalState]) -> List[str]:
+        with get_tracer().span("node.gen_advice_batch", inputs=len(states)):
+            return await dg.aquery_medical_advice_many([st["json_text"] for st in states],
+                                                       [st["retrieved_info"] for st in states])
+
+    advice_many_node = outer("gen_advice", advice_many)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    latencies: List[float] = []
+
+    async def bounded(fn: Callable, state: MedicalState) -> dict:
+        async with semaphore:
+            return await fn(state)
+
+    async def run_stage(fn: Callable, states: List[MedicalState], live: List[int], errors: List[Optional[str]]) -> None:
+        outs = await asyncio.gather(*(bounded(fn, states[i]) for i in live), return_exceptions=True)
+        for i, out in zip(live, outs):
+            if isinstance(out, BaseException):
+                errors[i] = f"{type(out).__name__}: {out}"
+            else:
+                states[i].update(out)
+
+    async def run_advice_groups(states: List[MedicalState], live: List[int], errors: List[Optional[str]]) -> None:
+        groups = list(batched(live, advice_batch))
+
+        async def one(group: List[int]) -> List[str]:
+            async with semaphore:
+                return await advice_many_node([states[i] for i in group])
+
+        outs = await asyncio.gather(*(one(g) for g in groups), return_exceptions=True)
+        for group, out in zip(groups, outs):
+            for pos, i in enumerate(group):
+                item = out if isinstance(out, BaseException) else out[pos]
+                if isinstance(item, BaseException):
+                    errors[i] = f"{type(item).__name__}: {item}"
+                else:
+                    states[i]["advice_json"] = item
+
+    async def flush(batch: List[Tuple[int, str, str]]) -> None:
+        start = time.perf_counter()
+        states = [new_state(t_line, j_line, group_key_of(idx, j_line)) for idx, t_line, j_line in batch]
+        errors: List[Optional[str]] = [None] * len(batch)
+        await run_stage(ask_node, states, list(range(len(batch))), errors)
+        live = [i for i in range(len(batch)) if errors[i] is None]
+        if live:
             try:
-                json_data = json.loads(j_line)
-                case_id = json_data.get("就诊标识", f"line-{idx}")
-            except Exception:
-                case_id = f"line-{idx}"
-            results.append({
-                "ID": case_id,
-                "prediction": drugs
-            })
-            ok += 1
-            print(f"# 处理 {case_id}: {len(drugs)} 个药物")
-
-    # 输出为JSON格式
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
-    print(f"完成：共处理 {total} 行，已写出 {ok} 行到 {out_path}")
+                infos = await retrieve_node([states[i] for i in live])
+                for i, info in zip(live, infos):
+                    if isinstance(info, BaseException):
+                        errors[i] = f"{type(info).__name__}: {info}"
+                    else:
+                        states[i]["retrieved_info"] = info
+            except Exception as e:
+                for i in live:
+                    errors[i] = f"{type(e).__name__}: {e}"
+        todo = [i for i in live if errors[i] is None]
+        if advice_batch > 1:
+            await run_advice_groups(states, todo, errors)
+        else:
+            await run_stage(advice_node, states, todo, errors)
+        elapsed = time.perf_counter() - start
+        for (idx, _, j_line), state, error in zip(batch, states, errors):
+            res = {
+                "ID": case_id_of(idx, j_line),
+                "prediction": [] if error else parse_drugs(state.get("advice_json") or "[]"),
+                "latency": elapsed,
+                "error": error,
+            }
+            latencies.append(elapsed)
+            on_result(res)
+            log_result(res)
+
+    batch: List[Tuple[int, str, str]] = []
+    for record in records:
+        batch.append(record)
+        if 0 < batch_size <= len(batch):
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+    return latencies
+
+
+def percentile(values: List[float], q: float) -> float:
+    """最近秩法分位数。"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100.0 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def print_trace_summary() -> None:
+    """按 span 名称打印次数、平均耗时以及 token / 缓存命中等合计。"""
+    for name, st in get_tracer().summary().items():
+        extras = ", ".join(f"{k}={v}" for k, v in st.items()
+                           if k not in ("kind", "count", "errors", "total_s", "mean_ms"))
+        print(f"   🔎 {name}: {st['count']} 次，均值 {st['mean_ms']}ms，错误 {st['errors']}"
+              + (f"，{extras}" if extras else ""))
+
+
+def report(latencies: List[float], failed: int, elapsed: float) -> dict:
+    stats = {
+        "records": len(latencies),
+        "failed": failed,
+        "elapsed_s": round(elapsed, 3),
+        "records_per_s": round(len(latencies) / elapsed, 3) if elapsed > 0 else 0.0,
+        "latency_p50_s": round(percentile(latencies, 50), 3),
+        "latency_p95_s": round(percentile(latencies, 95), 3),
+    }
+    print(
+        f"⏱️ 吞吐 {stats['records_per_s']} 条/s，单条延迟 p50={stats['latency_p50_s']}s "
+        f"p95={stats['latency_p95_s']}s，失败 {stats['failed']} 条"
+    )
+    return stats
+
+
+def report_reuse(reuse: RecordReuse) -> dict:
+    """打印分组与复用情况，并按当前配置估算节省的 LLM 调用与嵌入输入数。"""
+    stats = reuse.stats()
+    queries, retrievals = stats.get("reused_query", 0), stats.get("reused_retrieval", 0)
+    # lexical query 不调用模型；纯 BM25 或纯图谱检索不请求嵌入
+    stats["saved_llm_calls"] = queries if dg.query_mode == "llm" else 0
+    dense = os.getenv("SEARCH_MODE", "dense") != "bm25" and dg.retrieval_mode in ("vector", "both")
+    stats["saved_embedding_inputs"] = retrievals if dense else 0
+    print(
+        f"♻️ 相似病历分组：{stats['records']} 条分为 {stats['groups']} 组（{stats['merged']} 条并入已有组），"
+        f"复用 query {queries} 次、检索结果 {retrievals} 次，"
+        f"节省 LLM 调用 {stats['saved_llm_calls']} 次、嵌入输入 {stats['saved_embedding_inputs']} 条"
+    )
+    return stats
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="批量生成出院带药推荐")
+    parser.add_argument("--txt", default="/home/lx/drug-ragLLM/outputs/queries.txt",
+                        help="TXT：每行作为 ask 的输入")
+    parser.add_argument("--jsonl", default="/home/lx/drug-ragLLM/data/CDrugRed_test-A.jsonl",
+                        help="JSONL：每行作为 advice 的输入")
+    parser.add_argument("--out", default="/home/lx/drug-ragLLM/outputs/results.txt")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("WORK_CONCURRENCY", "8")),
+                        help="同时在途的病历数，1 表示逐条串行")
+    parser.add_argument("--checkpoint", default=None,
+                        help="JSONL 检查点路径，默认 <out>.ckpt.jsonl")
+    parser.add_argument("--fresh", action="store_true",
+                        help="忽略并清空已有检查点，从头开始")
+    parser.add_argument("--no-llm-cache", action="store_true",
+                        help="不读取 LLM 响应缓存，强制重新生成（新结果仍写回缓存）")
+    parser.add_argument("--fsync-every", type=int, default=20,
+                        help="检查点每写入多少条执行一次 fsync")
+    parser.add_argument("--retrieval", choices=("vector", "graph", "both"), default=None,
+                        help="检索来源：向量库 / 按出院诊断查图谱关联药物 / 两者（缺省取环境变量 RETRIEVAL_MODE）")
+    parser.add_argument("--query-mode", choices=("llm", "lexical"), default=None,
+                        help="检索 query 来源：LLM 生成 / 由出院诊断、主诉与诊疗要点本地生成（缺省取环境变量 QUERY_MODE）")
+    parser.add_argument("--query-stats", default=os.getenv("QUERY_STATS_PATH", "./cache/query_stats.json"),
+                        help="lexical 模式的语料统计缓存（按输入 JSONL 计算，文件变化时自动重算）")
+    parser.add_argument("--search-mode", choices=("dense", "bm25", "hybrid"), default=None,
+                        help="向量库检索方式：稠密 / BM25 / 两者 RRF 融合（缺省取环境变量 SEARCH_MODE）")
+    parser.add_argument("--staged", action="store_true",
+                        help="分阶段批处理：整批生成 query 后一次批量检索，再整批生成建议")
+    parser.add_argument("--stage-batch", type=int, default=64,
+                        help="分阶段模式下每批的病历数（0 表示整份输入一批）")
+    parser.add_argument("--advice-batch", type=int, default=int(os.getenv("ADVICE_BATCH", "1")),
+                        help="每次推荐调用合并的病历数（>1 时启用分阶段批处理；解析失败的病历单独重试）")
+    parser.add_argument("--group-threshold", type=float, default=float(os.getenv("GROUP_THRESHOLD", "0")),
+                        help="相似病历复用：同一患者出院诊断/主诉/既往史的 MinHash 估计 Jaccard 相似度不低于该值"
+                             "（不同患者需不低于 max(该值, 0.85)）的病历共用 query 与检索结果，0 表示关闭")
+    parser.add_argument("--trace-out", default=None,
+                        help="将各 span 明细写为 JSONL（节点、LLM、嵌入、检索调用）")
+    parser.add_argument("--metrics-out", default=None,
+                        help="将聚合指标写为 Prometheus 文本格式")
+    return parser.parse_args(argv)
+
+
+async def amain(args: argparse.Namespace) -> None:
+    txt_path, jsonl_path, out_path = args.txt, args.jsonl, args.out
+    if not os.path.isfile(txt_path):
+        raise FileNotFoundError(f"未找到输入文件: {txt_path}")
+    if not os.path.isfile(jsonl_path):
+        raise FileNotFoundError(f"未找到输入文件: {jsonl_path}")
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    ckpt_path = args.checkpoint or out_path + ".ckpt.jsonl"
+    if args.fresh and os.path.exists(ckpt_path):
+        os.remove(ckpt_path)
+
+    # 断点续跑：跳过检查点中已成功完成的就诊标识
+    done_ids = load_completed_ids(ckpt_path)
+    if done_ids:
+        print(f"♻️ 检查点 {ckpt_path} 中已有 {len(done_ids)} 条完成记录，将跳过")
+    records = (
+        (idx, t_line, j_line)
+        for idx, t_line, j_line in iter_records(txt_path, jsonl_path)
+        if str(case_id_of(idx, j_line)) not in done_ids
+    )
+
+    # 同步检索在线程池中执行，线程数与并发度匹配
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=max(4, args.concurrency)))
+
+    dg.llm.cache_bypass = args.no_llm_cache
+    if args.retrieval:
+        dg.retrieval_mode = args.retrieval
+    if args.search_mode:
+        # 检索器在 warm_up 时才构建，此处设置即可生效
+        os.environ["SEARCH_MODE"] = args.search_mode
+    if args.query_mode:
+        dg.query_mode = args.query_mode
+    if dg.query_mode == "lexical":
+        dg.query_builder = load_query_builder([jsonl_path], dg.candidate_names, stats_path=args.query_stats)
+    if args.advice_batch > 1 and not args.staged:
+        print(f"ℹ️ 合并推荐（--advice-batch {args.advice_batch}）需要分阶段批处理，已启用 --staged")
+        args.staged = True
+    global record_reuse
+    if args.group_threshold > 0:
+        record_reuse = RecordReuse(RecordGrouper(threshold=args.group_threshold))
+        records = group_records(records, record_reuse)
+    graph = build_graph()
+    # 预热共享检索器，避免首条病历承担向量库初始化开销
+    dg.warm_up()
+
+    failed = 0
+
+    def on_result(res: dict) -> None:
+        nonlocal failed
+        failed += 1 if res["error"] else 0
+        writer.write({"ID": res["ID"], "prediction": res["prediction"], "error": res["error"]})
+
+    start = time.perf_counter()
+    with CheckpointWriter(ckpt_path, fsync_every=args.fsync_every) as writer:
+        if args.staged:
+            latencies = await run_staged(records, args.concurrency, args.stage_batch, on_result,
+                                         advice_batch=args.advice_batch)
+        else:
+            latencies = await run_batch(graph, records, args.concurrency, on_result)
+    elapsed = time.perf_counter() - start
+
+    # 按输入顺序把检查点整理为提交格式
+    order = (case_id_of(idx, j_line) for idx, _, j_line in iter_records(txt_path, jsonl_path))
+    written = compact_checkpoint(ckpt_path, out_path, order)
+    print(f"完成：本次处理 {len(latencies)} 行（跳过 {len(done_ids)} 行），共写出 {written} 行到 {out_path}")
+    report(latencies, failed, elapsed)
+    if record_reuse is not None:
+        report_reuse(record_reuse)
+    if dg.llm.response_cache is not None:
+        print(f"🗃️ LLM 响应缓存: {dg.llm.response_cache.stats()}")
+    await dg.aclose()
+    tracer = get_tracer()
+    if tracer.enabled:
+        print_trace_summary()
+        if args.trace_out:
+            n = tracer.export_jsonl(args.trace_out)
+            print(f"🧭 已写出 {n} 个 span 到 {args.trace_out}")
+        if args.metrics_out:
+            tracer.export_prometheus(args.metrics_out)
+            print(f"📈 指标已写出到 {args.metrics_out}")
+
+
+def main(argv: Optional[List[str]] = None):
+    asyncio.run(amain(parse_args(argv)))
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
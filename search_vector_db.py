@@ -3,13 +3,14 @@
 """
 import sys
 from pathlib import Path
-from langchain_ollama.embeddings import OllamaEmbeddings
-from wap.vector_retriver import VectorDatabaseFactory
 
-# 确保可以从父目录导入模块
+# 确保可以从父目录及 src 目录导入模块
 current_dir = Path(__file__).parent
 project_root = current_dir
 sys.path.insert(0, str(project_root))
+sys.path.insert(0, str(project_root / "src"))
+
+from retriever_registry import RetrieverKey, get_registry  # noqa: E402
 
 
 def search_drug_info(query: str, top_k: int = 3):
@@ -20,43 +21,33 @@ def search_drug_info(query: str, top_k: int = 3):
         query (str): 要搜索的查询字符串。
         top_k (int): 要返回的最相关结果的数量。
     """
-    # 1. 设置与存储时相同的参数
-    VECTOR_DB_PATH = "./chroma_store"
-    COLLECTION_NAME = "drug_info"
-    EMBEDDING_MODEL = "bge-m3"
-    OLLAMA_BASE_URL = "http://localhost:11434"
+    # 1. 设置与存储时相同的参数（可通过 VECTOR_DB_PATH 等环境变量覆盖）
+    key = RetrieverKey.create()
+    registry = get_registry()
 
-    # 2. 初始化嵌入模型
-    print("初始化嵌入模型...")
+    # 2. 从共享注册表获取向量数据库实例（同一进程内多次调用只加载一次）
+    print(f"正在加载向量数据库 from {key.vector_db_path}...")
     try:
-        embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL, base_url=OLLAMA_BASE_URL)
+        vector_db = registry.get(key)
     except Exception as e:
         print(f"❌ 初始化嵌入模型失败: {e}")
         print("请确保Ollama服务正在运行并且可以访问。")
         return
 
-    # 3. 创建向量数据库实例以加载现有数据库
-    print(f"正在加载向量数据库 from {VECTOR_DB_PATH}...")
-    vector_db = VectorDatabaseFactory.create(
-        embeddings=embeddings,
-        vector_db_path=VECTOR_DB_PATH,
-        collection_name=COLLECTION_NAME
-    )
-
     # 检查数据库是否成功加载
-    stats = vector_db.get_stats()
+    stats = registry.stats(key)
     if stats.get("status") != "initialized" or stats.get("documents_count", 0) == 0:
         print("❌ 数据库未初始化或为空。请先运行脚本将数据存入数据库。")
         return
     
     print(f"数据库加载成功。包含 {stats['documents_count']} 个文档。")
 
-    # 4. 执行搜索
+    # 3. 执行搜索
     print(f"\n--- 开始搜索 ---")
     print(f"查询: {query}")
     results = vector_db.search(query, top_k=top_k)
 
-    # 5. 显示结果
+    # 4. 显示结果
     if not results:
         print("未找到相关结果。")
         return
@@ -0,0 +1,104 @@
+"""
+批处理检查点
+
+每条病历的结果在产生后立即追加写入 JSONL 检查点（按条数/时间批量 fsync），
+重启时跳过已成功完成的就诊标识；最后再把检查点整理成提交用的 JSON 数组。
+"""
+
+import json
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+
+class CheckpointWriter:
+    """追加写入检查点文件，每 fsync_every 条或每 fsync_interval 秒落盘一次。"""
+
+    def __init__(self, path: str, fsync_every: int = 20, fsync_interval: float = 2.0):
+        self.path = path
+        self.fsync_every = max(1, fsync_every)
+        self.fsync_interval = fsync_interval
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._f = open(path, "a", encoding="utf-8")
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def write(self, record: dict) -> None:
+        self._f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._f.flush()
+        self._pending += 1
+        if self._pending >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self) -> None:
+        if self._pending:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        if not self._f.closed:
+            self.sync()
+            self._f.close()
+
+    def __enter__(self) -> "CheckpointWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def iter_checkpoint(path: str) -> Iterable[dict]:
+    """逐行读取检查点；中断时可能残留的半行会被跳过。"""
+    if not os.path.isfile(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except Exception:
+                continue
+            if isinstance(rec, dict) and "ID" in rec:
+                yield rec
+
+
+def load_completed_ids(path: str) -> Set[str]:
+    """已成功完成的就诊标识集合（失败的记录会在重启后重试）。"""
+    return {str(rec["ID"]) for rec in iter_checkpoint(path) if not rec.get("error")}
+
+
+def compact_checkpoint(path: str, out_path: str, order: Optional[Iterable[str]] = None) -> int:
+    """将检查点整理为提交格式 [{"ID": ..., "prediction": [...]}]。
+
+    同一 ID 多次出现时以最后一次成功结果为准；order 给出输入顺序，
+    检查点中不在 order 里的 ID 追加在末尾。返回写出的条数。
+    """
+    latest: Dict[str, dict] = {}
+    for rec in iter_checkpoint(path):
+        key = str(rec["ID"])
+        if key not in latest or not rec.get("error") or latest[key].get("error"):
+            latest[key] = rec
+    ordered: List[str] = []
+    seen: Set[str] = set()
+    for key in (order or []):
+        key = str(key)
+        if key in latest and key not in seen:
+            ordered.append(key)
+            seen.add(key)
+    ordered.extend(k for k in latest if k not in seen)
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        for i, key in enumerate(ordered):
+            item = {"ID": latest[key]["ID"], "prediction": latest[key].get("prediction") or []}
+            body = json.dumps(item, ensure_ascii=False, indent=2)
+            f.write("  " + body.replace("\n", "\n  ") + (",\n" if i < len(ordered) - 1 else "\n"))
+        f.write("]\n")
+    os.replace(tmp_path, out_path)
+    return len(ordered)
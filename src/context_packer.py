@@ -0,0 +1,164 @@
+"""
+检索结果的上下文打包
+
+把向量检索取回的药物文档压缩为放入推荐提示词的知识库文本：
+- 按相对得分（相对第一名）与绝对得分过滤低分文档（RRF 融合分只反映名次，不做得分过滤），
+  同名药物只保留得分最高的一条；
+- 每个药物只保留对选药最关键的字段（治疗病症、禁忌症、相互作用），预算有余时再补充次要字段，
+  单个字段过长时截断；同一药物内与已输出字段高度重复的字段值不再重复输出（不同药物的
+  字段即使相同也各自保留，同类药物常共用适应症、禁忌症文本，缺失会被理解为没有）；
+- 以 estimate_tokens 估计 token 数，整体不超过配置的预算（先保证药物覆盖面，再补充细节）。
+"""
+
+import os
+import re
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from util import estimate_tokens
+
+
+PRIMARY_FIELDS = ("治疗病症", "禁忌症", "相互作用", "药物相互作用")
+SECONDARY_FIELDS = ("适用人群", "特殊人群", "注意事项", "严重不良反应", "常见不良反应", "副作用", "相关症状")
+
+_FIELD_RE = re.compile(r"([^；“”。]{1,12})为“(.*?)”", re.S)
+_NAME_FIELD = "药物名称"
+# 不提供信息的字段值
+_EMPTY_VALUES = {"无", "未知", "暂无", "不详", "尚不明确", "无特殊"}
+
+
+def parse_fields(text: str) -> Tuple[Optional[str], Dict[str, str]]:
+    """把 render_drug_text 渲染的文本还原为 (药物名称, {字段名: 值})；无法解析时名称为 None。"""
+    fields: Dict[str, str] = {}
+    for m in _FIELD_RE.finditer(text or ""):
+        key, value = m.group(1).strip(), m.group(2).strip()
+        if value and value not in _EMPTY_VALUES and key not in fields:
+            fields[key] = value
+    return fields.pop(_NAME_FIELD, None), fields
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """按估计 token 数截断（超出时以省略号结尾）。"""
+    if max_tokens <= 0 or estimate_tokens(text) <= max_tokens:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) + 1 <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo] + "…"
+
+
+def _bigrams(text: str) -> Set[str]:
+    return {text[i:i + 2] for i in range(len(text) - 1)} if len(text) > 1 else {text}
+
+
+class ContextPacker:
+    """按 token 预算打包检索结果"""
+
+    def __init__(self,
+                 token_budget: int = 1200,
+                 max_field_tokens: int = 80,
+                 relative_cutoff: float = 0.5,
+                 min_score: Optional[float] = None,
+                 dedup_threshold: float = 0.8,
+                 primary_fields: Sequence[str] = PRIMARY_FIELDS,
+                 secondary_fields: Sequence[str] = SECONDARY_FIELDS):
+        self.token_budget = token_budget
+        self.max_field_tokens = max_field_tokens
+        self.relative_cutoff = relative_cutoff
+        self.min_score = min_score
+        self.dedup_threshold = dedup_threshold
+        self.primary_fields = tuple(primary_fields)
+        self.secondary_fields = tuple(secondary_fields)
+
+    @classmethod
+    def from_env(cls) -> Optional["ContextPacker"]:
+        """由环境变量创建；CONTEXT_PACKING=0 时返回 None（保留全文拼接）。"""
+        if os.getenv("CONTEXT_PACKING", "1") == "0":
+            return None
+        min_score = os.getenv("CONTEXT_MIN_SCORE")
+        return cls(
+            token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200")),
+            max_field_tokens=int(os.getenv("CONTEXT_FIELD_TOKENS", "80")),
+            relative_cutoff=float(os.getenv("CONTEXT_RELATIVE_SCORE", "0.5")),
+            min_score=float(min_score) if min_score else None,
+        )
+
+    def _select(self, docs: List[Tuple[str, Optional[float]]],
+                rank_based: bool = False) -> List[Tuple[str, Optional[float]]]:
+        """得分过滤：低于 min_score 或低于 第一名得分 × relative_cutoff 的文档丢弃（无得分时全部保留）。
+        rank_based 时得分为 RRF 融合分：只被一路检索命中的文档（≤1/(k+1)）必然低于两路都命中者的一半，
+        按得分比例过滤会丢掉混合检索要找回的 BM25 精确命中，因此全部保留，由 token 预算按名次截断。"""
+        scored = [s for _, s in docs if s is not None]
+        if not scored or rank_based:
+            return docs
+        floor = max(scored) * self.relative_cutoff if max(scored) > 0 else None
+        kept = []
+        for text, score in docs:
+            if score is not None:
+                if self.min_score is not None and score < self.min_score:
+                    continue
+                if floor is not None and score < floor:
+                    continue
+            kept.append((text, score))
+        return kept
+
+    def pack(self, docs: List[Tuple[str, Optional[float]]], rank_based: bool = False) -> str:
+        """docs 为按相关性排序的 (文本, 得分)；返回打包后的知识库文本。rank_based 表示得分为 RRF 融合分。"""
+        entries: List[Dict[str, Any]] = []
+        seen_names: Set[str] = set()
+        for text, _ in self._select(docs, rank_based):
+            name, fields = parse_fields(text)
+            if name is None:
+                # 非药物模板文本（例如图谱节点）整体作为一个字段
+                name, fields = "", {"内容": str(text).strip()}
+            if name and name in seen_names:
+                continue
+            seen_names.add(name)
+            entries.append({"name": name, "fields": fields, "parts": [], "emitted": []})
+
+        used = 0
+
+        def duplicate(entry: Dict[str, Any], value: str) -> bool:
+            """与同一药物已输出的字段值高度重复（二元组 Jaccard 相似度达到阈值）。"""
+            grams = _bigrams(value)
+            for other in entry["emitted"]:
+                if len(grams & other) / max(1, len(grams | other)) >= self.dedup_threshold:
+                    return True
+            return False
+
+        def line_of(entry: Dict[str, Any], parts: List[str]) -> str:
+            head = f"【{entry['name']}】" if entry["name"] else ""
+            return head + "；".join(parts)
+
+        def try_add(entry: Dict[str, Any], key: str) -> bool:
+            """把字段追加到条目中；超出预算返回 False。"""
+            nonlocal used
+            value = entry["fields"].get(key)
+            if not value:
+                return True
+            value = truncate_tokens(value, self.max_field_tokens)
+            if duplicate(entry, value):
+                return True
+            part = value if key == "内容" else f"{key}：{value}"
+            before = estimate_tokens(line_of(entry, entry["parts"])) + 1 if entry["parts"] else 0
+            after = estimate_tokens(line_of(entry, entry["parts"] + [part])) + 1
+            if used - before + after > self.token_budget:
+                return False
+            used += after - before
+            entry["parts"].append(part)
+            entry["emitted"].append(_bigrams(value))
+            return True
+
+        # 第一轮保证覆盖面：每个药物的名称与关键字段；第二轮用剩余预算补充次要字段
+        for keys in (self.primary_fields + ("内容",), self.secondary_fields):
+            for entry in entries:
+                if keys is self.secondary_fields and not entry["parts"]:
+                    continue
+                for key in keys:
+                    if not try_add(entry, key):
+                        break
+        lines = [line_of(e, e["parts"]) for e in entries if e["parts"]]
+        return "\n".join(lines)
@@ -0,0 +1,213 @@
+"""
+候选药物提及识别
+
+以候选药物名称（及别名、去剂型/去盐形式的通用名词干）构建 Aho–Corasick 多模式自动机，
+对一条病历只做一次线性扫描，返回其中提及的候选药物及位置。
+结果不依赖 LLM，可作为推荐提示词的补充信息与最终过滤的兜底信号。
+"""
+
+import json
+import os
+from collections import deque
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+
+# 剂型后缀（长的在前，保证只去掉最长的一个）
+DOSAGE_FORM_SUFFIXES = tuple(sorted((
+    "片", "胶囊", "软胶囊", "肠溶胶囊", "缓释胶囊", "颗粒", "丸", "滴丸", "散",
+    "缓释片", "控释片", "肠溶片", "分散片", "咀嚼片", "泡腾片", "口崩片", "口腔崩解片", "薄膜衣片",
+    "注射液", "氯化钠注射液", "葡萄糖注射液", "口服液", "口服溶液", "混悬液", "干混悬剂", "糖浆",
+    "滴眼液", "眼用凝胶", "滴耳液", "鼻喷雾", "鼻喷雾剂", "喷雾剂", "气雾剂", "吸入剂", "吸入粉雾剂",
+    "乳膏", "软膏", "凝胶", "凝胶贴膏", "贴膏", "贴剂", "栓",
+), key=len, reverse=True))
+
+# 注射用粉针与盐/酯形式前缀
+NAME_PREFIXES = tuple(sorted((
+    "注射用", "盐酸", "硫酸", "磷酸", "醋酸", "枸橼酸", "酒石酸", "马来酸", "富马酸", "琥珀酸",
+    "甲磺酸", "苯磺酸", "苯磺酸左旋", "门冬氨酸",
+), key=len, reverse=True))
+
+# 扫描的病历字段（出院诊断/出院带药等不参与）
+MENTION_FIELDS = ("主诉", "现病史", "既往史", "入院情况", "诊疗过程描述")
+
+MIN_PATTERN_LENGTH = 2
+# 两字词干（丹参、乌灵等）在病历中歧义太大，只登记更长的词干
+MIN_STEM_LENGTH = 3
+
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+class DrugMention(NamedTuple):
+    """一次命中：候选药物名、在文本中的 [start, end) 位置与原文片段。"""
+    name: str
+    start: int
+    end: int
+    surface: str
+
+
+def generic_stem(name: str) -> str:
+    """去掉剂型后缀与盐/注射用前缀，得到通用名词干（如 盐酸二甲双胍缓释片 -> 二甲双胍）。"""
+    stem = name.strip()
+    for suffix in DOSAGE_FORM_SUFFIXES:
+        if stem.endswith(suffix) and len(stem) > len(suffix):
+            stem = stem[:-len(suffix)]
+            break
+    for prefix in NAME_PREFIXES:
+        if stem.startswith(prefix) and len(stem) > len(prefix):
+            stem = stem[len(prefix):]
+            break
+    return stem
+
+
+class DrugMatcher:
+    """候选药物 Aho–Corasick 自动机（构建后只读，可在线程间共享）"""
+
+    def __init__(self):
+        self._patterns: Dict[str, str] = {}
+        self._goto: List[Dict[str, int]] = []
+        self._fail: List[int] = []
+        self._out: List[Tuple[Tuple[int, str], ...]] = []
+
+    @classmethod
+    def from_candidates(cls, names: Iterable[str], aliases: Optional[Dict[str, Iterable[str]]] = None,
+                        stems: bool = True) -> "DrugMatcher":
+        """由候选名称（+ 别名 + 通用名词干）构建自动机。"""
+        matcher = cls()
+        names = sorted({str(n).strip() for n in names if str(n).strip()})
+        for name in names:
+            matcher.add(name, name)
+        for name, surfaces in (aliases or {}).items():
+            if name in matcher._patterns:
+                for surface in surfaces:
+                    matcher.add(surface, name)
+        if stems:
+            matcher.add_stems(names)
+        matcher.build()
+        return matcher
+
+    def add(self, surface: str, name: str) -> None:
+        """登记一个表面形式 -> 候选名称；已登记的表面形式保持原映射（精确名称优先于别名与词干）。"""
+        key = str(surface).strip().translate(_ASCII_LOWER)
+        if len(key) >= MIN_PATTERN_LENGTH and key not in self._patterns:
+            self._patterns[key] = name
+            self._goto = []
+
+    def add_stems(self, names: Iterable[str]) -> None:
+        """为每个候选名称登记其通用名词干；多个候选共用同一词干时有歧义，不登记。"""
+        owners: Dict[str, Set[str]] = {}
+        for name in names:
+            stem = generic_stem(name)
+            if stem != name and len(stem) >= MIN_STEM_LENGTH:
+                owners.setdefault(stem, set()).add(name)
+        for stem, owner in owners.items():
+            if len(owner) == 1:
+                self.add(stem, next(iter(owner)))
+
+    def build(self) -> "DrugMatcher":
+        """构建 goto / fail / output 表（BFS 计算失败指针并合并输出）。"""
+        goto: List[Dict[str, int]] = [{}]
+        out: List[List[Tuple[int, str]]] = [[]]
+        for surface, name in self._patterns.items():
+            state = 0
+            for ch in surface:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append([])
+                state = nxt
+            out[state].append((len(surface), name))
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0) if goto[f].get(ch) != nxt else 0
+                out[nxt].extend(out[fail[nxt]])
+        self._goto = goto
+        self._fail = fail
+        self._out = [tuple(o) for o in out]
+        return self
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+    def iter_matches(self, text: str) -> Iterable[DrugMention]:
+        """单次线性扫描，产出所有（可能重叠的）命中。"""
+        if not self._goto:
+            self.build()
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, ch in enumerate(str(text).translate(_ASCII_LOWER)):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length, name in out[state]:
+                start = i + 1 - length
+                yield DrugMention(name, start, i + 1, text[start:i + 1])
+
+    def find(self, text: str) -> List[DrugMention]:
+        """返回互不重叠的命中（最左最长优先），按位置排序。"""
+        matches = sorted(self.iter_matches(text), key=lambda m: (m.start, m.start - m.end))
+        picked: List[DrugMention] = []
+        end = 0
+        for m in matches:
+            if m.start >= end:
+                picked.append(m)
+                end = m.end
+        return picked
+
+    def mentioned(self, text: str) -> List[str]:
+        """文本中提及的候选药物（按首次出现顺序去重）。"""
+        names: List[str] = []
+        for m in self.find(text):
+            if m.name not in names:
+                names.append(m.name)
+        return names
+
+
+def record_text(medical_text: str, fields: Iterable[str] = MENTION_FIELDS) -> str:
+    """取病历 JSON 中参与扫描的字段拼接为一段文本；非 JSON 时原样返回。"""
+    try:
+        obj = json.loads(str(medical_text))
+    except Exception:
+        return str(medical_text)
+    if not isinstance(obj, dict):
+        return str(medical_text)
+    parts = []
+    for k in fields:
+        v = obj.get(k)
+        if isinstance(v, list):
+            v = "、".join(map(str, v))
+        if v:
+            parts.append(str(v))
+    return "\n".join(parts)
+
+
+def load_aliases(path: Optional[str] = None) -> Dict[str, List[str]]:
+    """读取别名表 {候选名称: [别名, ...]}（DRUG_ALIASES_JSON，默认 data/药物别名.json，不存在时为空）。"""
+    path = path or os.getenv(
+        "DRUG_ALIASES_JSON",
+        os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")), "data", "药物别名.json"),
+    )
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception as e:
+        print(f"⚠️ 读取药物别名表失败: {e}")
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    aliases: Dict[str, List[str]] = {}
+    for name, values in data.items():
+        if isinstance(values, str):
+            values = [values]
+        aliases[str(name).strip()] = [str(v).strip() for v in values or [] if str(v).strip()]
+    return aliases
@@ -0,0 +1,140 @@
+"""
+药名模糊规范化
+
+将模型输出的药名映射到候选集合中最相近的名称（如 氨氯地平 -> 氨氯地平片）：
+- 候选名称及其通用名词干按字符 n-gram 建倒排索引，查询时只取共享 n-gram 最多的少量候选；
+- 对候选短名单用（带上限剪枝的）编辑距离核验，相似度 = 1 - 距离 / 较长串长度，
+  原名与去剂型/盐前缀后的词干两种写法取较高者，低于阈值视为不在候选集合内；
+- 判定结果（含未命中）进入 LRU 缓存，重复出现的药名直接返回。
+"""
+
+import re
+import unicodedata
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from drug_matcher import generic_stem
+from util import LRUCache
+
+
+DEFAULT_THRESHOLD = 0.8
+
+_WS_RE = re.compile(r"\s+")
+_MISS = object()
+
+
+def normalize_name(name: str) -> str:
+    """NFKC（全角转半角）+ 去空白 + ASCII 小写。"""
+    return _WS_RE.sub("", unicodedata.normalize("NFKC", str(name))).lower()
+
+
+def char_ngrams(text: str, n: int = 2) -> List[str]:
+    """字符 n-gram（去重保序）；短于 n 的文本以整体作为唯一 gram。"""
+    if len(text) <= n:
+        return [text] if text else []
+    grams: List[str] = []
+    for i in range(len(text) - n + 1):
+        g = text[i:i + n]
+        if g not in grams:
+            grams.append(g)
+    return grams
+
+
+def edit_distance(a: str, b: str, max_dist: Optional[int] = None) -> int:
+    """Levenshtein 距离；给定 max_dist 时一旦超出即提前返回 max_dist + 1。"""
+    if a == b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+    if max_dist is not None and len(a) - len(b) > max_dist:
+        return max_dist + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        cur = [i]
+        for j, cb in enumerate(b, start=1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if max_dist is not None and min(cur) > max_dist:
+            return max_dist + 1
+        prev = cur
+    return prev[-1]
+
+
+def similarity(a: str, b: str, threshold: float = 0.0) -> float:
+    """1 - 编辑距离 / 较长串长度；低于 threshold 时可能提前剪枝并返回 0。"""
+    longest = max(len(a), len(b))
+    if not longest:
+        return 1.0
+    max_dist = int((1.0 - threshold) * longest)
+    dist = edit_distance(a, b, max_dist)
+    return 0.0 if dist > max_dist else 1.0 - dist / longest
+
+
+class DrugNormalizer:
+    """候选药名模糊规范化器（索引构建后只读，缓存线程安全）"""
+
+    def __init__(self, names: Iterable[str], threshold: float = DEFAULT_THRESHOLD, ngram: int = 2,
+                 shortlist: int = 16, cache_size: int = 10000):
+        self.threshold = threshold
+        self.ngram = ngram
+        self.shortlist = shortlist
+        self.cache = LRUCache(cache_size)
+        self._names: List[str] = sorted({str(n).strip() for n in names if str(n).strip()})
+        # 每个候选的 (规范化原名, 规范化词干)
+        self._keys: List[Tuple[str, str]] = []
+        self._exact: Dict[str, str] = {}
+        postings: Dict[str, List[int]] = {}
+        for idx, name in enumerate(self._names):
+            key = normalize_name(name)
+            stem = normalize_name(generic_stem(name))
+            self._keys.append((key, stem))
+            self._exact.setdefault(key, name)
+            for g in set(char_ngrams(key, ngram)) | set(char_ngrams(stem, ngram)):
+                postings.setdefault(g, []).append(idx)
+        self._postings: Dict[str, array] = {g: array("I", ids) for g, ids in postings.items()}
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def _shortlist(self, key: str, stem: str) -> List[int]:
+        """按共享 n-gram 数取前 shortlist 个候选。"""
+        counts: Counter = Counter()
+        for g in set(char_ngrams(key, self.ngram)) | set(char_ngrams(stem, self.ngram)):
+            ids = self._postings.get(g)
+            if ids is not None:
+                counts.update(ids)
+        return [idx for idx, _ in counts.most_common(self.shortlist)]
+
+    def best_match(self, name: str) -> Optional[Tuple[str, float]]:
+        """返回 (候选名称, 相似度)；没有达到阈值的候选时返回 None（不走缓存）。"""
+        key = normalize_name(name)
+        if not key:
+            return None
+        if key in self._exact:
+            return self._exact[key], 1.0
+        stem = normalize_name(generic_stem(name))
+        best: Optional[Tuple[float, int, str]] = None
+        for idx in self._shortlist(key, stem):
+            cand_key, cand_stem = self._keys[idx]
+            score = max(similarity(key, cand_key, self.threshold),
+                        similarity(stem, cand_stem, self.threshold))
+            if score < self.threshold:
+                continue
+            # 同分时取长度更接近的候选，再按名称保证结果稳定
+            rank = (score, -abs(len(cand_key) - len(key)), self._names[idx])
+            if best is None or rank > best:
+                best = rank
+        if best is None:
+            return None
+        return best[2], best[0]
+
+    def normalize(self, name: str) -> Optional[str]:
+        """映射到候选名称；无法确定时返回 None。"""
+        key = normalize_name(name)
+        cached = self.cache.get(key, _MISS)
+        if cached is not _MISS:
+            return cached
+        match = self.best_match(name)
+        result = match[0] if match else None
+        self.cache.put(key, result)
+        return result
@@ -0,0 +1,218 @@
+"""
+嵌入向量缓存
+
+以 (模型名, 规范化文本) 的哈希为键，将嵌入向量以 float32 形式持久化到 SQLite，
+前置一层内存 LRU；磁盘条目超过上限时按最近访问时间淘汰。
+同一份药物文本或重复的查询语句再次出现时不再请求嵌入服务。
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from langchain_core.embeddings import Embeddings
+from util import LRUCache
+
+
+DEFAULT_CACHE_PATH = "./cache/embeddings.sqlite"
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本：NFKC（全角转半角等）+ 合并空白 + 去除首尾空白。"""
+    return _WS_RE.sub(" ", unicodedata.normalize("NFKC", str(text))).strip()
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite + 内存 LRU 的嵌入缓存（线程安全）"""
+
+    def __init__(self,
+                 path: str = DEFAULT_CACHE_PATH,
+                 max_memory_items: int = 20000,
+                 max_disk_items: int = 500000):
+        self.path = path
+        self.max_disk_items = max_disk_items
+        self.memory = LRUCache(max_memory_items)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, dim INTEGER NOT NULL, "
+            "vector BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_access ON embeddings(last_access)")
+        self._conn.commit()
+
+    # ---- 读写 ----
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """批量读取，未命中的位置返回 None（不计入命中统计）。"""
+        keys = [cache_key(model, t) for t in texts]
+        results: List[Optional[List[float]]] = [self.memory.get(k) for k in keys]
+        missing = list({k for k, v in zip(keys, results) if v is None})
+        if missing:
+            found: Dict[str, List[float]] = {}
+            with self._lock:
+                for i in range(0, len(missing), 500):
+                    chunk = missing[i:i + 500]
+                    rows = self._conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                        chunk,
+                    ).fetchall()
+                    for k, blob in rows:
+                        found[k] = array("f", blob).tolist()
+                if found:
+                    now = time.time()
+                    self._conn.executemany(
+                        "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                        [(now, k) for k in found],
+                    )
+                    self._conn.commit()
+            for k, vec in found.items():
+                self.memory.put(k, vec)
+            results = [v if v is not None else found.get(k) for k, v in zip(keys, results)]
+        return results
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        now = time.time()
+        rows = []
+        for t, vec in zip(texts, vectors):
+            k = cache_key(model, t)
+            vec = list(vec)
+            self.memory.put(k, vec)
+            rows.append((k, model, len(vec), array("f", vec).tobytes(), now))
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, dim, vector, last_access) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self._evict_locked()
+
+    def _lookup(self, model: str, texts: List[str]):
+        """读取缓存并统计命中，返回 (各位置缓存结果, 去重后的未命中 {key: text})。"""
+        cached = self.get_many(model, texts)
+        pending: Dict[str, str] = {}
+        for t, v in zip(texts, cached):
+            if v is None:
+                pending.setdefault(cache_key(model, t), t)
+        with self._lock:
+            self.misses += len(pending)
+            self.hits += sum(1 for v in cached if v is not None)
+        return cached, pending
+
+    def _fill(self, model: str, texts: List[str], cached, pending: Dict[str, str], vectors) -> List[List[float]]:
+        """写回新计算的向量，并按输入顺序合并结果。"""
+        self.put_many(model, list(pending.values()), vectors)
+        computed = {k: list(vec) for k, vec in zip(pending.keys(), vectors)}
+        return [v if v is not None else computed[cache_key(model, t)] for t, v in zip(texts, cached)]
+
+    def get_or_compute(self,
+                       model: str,
+                       texts: Sequence[str],
+                       compute: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """读取缓存，仅对未命中的去重文本调用 compute，并写回缓存。"""
+        texts = list(texts)
+        cached, pending = self._lookup(model, texts)
+        if not pending:
+            return cached
+        return self._fill(model, texts, cached, pending, compute(list(pending.values())))
+
+    async def aget_or_compute(self, model: str, texts: Sequence[str], acompute) -> List[List[float]]:
+        """get_or_compute 的异步版本，acompute 为异步批量嵌入函数。"""
+        texts = list(texts)
+        cached, pending = self._lookup(model, texts)
+        if not pending:
+            return cached
+        return self._fill(model, texts, cached, pending, await acompute(list(pending.values())))
+
+    def _evict_locked(self) -> None:
+        """磁盘条目超过上限时，删除最久未访问的条目（调用方需持有锁）。"""
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        overflow = count - self.max_disk_items
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                (overflow,),
+            )
+            self._conn.commit()
+
+    # ---- 统计与管理 ----
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            total = self.hits + self.misses
+            return {
+                "path": self.path,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "memory_items": len(self.memory),
+                "disk_items": count,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self.memory.clear()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """为 langchain 嵌入模型（如 OllamaEmbeddings）加上持久化缓存的包装类。"""
+
+    def __init__(self, inner: Any, cache: EmbeddingCache, model_name: Optional[str] = None):
+        self.inner = inner
+        self.cache = cache
+        self.model_name = model_name or getattr(inner, "model", None) or inner.__class__.__name__
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.cache.get_or_compute(self.model_name, texts, self.inner.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.cache.get_or_compute(self.model_name, [text], lambda ts: [self.inner.embed_query(ts[0])])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.cache.aget_or_compute(self.model_name, texts, self.inner.aembed_documents)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        async def _one(ts: List[str]) -> List[List[float]]:
+            return [await self.inner.aembed_query(ts[0])]
+        return (await self.cache.aget_or_compute(self.model_name, [text], _one))[0]
+
+
+_caches: Dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(path: Optional[str] = None) -> Optional[EmbeddingCache]:
+    """按路径获取进程内共享的缓存实例；环境变量 EMBEDDING_CACHE=0 时禁用缓存并返回 None。"""
+    if os.getenv("EMBEDDING_CACHE", "1") == "0":
+        return None
+    path = os.path.abspath(path or os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH))
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = EmbeddingCache(path)
+        return _caches[path]
@@ -0,0 +1,85 @@
+"""
+推荐结果评估
+
+按记录计算预测药物集合与真实出院带药列表之间的 Jaccard、精确率、召回率与 F1，并做宏平均。
+"""
+
+import json
+import os
+from typing import Dict, Iterable, List, Optional
+
+
+def score_prediction(prediction: Iterable[str], gold: Iterable[str]) -> Dict[str, float]:
+    """单条记录的集合指标；预测与真实均为空时记为满分。"""
+    pred_set = {str(x).strip() for x in prediction if str(x).strip()}
+    gold_set = {str(x).strip() for x in gold if str(x).strip()}
+    if not pred_set and not gold_set:
+        return {"jaccard": 1.0, "precision": 1.0, "recall": 1.0, "f1": 1.0}
+    tp = len(pred_set & gold_set)
+    union = len(pred_set | gold_set)
+    precision = tp / len(pred_set) if pred_set else 0.0
+    recall = tp / len(gold_set) if gold_set else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        "jaccard": tp / union if union else 0.0,
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+    }
+
+
+def aggregate_scores(scores: List[Dict[str, float]]) -> Dict[str, float]:
+    """宏平均。"""
+    if not scores:
+        return {"jaccard": 0.0, "precision": 0.0, "recall": 0.0, "f1": 0.0}
+    keys = ("jaccard", "precision", "recall", "f1")
+    return {k: round(sum(s[k] for s in scores) / len(scores), 4) for k in keys}
+
+
+def load_gold(path: str, field: str = "出院带药列表") -> Dict[str, List[str]]:
+    """读取真实标签，返回 {就诊标识: 药物列表}；只保留非空标签。
+
+    支持两种格式：病历 JSONL（含 就诊标识 与 field 字段），
+    以及提交格式 JSON 数组 [{"ID": ..., "prediction": [...]}]。
+    """
+    gold: Dict[str, List[str]] = {}
+    if not path or not os.path.isfile(path):
+        return gold
+    with open(path, "r", encoding="utf-8") as f:
+        head = f.read(1)
+        f.seek(0)
+        if head == "[":
+            for item in json.load(f):
+                if isinstance(item, dict) and item.get("prediction"):
+                    gold[str(item.get("ID"))] = list(item["prediction"])
+            return gold
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except Exception:
+                continue
+            drugs = rec.get(field)
+            if isinstance(drugs, list) and drugs:
+                gold[str(rec.get("就诊标识"))] = [str(x) for x in drugs]
+    return gold
+
+
+def evaluate(predictions: Dict[str, List[str]], gold: Dict[str, List[str]],
+             ids: Optional[Iterable[str]] = None) -> Dict[str, object]:
+    """对有标签的记录打分，返回汇总指标与逐条得分。"""
+    ids = list(ids) if ids is not None else list(predictions.keys())
+    per_record = []
+    for rid in ids:
+        if rid not in gold:
+            continue
+        s = score_prediction(predictions.get(rid, []), gold[rid])
+        per_record.append({"ID": rid, **{k: round(v, 4) for k, v in s.items()}})
+    return {
+        "labeled": len(per_record),
+        "unlabeled": len(ids) - len(per_record),
+        **aggregate_scores(per_record),
+        "per_record": per_record,
+    }
@@ -0,0 +1,226 @@
+"""
+LLM 响应缓存
+
+以 (模型, temperature, max_tokens, 完整提示词哈希) 为键缓存确定性（temperature=0）调用的结果：
+内存 LRU + SQLite 持久化，支持 TTL 与条目数上限淘汰；
+并发的相同请求只向上游发起一次（single-flight），其余请求等待同一结果。
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from tracing import get_tracer
+from util import LRUCache
+
+
+DEFAULT_CACHE_PATH = "./cache/llm_responses.sqlite"
+
+
+class LLMResponseCache:
+    """确定性 LLM 响应缓存（线程安全，支持同步与异步 single-flight）"""
+
+    def __init__(self,
+                 path: str = DEFAULT_CACHE_PATH,
+                 ttl_seconds: Optional[float] = 30 * 24 * 3600,
+                 max_memory_items: int = 5000,
+                 max_disk_items: int = 100000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_items = max_disk_items
+        self.memory = LRUCache(max_memory_items)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._ainflight: Dict[Tuple[int, str], asyncio.Future] = {}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, text TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, temperature: float, max_tokens: int, prompt: str) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        raw = json.dumps([model, float(temperature), int(max_tokens), prompt_hash])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds
+
+    # ---- 读写 ----
+    def get(self, key: str) -> Optional[str]:
+        entry = self.memory.get(key)
+        if entry is not None:
+            text, created_at = entry
+            if not self._expired(created_at):
+                return text
+            self.memory.pop(key)
+        with self._lock:
+            row = self._conn.execute("SELECT text, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            text, created_at = row
+            if self._expired(created_at):
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        self.memory.put(key, (text, created_at))
+        return text
+
+    def put(self, key: str, model: str, text: Optional[str]) -> None:
+        """写入缓存；空响应（None 或空串，多为上游异常或内容过滤）不缓存，下次重新请求。"""
+        if not text:
+            return
+        now = time.time()
+        self.memory.put(key, (text, now))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, text, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, model, text, now, now),
+            )
+            self._conn.commit()
+            self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        """删除过期条目；条目数超过上限时删除最久未访问的条目（调用方需持有锁）。"""
+        if self.ttl_seconds is not None:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        overflow = count - self.max_disk_items
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                (overflow,),
+            )
+        self._conn.commit()
+
+    # ---- single-flight ----
+    def get_or_call(self, key: str, model: str, call: Callable[[], str], refresh: bool = False) -> str:
+        """命中缓存直接返回；否则同一 key 只有一个线程调用 call，其余线程等待其结果。
+
+        refresh=True 时跳过读缓存强制请求上游，结果仍会写回缓存。
+        """
+        if not refresh:
+            text = self.get(key)
+            if text is not None:
+                with self._lock:
+                    self.hits += 1
+                return text
+        with self._lock:
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = Future()
+                self._inflight[key] = fut
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            # 等待在途请求的调用不是缓存命中，单独记为 coalesced
+            get_tracer().annotate(cache_hits=0, coalesced=1)
+            return fut.result()
+        try:
+            text = call() or ""
+            self.put(key, model, text)
+            fut.set_result(text)
+            return text
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def aget_or_call(self, key: str, model: str, acall: Callable[[], Awaitable[str]],
+                           refresh: bool = False) -> str:
+        """get_or_call 的异步版本（在同一事件循环内合并并发请求）。"""
+        if not refresh:
+            text = self.get(key)
+            if text is not None:
+                with self._lock:
+                    self.hits += 1
+                return text
+        loop = asyncio.get_running_loop()
+        slot = (id(loop), key)
+        fut = self._ainflight.get(slot)
+        if fut is not None:
+            with self._lock:
+                self.coalesced += 1
+            get_tracer().annotate(cache_hits=0, coalesced=1)
+            return await asyncio.shield(fut)
+        fut = loop.create_future()
+        self._ainflight[slot] = fut
+        with self._lock:
+            self.misses += 1
+        try:
+            text = await acall() or ""
+            self.put(key, model, text)
+            fut.set_result(text)
+            return text
+        except BaseException as e:
+            fut.set_exception(e)
+            # 没有等待者时避免 "exception was never retrieved" 警告
+            fut.exception()
+            raise
+        finally:
+            self._ainflight.pop(slot, None)
+
+    # ---- 统计与管理 ----
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+            total = self.hits + self.misses + self.coalesced
+            return {
+                "path": self.path,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": round((self.hits + self.coalesced) / total, 4) if total else 0.0,
+                "memory_items": len(self.memory),
+                "disk_items": count,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self.memory.clear()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_caches: Dict[str, LLMResponseCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_llm_cache(path: Optional[str] = None) -> Optional[LLMResponseCache]:
+    """按路径获取进程内共享的响应缓存；环境变量 LLM_CACHE=0 时禁用并返回 None。
+    LLM_CACHE_TTL 可设置过期秒数（0 表示永不过期）。"""
+    if os.getenv("LLM_CACHE", "1") == "0":
+        return None
+    path = os.path.abspath(path or os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH))
+    with _caches_lock:
+        if path not in _caches:
+            ttl = float(os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600)))
+            _caches[path] = LLMResponseCache(path, ttl_seconds=ttl or None)
+        return _caches[path]
@@ -0,0 +1,210 @@
+"""
+异步 Neo4j 访问层
+
+基于 AsyncGraphDatabase，进程内共享一个连接池：
+- 连接池大小、单次查询超时、托管事务重试时长均可配置；
+- 读查询以 READ_ACCESS + execute_read 执行（neo4j:// 集群下路由到只读成员），写查询走 execute_write，
+  两者均为托管事务，遇到可重试错误（如连接中断、死锁）时由驱动自动重试；
+- 提供图谱检索与嵌入批量写回的异步版本，供 asyncio 批处理与 LLM 调用重叠执行。
+"""
+
+import asyncio
+from typing import Any, Dict, List, Optional, Set
+
+from neo4j import AsyncGraphDatabase, READ_ACCESS, WRITE_ACCESS, unit_of_work
+
+from neo4j_manage import (
+    GRAPH_CANDIDATES_CYPHER,
+    KEYWORD_INDEX_CYPHER,
+    NAME_FULLTEXT_INDEX,
+    STALE_NODES_CYPHER,
+    VECTOR_INDEX_CYPHER,
+    WRITE_EMBEDDINGS_CYPHER,
+    _fulltext_phrase,
+    format_graph_candidates,
+    name_fulltext_index_cypher,
+    stale_node_row,
+)
+from tracing import get_tracer
+from util import batched
+
+
+class AsyncNeo4jManager:
+    """异步 Neo4j 管理器（需在同一个事件循环内使用）"""
+
+    def __init__(self, url: str, username: str, password: str,
+                 database: Optional[str] = None,
+                 max_connection_pool_size: int = 50,
+                 query_timeout: Optional[float] = 30.0,
+                 max_transaction_retry_time: float = 15.0,
+                 connection_acquisition_timeout: float = 60.0,
+                 fetch_size: int = 1000):
+        self.driver = AsyncGraphDatabase.driver(
+            url,
+            auth=(username, password),
+            max_connection_pool_size=max_connection_pool_size,
+            max_transaction_retry_time=max_transaction_retry_time,
+            connection_acquisition_timeout=connection_acquisition_timeout,
+        )
+        self.url = url
+        self.database = database
+        self.query_timeout = query_timeout
+        self.fetch_size = fetch_size
+        self._fulltext_ready = False
+        self._index_lock = asyncio.Lock()
+
+    async def close(self) -> None:
+        """关闭驱动并释放连接池"""
+        await self.driver.close()
+
+    async def __aenter__(self) -> "AsyncNeo4jManager":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def verify_connectivity(self) -> None:
+        await self.driver.verify_connectivity()
+
+    # ---- 基础查询 ----
+    def _session(self, access_mode: str):
+        return self.driver.session(database=self.database, default_access_mode=access_mode,
+                                   fetch_size=self.fetch_size)
+
+    async def _run_managed(self, access_mode: str, cypher: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """在托管事务中执行查询并返回全部记录（超时作用于整个事务，失败时按驱动策略重试）。"""
+        @unit_of_work(timeout=self.query_timeout)
+        async def work(tx) -> List[Dict[str, Any]]:
+            result = await tx.run(cypher, **params)
+            return await result.data()
+
+        async with self._session(access_mode) as session:
+            if access_mode == READ_ACCESS:
+                return await session.execute_read(work)
+            return await session.execute_write(work)
+
+    async def read(self, cypher: str, **params: Any) -> List[Dict[str, Any]]:
+        """只读查询（路由到读成员）"""
+        return await self._run_managed(READ_ACCESS, cypher, params)
+
+    async def write(self, cypher: str, **params: Any) -> List[Dict[str, Any]]:
+        """写查询"""
+        return await self._run_managed(WRITE_ACCESS, cypher, params)
+
+    async def _run_schema(self, cypher: str, **params: Any) -> None:
+        """索引等 schema 语句只能以自动提交事务执行"""
+        async with self._session(WRITE_ACCESS) as session:
+            result = await session.run(cypher, **params)
+            await result.consume()
+
+    # ---- 索引 ----
+    async def ensure_vector_indexes(self, dimension: int = 1024) -> None:
+        """创建 Neo4jVectorStore 所需的向量索引与全文索引（已存在时跳过）。"""
+        await self._run_schema(VECTOR_INDEX_CYPHER, dimension=dimension)
+        await self._run_schema(KEYWORD_INDEX_CYPHER)
+
+    async def ensure_name_fulltext_index(self) -> None:
+        """在所有业务标签的 name 属性上创建全文索引（并发调用时只执行一次）。"""
+        async with self._index_lock:
+            if self._fulltext_ready:
+                return
+            labels = [rec["label"] for rec in await self.read("CALL db.labels() YIELD label RETURN label")]
+            cypher = name_fulltext_index_cypher(labels)
+            if cypher:
+                await self._run_schema(cypher)
+                await self._run_schema("CALL db.awaitIndexes(300)")
+            self._fulltext_ready = True
+
+    # ---- 图谱检索 ----
+    async def graph_candidates_many(self, term_lists: List[List[str]], drug_names: List[str], top_k: int = 20,
+                                    chunk_size: int = 200, term_limit: int = 10,
+                                    concurrency: int = 4) -> List[List[Dict[str, Any]]]:
+        """Neo4jManager.graph_candidates_many 的异步版本，多个分块并发查询。"""
+        results: List[List[Dict[str, Any]]] = [[] for _ in term_lists]
+        rows = [{"key": i, "terms": [_fulltext_phrase(t) for t in terms]}
+                for i, terms in enumerate(term_lists) if terms]
+        if not rows:
+            return results
+        await self.ensure_name_fulltext_index()
+        names = sorted(drug_names)
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def run_chunk(chunk: List[Dict[str, Any]]) -> None:
+            async with semaphore:
+                with get_tracer().span("retrieval.graph_many", kind="client", inputs=len(chunk)) as sp:
+                    records = await self.read(GRAPH_CANDIDATES_CYPHER, rows=chunk, index=NAME_FULLTEXT_INDEX,
+                                              term_limit=term_limit, drug_names=names, top_k=top_k)
+                    if sp is not None:
+                        sp.set(retrieved_docs=sum(len(rec["drugs"]) for rec in records))
+            for rec in records:
+                results[rec["key"]] = rec["drugs"]
+
+        await asyncio.gather(*(run_chunk(chunk) for chunk in batched(rows, chunk_size)))
+        return results
+
+    async def retrieve_graph_info_many(self, term_lists: List[List[str]], drug_names: List[str]) -> List[str]:
+        """批量图谱检索并渲染为知识库文本；出错时每条返回错误说明。"""
+        try:
+            return [format_graph_candidates(c) for c in await self.graph_candidates_many(term_lists, drug_names)]
+        except Exception as e:
+            print(f"❌ 图谱检索过程中出错: {e}")
+            return [f"图谱检索过程中出现错误: {e}" for _ in term_lists]
+
+    # ---- 批量写回 ----
+    async def write_embeddings(self, rows: List[Dict[str, Any]], chunk_size: int = 500) -> int:
+        """以 UNWIND $rows 分块写回 {id, embedding, hash}，返回写入的节点数。"""
+        for chunk in batched(rows, chunk_size):
+            await self.write(WRITE_EMBEDDINGS_CYPHER, rows=chunk)
+        return len(rows)
+
+    async def backfill_embeddings(self, embed_model, batch_size: int = 64, workers: int = 4,
+                                  dimension: int = 1024, force: bool = False) -> Dict[str, int]:
+        """Neo4jManager.backfill_embeddings 的异步版本：嵌入请求与写事务在事件循环中并发执行。"""
+        await self.ensure_vector_indexes(dimension)
+        model_name = getattr(embed_model, "model_name", embed_model.__class__.__name__)
+        stats = {"scanned": 0, "skipped": 0, "embedded": 0, "failed": 0}
+        semaphore = asyncio.Semaphore(max(1, workers))
+        pending: Set[asyncio.Task] = set()
+
+        async def work(rows: List[Dict[str, Any]]) -> None:
+            try:
+                vectors = await embed_model.aget_text_embedding_batch([r["text"] for r in rows])
+                bad = [len(v) for v in vectors if len(v) != dimension]
+                if bad:
+                    raise ValueError(f"嵌入维度为 {bad[0]}，与向量索引维度 {dimension} 不一致")
+                stats["embedded"] += await self.write_embeddings(
+                    [{"id": r["id"], "embedding": list(v), "hash": r["hash"]} for r, v in zip(rows, vectors)]
+                )
+            except Exception as e:
+                stats["failed"] += len(rows)
+                print(f"❌ 回填批次失败（{len(rows)} 个节点，重跑时会重试）: {e}")
+            finally:
+                semaphore.release()
+            print(f"📥 已写回 {stats['embedded']} 个节点嵌入（扫描 {stats['scanned']}，"
+                  f"跳过 {stats['skipped']}，失败 {stats['failed']}）")
+
+        batch: List[Dict[str, Any]] = []
+
+        async def submit() -> None:
+            await semaphore.acquire()
+            task = asyncio.create_task(work(batch))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+        async with self._session(READ_ACCESS) as session:
+            result = await session.run(STALE_NODES_CYPHER)
+            async for rec in result:
+                stats["scanned"] += 1
+                row = stale_node_row(rec, model_name, force)
+                if row is None:
+                    stats["skipped"] += 1
+                    continue
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    await submit()
+                    batch = []
+        if batch:
+            await submit()
+        if pending:
+            await asyncio.gather(*pending)
+        return stats
@@ -1,31 +1,265 @@
-from neo4j import GraphDatabase
-from typing import List, Dict, Any
-from llama_index.core import Document, VectorStoreIndex, StorageContext
+import hashlib
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from neo4j import GraphDatabase, READ_ACCESS
+from typing import List, Dict, Any, Iterator, Optional
+from llama_index.core import Document, VectorStoreIndex, StorageContext, Settings
 from llama_index.vector_stores.neo4jvector import Neo4jVectorStore
 from qianwen_class import QianwenEmbedding, QianwenLLM
-from langchain_ollama.embeddings import OllamaEmbeddings
-from wap.vector_retriver import VectorDatabaseFactory
+from embedding_cache import get_embedding_cache
+from retriever_registry import RetrieverKey, RetrieverRegistry, get_registry
+from tracing import get_tracer
+from util import batched, estimate_tokens
+from context_packer import ContextPacker
+
+
+# 与 Neo4jVectorStore 默认配置一致：向量索引 "vector"、全文索引 "keyword"，均建在 Chunk 标签上
+VECTOR_INDEX_NAME = "vector"
+KEYWORD_INDEX_NAME = "keyword"
+VECTOR_NODE_LABEL = "Chunk"
+# 覆盖所有业务标签 name 属性的全文索引，用于按诊断术语查找图谱节点
+NAME_FULLTEXT_INDEX = "name_fulltext"
+
+# 一次查询处理一批病历：诊断术语经全文索引命中节点，再沿一跳关系找到候选药物，按命中术语数与得分排序
+GRAPH_CANDIDATES_CYPHER = (
+    "UNWIND $rows AS row "
+    "UNWIND row.terms AS term "
+    "CALL db.index.fulltext.queryNodes($index, term, {limit: $term_limit}) YIELD node AS hit, score "
+    "MATCH (hit)-[r]-(drug) "
+    "WHERE drug.name IN $drug_names AND NOT hit.name IN $drug_names "
+    "WITH row.key AS key, drug.name AS drug, term, hit.name AS via, type(r) AS rel, max(score) AS score "
+    "WITH key, drug, sum(score) AS total, count(DISTINCT term) AS matched, "
+    "collect(via + ' -[' + rel + ']- ' + drug)[..3] AS evidence "
+    "ORDER BY key, matched DESC, total DESC "
+    "WITH key, collect({drug: drug, score: total, matched_terms: matched, evidence: evidence}) AS drugs "
+    "RETURN key, drugs[..$top_k] AS drugs"
+)
+
+
+VECTOR_INDEX_CYPHER = (
+    f"CREATE VECTOR INDEX {VECTOR_INDEX_NAME} IF NOT EXISTS "
+    f"FOR (n:{VECTOR_NODE_LABEL}) ON n.embedding "
+    "OPTIONS { indexConfig: {"
+    "`vector.dimensions`: toInteger($dimension), "
+    "`vector.similarity_function`: 'cosine'"
+    "} }"
+)
+KEYWORD_INDEX_CYPHER = (
+    f"CREATE FULLTEXT INDEX {KEYWORD_INDEX_NAME} IF NOT EXISTS "
+    f"FOR (n:{VECTOR_NODE_LABEL}) ON EACH [n.name]"
+)
+
+# 回填：流式扫描节点与批量写回嵌入
+STALE_NODES_CYPHER = (
+    "MATCH (n) WHERE n.name IS NOT NULL "
+    "RETURN elementId(n) AS id, n.name AS name, labels(n) AS labels, n.desc AS desc, "
+    "n.embedding_hash AS hash, n.embedding IS NULL AS missing"
+)
+WRITE_EMBEDDINGS_CYPHER = (
+    "UNWIND $rows AS row "
+    "MATCH (n) WHERE elementId(n) = row.id "
+    f"SET n:{VECTOR_NODE_LABEL}, n.embedding = row.embedding, n.embedding_hash = row.hash"
+)
+
+
+def node_text_hash(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+
+def stale_node_row(rec: Any, model_name: str, force: bool) -> Optional[Dict[str, Any]]:
+    """缺少嵌入或文本哈希已过期时返回待回填的行，否则返回 None。"""
+    text = render_node_text(rec["name"], list(rec["labels"]), rec["desc"])
+    text_hash = node_text_hash(model_name, text)
+    if force or rec["missing"] or rec["hash"] != text_hash:
+        return {"id": rec["id"], "text": text, "hash": text_hash}
+    return None
+
+
+def name_fulltext_index_cypher(labels: List[str]) -> Optional[str]:
+    """覆盖给定业务标签 name 属性的全文索引 DDL；没有业务标签时返回 None。"""
+    labels = [label for label in labels if label != VECTOR_NODE_LABEL]
+    if not labels:
+        return None
+    label_expr = "|".join(f"`{label}`" for label in labels)
+    return f"CREATE FULLTEXT INDEX {NAME_FULLTEXT_INDEX} IF NOT EXISTS FOR (n:{label_expr}) ON EACH [n.name]"
+
+
+def _fulltext_phrase(term: str) -> str:
+    """把术语转为 Lucene 短语查询（转义引号与反斜杠），避免中文被拆成单字后的宽泛匹配。"""
+    return '"' + term.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def format_graph_candidates(candidates: List[Dict[str, Any]]) -> str:
+    """把图谱候选药物渲染为提示词中的知识库文本。"""
+    if not candidates:
+        return ""
+    lines = [f"{c['drug']}（依据：{'；'.join(c.get('evidence') or [])}）" for c in candidates]
+    return "图谱关联药物：\n" + "\n".join(lines)
+
+
+def render_node_text(name: Any, labels: List[str], desc: Any) -> str:
+    """节点的嵌入文本；不含检索用的 Chunk 标签，保证回填前后文本一致。"""
+    labels = [label for label in labels if label != VECTOR_NODE_LABEL]
+    return f"{name}，{labels}。{desc if desc is not None else ''}"
 
 
 class Neo4jManager:
     """Neo4j数据库管理器"""
-    def __init__(self, url: str, username: str, password: str):
+    def __init__(self, url: str, username: str, password: str,
+                 retriever_key: Optional[RetrieverKey] = None,
+                 registry: Optional[RetrieverRegistry] = None):
         self.driver = GraphDatabase.driver(url, auth=(username, password))
         self.url = url
         self.username = username
         self.password = password
         self._query_engine = None
+        # 外部向量库（Chroma）检索器：由进程级注册表构建并在线程间共享
+        self.retriever_key = retriever_key or RetrieverKey.create()
+        self.registry = registry or get_registry()
+        self._fulltext_ready = False
+        # 检索结果按 token 预算打包（CONTEXT_PACKING=0 时为全文拼接）
+        self.context_packer = ContextPacker.from_env()
         
     def close(self):
         """关闭数据库连接"""
         if self.driver:
             self.driver.close()
 
+    def warm_up_retriever(self) -> Dict[str, Any]:
+        """预先构建向量检索器，返回向量库统计信息。"""
+        return self.registry.warm_up([self.retriever_key])[self.retriever_key]
+
+    def close_retriever(self) -> None:
+        """释放当前使用的向量检索器。"""
+        self.registry.close(self.retriever_key)
+
+    def iter_node_documents(self, fetch_size: int = 5000) -> Iterator[Document]:
+        """以单个游标流式导出所有带 name 属性的节点（只取所需属性），逐条产出 Document。
+
+        驱动按 fetch_size 分批拉取，无 SKIP 偏移，导出耗时与节点数线性相关，内存只与批大小有关。
+        """
+        cypher = (
+            "MATCH (n) WHERE n.name IS NOT NULL "
+            "RETURN n.name AS name, labels(n) AS labels, n.desc AS desc"
+        )
+        with self.driver.session(fetch_size=fetch_size) as session:
+            for rec in session.run(cypher):
+                name, labels = rec["name"], list(rec["labels"])
+                yield Document(
+                    text=render_node_text(name, labels, rec["desc"]),
+                    metadata={"name": name, "labels": labels}
+                )
+
+    def ensure_vector_indexes(self, dimension: int = 1024) -> None:
+        """创建 Neo4jVectorStore 所需的向量索引与全文索引（已存在时跳过）。"""
+        with self.driver.session() as session:
+            session.run(VECTOR_INDEX_CYPHER, dimension=dimension).consume()
+            session.run(KEYWORD_INDEX_CYPHER).consume()
+
+    def ensure_name_fulltext_index(self) -> None:
+        """在所有业务标签的 name 属性上创建全文索引（已存在时跳过；新增标签后需删除索引重建）。"""
+        with self.driver.session() as session:
+            labels = [rec["label"] for rec in session.run("CALL db.labels() YIELD label RETURN label")]
+            cypher = name_fulltext_index_cypher(labels)
+            if cypher:
+                session.run(cypher).consume()
+                session.run("CALL db.awaitIndexes(300)").consume()
+        self._fulltext_ready = True
+
+    def graph_candidates_many(self, term_lists: List[List[str]], drug_names: List[str], top_k: int = 20,
+                              chunk_size: int = 200, term_limit: int = 10) -> List[List[Dict[str, Any]]]:
+        """按诊断术语批量检索图谱中的关联候选药物，每 chunk_size 条病历一次数据库往返。
+
+        返回与 term_lists 一一对应的列表，每项为 {drug, score, matched_terms, evidence}，按相关度降序。
+        """
+        results: List[List[Dict[str, Any]]] = [[] for _ in term_lists]
+        rows = [{"key": i, "terms": [_fulltext_phrase(t) for t in terms]}
+                for i, terms in enumerate(term_lists) if terms]
+        if not rows:
+            return results
+        if not self._fulltext_ready:
+            self.ensure_name_fulltext_index()
+        names = sorted(drug_names)
+        with self.driver.session(default_access_mode=READ_ACCESS) as session:
+            for chunk in batched(rows, chunk_size):
+                params = {"rows": chunk, "index": NAME_FULLTEXT_INDEX, "term_limit": term_limit,
+                          "drug_names": names, "top_k": top_k}
+                with get_tracer().span("retrieval.graph_many", kind="client", inputs=len(chunk)) as sp:
+                    records = session.execute_read(lambda tx: list(tx.run(GRAPH_CANDIDATES_CYPHER, **params)))
+                    if sp is not None:
+                        sp.set(retrieved_docs=sum(len(rec["drugs"]) for rec in records))
+                for rec in records:
+                    results[rec["key"]] = [dict(d) for d in rec["drugs"]]
+        return results
+
+    def retrieve_graph_info_many(self, term_lists: List[List[str]], drug_names: List[str]) -> List[str]:
+        """批量图谱检索并渲染为知识库文本；出错时每条返回错误说明。"""
+        try:
+            return [format_graph_candidates(c) for c in self.graph_candidates_many(term_lists, drug_names)]
+        except Exception as e:
+            print(f"❌ 图谱检索过程中出错: {e}")
+            return [f"图谱检索过程中出现错误: {e}" for _ in term_lists]
+
+    def _iter_stale_nodes(self, model_name: str, force: bool, stats: Dict[str, int],
+                          fetch_size: int = 5000) -> Iterator[Dict[str, Any]]:
+        """流式扫描节点，只产出缺少嵌入或文本哈希已过期的节点。"""
+        with self.driver.session(fetch_size=fetch_size) as session:
+            for rec in session.run(STALE_NODES_CYPHER):
+                stats["scanned"] += 1
+                row = stale_node_row(rec, model_name, force)
+                if row is not None:
+                    yield row
+                else:
+                    stats["skipped"] += 1
+
+    def backfill_embeddings(self, embed_model, batch_size: int = 64, workers: int = 4,
+                            dimension: int = 1024, force: bool = False) -> Dict[str, int]:
+        """为图中节点批量生成并写回嵌入（可中断后重跑）。
+
+        - 流式扫描节点，跳过嵌入已存在且文本哈希（n.embedding_hash）未变化的节点；
+        - 每批由 embed_model 一次批量嵌入，再以一个 UNWIND $rows 写事务写回向量、哈希并打上 Chunk 标签；
+        - workers 个线程并发处理，在途批次数受限；每批独立提交，中断后重跑只处理剩余节点。
+        """
+        self.ensure_vector_indexes(dimension)
+        model_name = getattr(embed_model, "model_name", embed_model.__class__.__name__)
+        stats = {"scanned": 0, "skipped": 0, "embedded": 0, "failed": 0}
+
+        def work(rows: List[Dict[str, Any]]) -> int:
+            vectors = embed_model.get_text_embedding_batch([r["text"] for r in rows])
+            bad = [len(v) for v in vectors if len(v) != dimension]
+            if bad:
+                raise ValueError(f"嵌入维度为 {bad[0]}，与向量索引维度 {dimension} 不一致")
+            payload = [{"id": r["id"], "embedding": list(v), "hash": r["hash"]} for r, v in zip(rows, vectors)]
+            with self.driver.session() as session:
+                session.execute_write(lambda tx: tx.run(WRITE_EMBEDDINGS_CYPHER, rows=payload).consume())
+            return len(rows)
+
+        def collect(done) -> None:
+            for fut in done:
+                size = inflight.pop(fut)
+                try:
+                    stats["embedded"] += fut.result()
+                except Exception as e:
+                    stats["failed"] += size
+                    print(f"❌ 回填批次失败（{size} 个节点，重跑时会重试）: {e}")
+            print(f"📥 已写回 {stats['embedded']} 个节点嵌入（扫描 {stats['scanned']}，"
+                  f"跳过 {stats['skipped']}，失败 {stats['failed']}）")
+
+        inflight: Dict[Future, int] = {}
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for rows in batched(self._iter_stale_nodes(model_name, force, stats), batch_size):
+                if len(inflight) >= 2 * max(1, workers):
+                    done, _ = wait(list(inflight), return_when=FIRST_COMPLETED)
+                    collect(done)
+                inflight[pool.submit(work, rows)] = len(rows)
+            if inflight:
+                collect(wait(list(inflight)).done)
+        return stats
+
     def _get_query_engine(self):
         """获取或创建查询引擎（基于Neo4j混合搜索，延迟初始化）"""
         if self._query_engine is None:
             print("🔄 正在构建向量索引...")
-            llm, embed_model = QianwenLLM(), QianwenEmbedding()
+            llm, embed_model = QianwenLLM(), QianwenEmbedding(cache=get_embedding_cache())
             index = None
             try:
                 print("💾 尝试从 Neo4j 混合向量存储构建索引...")
@@ -41,64 +275,85 @@ class Neo4jManager:
             except Exception as e:
                 print(f"⚠️ 基于向量存储构建索引失败，将回退全量构建：{e}")
             
-            # 如果Neo4jVectorStore失败，回退到直接构建
+            # 如果Neo4jVectorStore失败，回退到直接构建：单游标流式导出节点，分批嵌入并写入索引
             if index is None:
-                print("📊 从 Neo4j 分页拉取全部节点并构建索引...")
-                docs, batch_size, total, skip = [], 5000, 0, 0
-                with self.driver.session() as session:
-                    while True:
-                        cypher = (
-                            "MATCH (n) WHERE n.name IS NOT NULL "
-                            "RETURN n SKIP $skip LIMIT $limit"
-                        )
-                        records = list(session.run(cypher, skip=skip, limit=batch_size))
-                        if not records:
-                            break
-                        for rec in records:
-                            node, properties = rec["n"], dict(node)
-                            docs.append(Document(
-                                text=f"{properties.get('name','')}，{list(node.labels)}。{properties.get('desc','')}",
-                                metadata={"name": properties.get('name'), "labels": list(node.labels)}
-                            ))
-                        total, skip = total + len(records), skip + batch_size
-                        print(f"📥 已加载 {total} 条节点为文档...")
+                print("📊 从 Neo4j 流式导出全部节点并分批构建索引...")
+                index = VectorStoreIndex(nodes=[], embed_model=embed_model)
+                total = 0
+                for docs in batched(self.iter_node_documents(), 500):
+                    index.insert_nodes(Settings.node_parser.get_nodes_from_documents(docs))
+                    total += len(docs)
+                    print(f"📥 已导入 {total} 条节点...")
                 
-                if not docs: 
+                if not total: 
                     raise RuntimeError("未从 Neo4j 拉取到任何节点，无法构建向量索引")
-                print(f"📚 全量节点文档数：{len(docs)}，开始构建混合向量索引...")
-                index = VectorStoreIndex.from_documents(docs, embed_model=embed_model)
+                print(f"📚 全量节点文档数：{total}")
             
             self._query_engine = index
             print("✅ Neo4j混合检索引擎初始化完成")
         return self._query_engine
         
+    def _format_nodes(self, nodes, rank_based: bool = False) -> str:
+        """把检索结果（按 token 预算打包后）拼接为提示词中的知识库文本；rank_based 表示得分为 RRF 融合分。"""
+        if not nodes:
+            return "未找到相关信息"
+        docs = [(n.node.get_content(), n.score) for n in nodes if getattr(n, 'node', None)]
+        if self.context_packer is None:
+            return "\n".join(text for text, _ in docs)
+        return self.context_packer.pack(docs, rank_based=rank_based) or "未找到相关信息"
+
+    def search_medical_info(self, medical_text: str) -> str:
+        """基于外部向量库（Chroma + LlamaIndex）检索相关医疗信息（直接使用 medical_text 作为查询）；出错时抛出异常。"""
+        # 1) 直接将 medical_text 作为查询语句
+        query_text = str(medical_text).strip()
+        if not query_text:
+            return ""
+        # 2) 获取共享的外部向量数据库（需与入库时配置一致，首次调用时构建）
+        vector_db = self.registry.get(self.retriever_key)
+        if not self.registry.is_ready(self.retriever_key):
+            return "向量库为空或未初始化"
+        # 3) 执行检索
+        with get_tracer().span("retrieval.vector", kind="client", top_k=10,
+                               prompt_chars=len(query_text)) as sp:
+            nodes = vector_db.search(query_text, top_k=10)
+            info = self._format_nodes(nodes, rank_based=getattr(vector_db, "search_mode", "dense") == "hybrid")
+            if sp is not None:
+                sp.set(retrieved_docs=len(nodes or []), context_tokens=estimate_tokens(info))
+        return info
+
     def retrieve_medical_info(self, medical_text: str) -> str:
-        """基于外部向量库（Chroma + LlamaIndex）检索相关医疗信息（直接使用 medical_text 作为查询）。"""
+        """search_medical_info 的容错版本：出错时返回错误说明文本。"""
         try:
-            # 1) 直接将 medical_text 作为查询语句
-            query_text = str(medical_text).strip()
-            if not query_text:
-                return ""
-            # 2) 初始化外部向量数据库（需与入库时配置一致）
-            VECTOR_DB_PATH = "./chroma_store"
-            COLLECTION_NAME = "drug_info"
-            EMBEDDING_MODEL = "bge-m3"
-            OLLAMA_BASE_URL = "http://localhost:11434"
-            embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL, base_url=OLLAMA_BASE_URL)
-            vector_db = VectorDatabaseFactory.create(
-                embeddings=embeddings,
-                vector_db_path=VECTOR_DB_PATH,
-                collection_name=COLLECTION_NAME,
-            )
-            stats = vector_db.get_stats()
-            if stats.get("status") != "initialized" or stats.get("documents_count", 0) == 0:
-                return "向量库为空或未初始化"
-            # 3) 执行检索
-            nodes = vector_db.search(query_text, top_k=10)
-            if not nodes:
-                return "未找到相关信息"
-            results = [n.node.get_content() for n in nodes if getattr(n, 'node', None)]
-            return "\n".join(results)
+            return self.search_medical_info(medical_text)
         except Exception as e:
             print(f"❌ 检索过程中出错: {e}")
-            return f"检索过程中出现错误: {e}"
\ No newline at end of file
+            return f"检索过程中出现错误: {e}"
+
+    def search_medical_info_many(self, medical_texts: List[str]) -> List[str]:
+        """批量检索：一次嵌入全部查询并一起打分，结果与逐条调用 search_medical_info 一一对应；出错时抛出异常。"""
+        queries = [str(t).strip() for t in medical_texts]
+        results = ["" for _ in queries]
+        todo = [i for i, q in enumerate(queries) if q]
+        if not todo:
+            return results
+        vector_db = self.registry.get(self.retriever_key)
+        if not self.registry.is_ready(self.retriever_key):
+            return ["向量库为空或未初始化" if q else "" for q in queries]
+        with get_tracer().span("retrieval.vector_many", kind="client", top_k=10, inputs=len(todo),
+                               prompt_chars=sum(len(queries[i]) for i in todo)) as sp:
+            batches = vector_db.search_many([queries[i] for i in todo], top_k=10)
+            rank_based = getattr(vector_db, "search_mode", "dense") == "hybrid"
+            for i, nodes in zip(todo, batches):
+                results[i] = self._format_nodes(nodes, rank_based=rank_based)
+            if sp is not None:
+                sp.set(retrieved_docs=sum(len(b) for b in batches),
+                       context_tokens=sum(estimate_tokens(results[i]) for i in todo))
+        return results
+
+    def retrieve_medical_info_many(self, medical_texts: List[str]) -> List[str]:
+        """search_medical_info_many 的容错版本：出错时每条返回错误说明文本。"""
+        try:
+            return self.search_medical_info_many(medical_texts)
+        except Exception as e:
+            print(f"❌ 批量检索过程中出错: {e}")
+            return [f"检索过程中出现错误: {e}" if str(q).strip() else "" for q in medical_texts]
\ No newline at end of file
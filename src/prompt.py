@@ -19,6 +19,7 @@ recommend_prompt="""
 ## 输入
 - 患者住院电子病历文本（JSON格式）
 - 从知识库中检索到的与病历相关的信息
+- 病历中提及的候选药物（按名称规则匹配得到，仅供参考）
 
 ## 输出格式要求
 输出仅包含JSON数组，数组中每个元素为一个对象，且不能包含任何其他文本或解释，可以与知识库中检索到的信息无关。
@@ -26,6 +27,51 @@ recommend_prompt="""
 
 #输入： 病历信息：{{text1}}
        知识库检索内容：{{text2}}
+       病历中提及的候选药物：{{text3}}
+"""
+
+# 多病历合并调用：固定前缀逐字节不变（不含任何病历相关内容），便于服务端前缀缓存复用；
+# 其后依次拼接各病历块（batch_record_prompt）与要求输出的编号（batch_recommend_suffix）
+batch_recommend_prefix="""
+## 角色定位
+您是一名资深的内分泌科主任医师，具有20年代谢性疾病临床诊疗经验。您精通糖尿病、高血压、脂肪肝等各种慢性病的药物治疗方案制定，熟悉各类药物的适应症、禁忌症和相互作用。您擅长从复杂的病历中提取关键临床信息，并基于最新临床指南为患者推荐药物。接下来你会一次收到多段病历，每段病历带有编号，你将分别针对每段病历生成推荐的药物。
+
+## 任务指令
+请基于给定的每位患者的住院电子病历信息，分别生成准确的出院带药推荐列表。具体要求：
+1.综合分析患者住院期间的病情演变、治疗方案和营养摄入情况
+2.根据主要诊断、并发症以及病历中记载的患者日常饮食习惯（如碳水化合物摄入量、脂质代谢情况、钠盐摄入等）
+3.结合患者的食物摄入模式和营养代谢特点
+4.确保推荐药物既能有效控制疾病，又能与患者的饮食模式相匹配
+5.特别注意食物和药物相互作用，避免影响药效或产生不良反应
+6.考虑患者的长期营养管理和用药依从性
+7.给出推荐的药物列表，确保所有推荐药物均在候选药物范围内
+8.各段病历相互独立，只依据该段病历及其对应的知识库检索内容推荐，不要混用其他病历的信息
+
+## 相关上下文
+临床背景：代谢性疾病的药物治疗效果与饮食营养密切关联。例如：糖尿病患者的碳水化合物摄入量影响降糖药物选择和剂量调整，高血压患者的钠盐摄入与降压药物疗效直接相关，脂质代谢异常患者的脂肪摄入与他汀类药物使用需要协同考虑，饮食习惯也会影响药物吸收和代谢过程
+技术约束：基于真实电子病历数据，候选药物限制在651种范围内，需要从病历文本中提取饮食相关信息并匹配相应药物。
+
+## 输入
+每段病历以“### 病历 编号”开头，包含：
+- 患者住院电子病历文本（JSON格式）
+- 从知识库中检索到的与该病历相关的信息
+- 该病历中提及的候选药物（按名称规则匹配得到，仅供参考）
+
+## 输出格式要求
+输出仅包含一个JSON对象，键为病历编号，值为该病历推荐药物名称组成的JSON数组，例如 {"R1": ["药物1", "药物2"], "R2": ["药物3"]}；每个编号都必须出现，且不能包含任何其他文本或解释。
+
+# 输入：
+"""
+
+batch_record_prompt="""
+### 病历 {{rid}}
+病历信息：{{text1}}
+知识库检索内容：{{text2}}
+病历中提及的候选药物：{{text3}}
+"""
+
+batch_recommend_suffix="""
+请输出包含以下全部编号的JSON对象：{{rids}}
 """
 
 query_prompt="""
@@ -1,7 +1,7 @@
 #这个是ai生成的用于使用llamaindex的类
 
 import asyncio
-from typing import List, Optional, Generator, Any
+from typing import List, Optional, Generator, AsyncGenerator, Any, Dict, Tuple
 from llama_index.core.embeddings import BaseEmbedding
 from llama_index.core.llms import LLM
 from llama_index.core.base.llms.types import (
@@ -11,97 +11,309 @@ from llama_index.core.base.llms.types import (
     ChatMessage,
     MessageRole,
 )
+from llama_index.core.bridge.pydantic import PrivateAttr
 from openai import OpenAI as OpenAIClient
+from openai import AsyncOpenAI as AsyncOpenAIClient
 import asyncio
+import threading
+import time
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from util import LoopLocal, ThinkBlockFilter, estimate_tokens
+from embedding_cache import EmbeddingCache
+from llm_cache import LLMResponseCache
+from tracing import get_tracer
 from typing import List, Optional, Generator, Any
 
 class QianwenEmbedding(BaseEmbedding):
-    """基于 vLLM bge-m3 嵌入服务的自定义嵌入类。"""
+    """基于 vLLM bge-m3 嵌入服务的自定义嵌入类。
+
+    批量文本以列表形式一次性发送到 OpenAI 兼容的 /v1/embeddings 接口，
+    每批受 embed_batch_size 与 max_batch_tokens 双重限制；同步/异步请求分别复用
+    持久化的 keep-alive 连接池（requests.Session / httpx.AsyncClient）。
+    传入 cache（EmbeddingCache）时先查询缓存，只对未命中的文本发起请求。
+    """
     embed_dim: int = 1024  # bge-m3 的嵌入维度
     api_key: str = "sk-dummy"
     api_base: str = "http://localhost:11434"  # 保留主机:端口
+    model_name: str = "bge-m3"
+    embed_batch_size: int = 64  # 每次请求最多包含的文本条数
+    max_batch_tokens: int = 8192  # 每次请求的估算 token 上限
+    timeout: float = 30.0
+    pool_maxsize: int = 16  # 连接池大小（同步与异步各一份）
+
+    _session: Any = PrivateAttr(default=None)
+    _async_clients: Any = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _cache: Any = PrivateAttr(default=None)
 
-    def __init__(self, api_key: str = "sk-dummy", api_base: str = "http://localhost:11434", embed_dim: int = 1024, **kwargs):
+    def __init__(self, api_key: str = "sk-dummy", api_base: str = "http://localhost:11434", embed_dim: int = 1024,
+                 cache: Optional[EmbeddingCache] = None, **kwargs):
         super().__init__(embed_dim=embed_dim, api_key=api_key, api_base=api_base, **kwargs)
+        self._cache = cache
+        self._async_clients = LoopLocal(self._new_async_client, lambda c: c.aclose(), name="嵌入异步连接池")
+
+    @property
+    def cache(self) -> Optional[EmbeddingCache]:
+        return self._cache
 
     def _new_client(self) -> OpenAIClient:
         return OpenAIClient(api_key=self.api_key, base_url=self.api_base)
 
-    def _get_query_embedding(self, query: str) -> List[float]:
+    # ---- 连接与请求构造 ----
+    def _embeddings_url(self) -> str:
         # 直接调用完整 embeddings 接口，避免 OpenAIClient 拼接路径带来 404
-        url = f"{self.api_base.rstrip('/')}/v1/embeddings"
+        return f"{self.api_base.rstrip('/')}/v1/embeddings"
+
+    def _headers(self) -> dict:
         headers = {"Content-Type": "application/json"}
         if self.api_key:
             headers["Authorization"] = f"Bearer {self.api_key}"
-        payload = {"model": "bge-m3", "input": query}
-        r = requests.post(url, json=payload, headers=headers, timeout=30)
-        r.raise_for_status()
-        j = r.json()
+        return headers
+
+    def _get_session(self) -> requests.Session:
+        """获取（必要时创建）线程间共享的 keep-alive 会话。"""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    session.headers.update(self._headers())
+                    self._session = session
+        return self._session
+
+    def _new_async_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            headers=self._headers(),
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.pool_maxsize, max_keepalive_connections=self.pool_maxsize),
+        )
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """获取当前事件循环下的共享异步客户端（httpx 连接池与事件循环绑定，按事件循环分别创建）。"""
+        return self._async_clients.get()
+
+    def close(self) -> None:
+        """关闭同步连接池。"""
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    async def aclose(self) -> None:
+        """关闭异步连接池（含其他仍在运行的事件循环上创建的连接池）。"""
+        await self._async_clients.aclose()
+
+    def _split_batches(self, texts: List[str]) -> List[List[str]]:
+        """按条数与估算 token 数切分批次；单条超过 token 上限时独占一批。"""
+        batches: List[List[str]] = []
+        cur: List[str] = []
+        cur_tokens = 0
+        for t in texts:
+            n = estimate_tokens(t)
+            if cur and (len(cur) >= self.embed_batch_size or cur_tokens + n > self.max_batch_tokens):
+                batches.append(cur)
+                cur, cur_tokens = [], 0
+            cur.append(t)
+            cur_tokens += n
+        if cur:
+            batches.append(cur)
+        return batches
+
+    @staticmethod
+    def _parse_embeddings(j: Any, expected: int) -> List[List[float]]:
+        """解析 OpenAI 兼容响应，并按 index 还原为输入顺序。"""
         if isinstance(j, dict) and "data" in j and j["data"]:
-            item = j["data"][0]
-            return item.get("embedding") or item.get("vector") or item
-        if isinstance(j, list) and j and isinstance(j[0], (list, float)):
-            return j[0]
-        raise ValueError("无法解析嵌入响应: " + str(j))
+            items = sorted(j["data"], key=lambda it: it.get("index", 0))
+            vectors = [it.get("embedding") or it.get("vector") for it in items]
+        elif isinstance(j, list) and j and isinstance(j[0], list):
+            vectors = j
+        else:
+            raise ValueError("无法解析嵌入响应: " + str(j)[:500])
+        if len(vectors) != expected or any(v is None for v in vectors):
+            raise ValueError(f"嵌入响应条数不匹配: 期望 {expected}，实际 {len(vectors)}")
+        return vectors
+
+    def _post_batch(self, batch: List[str]) -> List[List[float]]:
+        payload = {"model": self.model_name, "input": batch}
+        with get_tracer().span("embedding.request", kind="client", model=self.model_name,
+                               inputs=len(batch), prompt_chars=sum(len(t) for t in batch)):
+            r = self._get_session().post(self._embeddings_url(), json=payload, timeout=self.timeout)
+            r.raise_for_status()
+            return self._parse_embeddings(r.json(), len(batch))
+
+    async def _apost_batch(self, batch: List[str]) -> List[List[float]]:
+        payload = {"model": self.model_name, "input": batch}
+        with get_tracer().span("embedding.request", kind="client", model=self.model_name,
+                               inputs=len(batch), prompt_chars=sum(len(t) for t in batch)):
+            r = await self._get_async_client().post(self._embeddings_url(), json=payload)
+            r.raise_for_status()
+            return self._parse_embeddings(r.json(), len(batch))
+
+    def _embed_uncached(self, texts: List[str]) -> List[List[float]]:
+        results: List[List[float]] = []
+        for batch in self._split_batches(texts):
+            results.extend(self._post_batch(batch))
+        return results
+
+    async def _aembed_uncached(self, texts: List[str]) -> List[List[float]]:
+        batches = self._split_batches(texts)
+        outputs = await asyncio.gather(*(self._apost_batch(b) for b in batches))
+        return [v for out in outputs for v in out]
+
+    # ---- BaseEmbedding 接口 ----
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._get_text_embeddings([query])[0]
 
     def _get_text_embedding(self, text: str) -> List[float]:
         return self._get_query_embedding(text)
 
     def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
-        return [self._get_text_embedding(t) for t in texts]
+        with get_tracer().span("embedding.embed", model=self.model_name, inputs=len(texts)) as sp:
+            if self._cache is None:
+                return self._embed_uncached(texts)
+            computed = [0]
+
+            def compute(ts: List[str]) -> List[List[float]]:
+                computed[0] += len(ts)
+                return self._embed_uncached(ts)
+
+            vectors = self._cache.get_or_compute(self.model_name, texts, compute)
+            if sp is not None:
+                sp.set(cache_hits=len(texts) - computed[0])
+            return vectors
 
     async def _aget_query_embedding(self, query: str) -> List[float]:
-        return await asyncio.to_thread(self._get_query_embedding, query)
+        return (await self._aget_text_embeddings([query]))[0]
 
     async def _aget_text_embedding(self, text: str) -> List[float]:
-        return await asyncio.to_thread(self._get_text_embedding, text)
+        return await self._aget_query_embedding(text)
 
     async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
-        return await asyncio.gather(*(self._aget_text_embedding(t) for t in texts))
+        with get_tracer().span("embedding.embed", model=self.model_name, inputs=len(texts)) as sp:
+            if self._cache is None:
+                return await self._aembed_uncached(texts)
+            computed = [0]
+
+            async def acompute(ts: List[str]) -> List[List[float]]:
+                computed[0] += len(ts)
+                return await self._aembed_uncached(ts)
+
+            vectors = await self._cache.aget_or_compute(self.model_name, texts, acompute)
+            if sp is not None:
+                sp.set(cache_hits=len(texts) - computed[0])
+            return vectors
 
 
 class QianwenLLM(LLM):
-    """基于 vLLM carebot-llama3 服务的自定义 LLM 适配类。"""
+    """基于 vLLM carebot-llama3 服务的自定义 LLM 适配类。
+
+    每个实例持有一个共享的同步 OpenAI 客户端和一个 AsyncOpenAI 客户端（各自带连接池），
+    acomplete/achat 直接走异步客户端，不再为每次调用占用一个线程。
+    传入 response_cache（LLMResponseCache）时，temperature=0 的 complete/acomplete 结果会被缓存，
+    并发的相同提示词只请求一次；cache_bypass=True 或调用时 use_cache=False 会跳过读缓存（结果仍写回）。
+    """
 
     api_key: str = ""  # vLLM 不需要真实的 API key
     api_base: str = "http://localhost:11434/v1"  # 仅主机:端口（不要包含 /v1 或具体路径）
     model: str = "qwq:latest"  # 你的模型名称
     temperature: float = 0.0
+    max_tokens: int = 1024
+    context_window: int = 8192  # 服务端模型的上下文窗口（合并推荐调用按它分组）
+    timeout: float = 300.0  # 单次请求超时（秒）
+    connect_timeout: float = 10.0
+    max_connections: int = 256  # 连接池上限（同步与异步各一份）
+    max_keepalive_connections: int = 64
+    max_retries: int = 2
+    stream_filter_think: bool = False  # 流式输出时默认是否实时剔除 <think> 块
+    cache_bypass: bool = False  # 需要全新输出时跳过响应缓存读取
+
+    _client: Any = PrivateAttr(default=None)
+    _async_clients: Any = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _response_cache: Any = PrivateAttr(default=None)
+
+    def __init__(self, response_cache: Optional[LLMResponseCache] = None, **kwargs):
+        super().__init__(**kwargs)
+        self._response_cache = response_cache
+        self._async_clients = LoopLocal(self._new_async_client, lambda c: c.close(), name="LLM 异步客户端")
+
+    @property
+    def response_cache(self) -> Optional[LLMResponseCache]:
+        return self._response_cache
+
+    def _client_api_key(self) -> str:
+        # 新版 openai SDK 拒绝空 key，vLLM 不校验，用占位值即可
+        return self.api_key or "sk-dummy"
+
+    def _http_limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+        )
+
+    def _http_timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.timeout, connect=self.connect_timeout)
 
     def _new_client(self) -> OpenAIClient:
-        return OpenAIClient(api_key=self.api_key, base_url=self.api_base)
+        return OpenAIClient(
+            api_key=self._client_api_key(),
+            base_url=self.api_base,
+            max_retries=self.max_retries,
+            http_client=httpx.Client(limits=self._http_limits(), timeout=self._http_timeout()),
+        )
+
+    def _get_client(self) -> OpenAIClient:
+        """获取（必要时创建）线程间共享的同步客户端。"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._new_client()
+        return self._client
+
+    def _new_async_client(self) -> AsyncOpenAIClient:
+        return AsyncOpenAIClient(
+            api_key=self._client_api_key(),
+            base_url=self.api_base,
+            max_retries=self.max_retries,
+            http_client=httpx.AsyncClient(limits=self._http_limits(), timeout=self._http_timeout()),
+        )
+
+    def _get_async_client(self) -> AsyncOpenAIClient:
+        """获取当前事件循环下的共享异步客户端（httpx 连接池与事件循环绑定，按事件循环分别创建）。"""
+        return self._async_clients.get()
+
+    def close(self) -> None:
+        """关闭同步客户端连接池。"""
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def aclose(self) -> None:
+        """关闭异步客户端连接池（含其他仍在运行的事件循环上创建的客户端）。"""
+        await self._async_clients.aclose()
 
     @property
     def metadata(self) -> LLMMetadata:
         return LLMMetadata(
-            context_window=8192,
-            num_output=1024,
+            context_window=self.context_window,
+            num_output=self.max_tokens,
             is_chat_model=True,
             model_name=self.model,
         )
 
-    # ---- Completion API ----
-    def complete(self, prompt: str, **kwargs) -> CompletionResponse:
-        client = self._new_client()
-        resp = client.chat.completions.create(
-            model=self.model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=self.temperature,
-            max_tokens=1024,
-        )
-        text = resp.choices[0].message.content
-        cr = CompletionResponse(text=text)
-        # cr.message = ChatMessage(role=MessageRole.ASSISTANT, content=text)
-        return cr
+    def _request_kwargs(self, messages: List[dict], **kwargs) -> dict:
+        return {
+            "model": self.model,
+            "messages": messages,
+            "temperature": kwargs.get("temperature", self.temperature),
+            "max_tokens": kwargs.get("max_tokens", self.max_tokens),
+        }
 
-    async def acomplete(self, prompt: str, **kwargs) -> CompletionResponse:
-        cr = await asyncio.to_thread(self.complete, prompt, **kwargs)
-        return cr
-
-    # ---- Chat API ----
-    def chat(self, messages: List[Any], **kwargs) -> ChatResponse:
-        client = self._new_client()
+    @staticmethod
+    def _to_openai_messages(messages: List[Any]) -> List[dict]:
         openai_msgs = []
         for m in messages:
             role = getattr(m, "role", None)
@@ -110,30 +322,176 @@ class QianwenLLM(LLM):
                 role = role or m.get("role")
                 content = m.get("content")
             if content:
+                role = getattr(role, "value", role)
                 openai_msgs.append({"role": role or "user", "content": content})
         if not openai_msgs:
             openai_msgs = [{"role": "user", "content": ""}]
-        resp = client.chat.completions.create(
-            model=self.model,
-            messages=openai_msgs,
-            temperature=self.temperature,
-            max_tokens=1024,
+        return openai_msgs
+
+    def _cache_for(self, request: dict) -> Optional[LLMResponseCache]:
+        """仅确定性请求（temperature=0）使用响应缓存。"""
+        if self._response_cache is None or request["temperature"] != 0:
+            return None
+        return self._response_cache
+
+    @staticmethod
+    def _record_usage(resp: Any, messages: List[Dict[str, Any]]) -> None:
+        """把上游返回的 token 用量记到当前 span（服务端未返回 usage 时按请求消息与回复文本估算）。"""
+        usage = getattr(resp, "usage", None)
+        text = resp.choices[0].message.content or ""
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        if not prompt_tokens:
+            prompt_tokens = sum(estimate_tokens(str(m.get("content") or "")) for m in messages)
+        get_tracer().annotate(
+            cache_hits=0,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=getattr(usage, "completion_tokens", None) or estimate_tokens(text),
         )
+
+    # ---- Completion API ----
+    def _complete_text(self, request: dict) -> str:
+        resp = self._get_client().chat.completions.create(**request)
+        self._record_usage(resp, request["messages"])
+        # content 可能为 None（如只返回工具调用或被内容过滤）
+        return resp.choices[0].message.content or ""
+
+    async def _acomplete_text(self, request: dict) -> str:
+        resp = await self._get_async_client().chat.completions.create(**request)
+        self._record_usage(resp, request["messages"])
+        return resp.choices[0].message.content or ""
+
+    def complete(self, prompt: str, **kwargs) -> CompletionResponse:
+        refresh = self.cache_bypass or not kwargs.pop("use_cache", True)
+        request = self._request_kwargs([{"role": "user", "content": prompt}], **kwargs)
+        cache = self._cache_for(request)
+        # cache_hits 先记为 1，真正请求上游时由 _record_usage 改为 0；等待同 key 在途请求的调用由缓存改记为 coalesced
+        with get_tracer().span("llm.complete", kind="client", model=self.model, prompt_chars=len(prompt),
+                               cache_hits=int(cache is not None)):
+            if cache is None:
+                text = self._complete_text(request)
+            else:
+                key = cache.make_key(self.model, request["temperature"], request["max_tokens"], prompt)
+                text = cache.get_or_call(key, self.model, lambda: self._complete_text(request), refresh=refresh)
+        cr = CompletionResponse(text=text)
+        # cr.message = ChatMessage(role=MessageRole.ASSISTANT, content=text)
+        return cr
+
+    async def acomplete(self, prompt: str, **kwargs) -> CompletionResponse:
+        refresh = self.cache_bypass or not kwargs.pop("use_cache", True)
+        request = self._request_kwargs([{"role": "user", "content": prompt}], **kwargs)
+        cache = self._cache_for(request)
+        with get_tracer().span("llm.complete", kind="client", model=self.model, prompt_chars=len(prompt),
+                               cache_hits=int(cache is not None)):
+            if cache is None:
+                text = await self._acomplete_text(request)
+            else:
+                key = cache.make_key(self.model, request["temperature"], request["max_tokens"], prompt)
+                text = await cache.aget_or_call(key, self.model, lambda: self._acomplete_text(request),
+                                                refresh=refresh)
+        return CompletionResponse(text=text)
+
+    # ---- Chat API ----
+    def chat(self, messages: List[Any], **kwargs) -> ChatResponse:
+        openai_msgs = self._to_openai_messages(messages)
+        with get_tracer().span("llm.chat", kind="client", model=self.model,
+                               prompt_chars=sum(len(m["content"]) for m in openai_msgs)):
+            resp = self._get_client().chat.completions.create(**self._request_kwargs(openai_msgs, **kwargs))
+            self._record_usage(resp, openai_msgs)
         text = resp.choices[0].message.content
         return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=text))
 
     async def achat(self, messages: List[Any], **kwargs) -> ChatResponse:
-        return await asyncio.to_thread(self.chat, messages, **kwargs)
+        openai_msgs = self._to_openai_messages(messages)
+        with get_tracer().span("llm.chat", kind="client", model=self.model,
+                               prompt_chars=sum(len(m["content"]) for m in openai_msgs)):
+            resp = await self._get_async_client().chat.completions.create(**self._request_kwargs(openai_msgs, **kwargs))
+            self._record_usage(resp, openai_msgs)
+        text = resp.choices[0].message.content
+        return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=text))
+
+    # ---- Streaming APIs ----
+    @staticmethod
+    def _chunk_delta(chunk: Any) -> str:
+        choices = getattr(chunk, "choices", None) or []
+        if not choices:
+            return ""
+        delta = getattr(choices[0], "delta", None)
+        return (getattr(delta, "content", None) or "") if delta is not None else ""
+
+    def _iter_stream(self, messages: List[dict], **kwargs) -> Generator[Tuple[str, str, float], None, None]:
+        """同步流式请求，逐段产出 (累计文本, 增量文本, 首 token 延迟秒数)。"""
+        think_filter = ThinkBlockFilter() if kwargs.pop("filter_think", self.stream_filter_think) else None
+        start = time.perf_counter()
+        ttft: Optional[float] = None
+        text = ""
+        stream = self._get_client().chat.completions.create(stream=True, **self._request_kwargs(messages, **kwargs))
+        for chunk in stream:
+            delta = self._chunk_delta(chunk)
+            if not delta:
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            if think_filter is not None:
+                delta = think_filter.feed(delta)
+            if delta:
+                text += delta
+                yield text, delta, ttft
+        tail = think_filter.flush() if think_filter is not None else ""
+        if tail:
+            text += tail
+            yield text, tail, ttft if ttft is not None else time.perf_counter() - start
+
+    async def _aiter_stream(self, messages: List[dict], **kwargs) -> AsyncGenerator[Tuple[str, str, float], None]:
+        """_iter_stream 的异步版本。"""
+        think_filter = ThinkBlockFilter() if kwargs.pop("filter_think", self.stream_filter_think) else None
+        start = time.perf_counter()
+        ttft: Optional[float] = None
+        text = ""
+        stream = await self._get_async_client().chat.completions.create(
+            stream=True, **self._request_kwargs(messages, **kwargs)
+        )
+        async for chunk in stream:
+            delta = self._chunk_delta(chunk)
+            if not delta:
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            if think_filter is not None:
+                delta = think_filter.feed(delta)
+            if delta:
+                text += delta
+                yield text, delta, ttft
+        tail = think_filter.flush() if think_filter is not None else ""
+        if tail:
+            text += tail
+            yield text, tail, ttft if ttft is not None else time.perf_counter() - start
 
-    # ---- Streaming APIs (简化为非流式fallback) ----
     def stream_complete(self, prompt: str, **kwargs) -> Generator[CompletionResponse, None, None]:
-        yield self.complete(prompt, **kwargs)
+        """逐段产出 CompletionResponse（text 为累计文本，delta 为增量，additional_kwargs["ttft"] 为首 token 延迟）；
+        filter_think=True 时在流中实时剔除 <think> 块。"""
+        for text, delta, ttft in self._iter_stream([{"role": "user", "content": prompt}], **kwargs):
+            yield CompletionResponse(text=text, delta=delta, additional_kwargs={"ttft": ttft})
 
-    async def astream_complete(self, prompt: str, **kwargs) -> Generator[CompletionResponse, None, None]:
-        yield await self.acomplete(prompt, **kwargs)
+    async def astream_complete(self, prompt: str, **kwargs) -> AsyncGenerator[CompletionResponse, None]:
+        async def gen() -> AsyncGenerator[CompletionResponse, None]:
+            async for text, delta, ttft in self._aiter_stream([{"role": "user", "content": prompt}], **kwargs):
+                yield CompletionResponse(text=text, delta=delta, additional_kwargs={"ttft": ttft})
+        return gen()
 
     def stream_chat(self, messages: List[Any], **kwargs) -> Generator[ChatResponse, None, None]:
-        yield self.chat(messages, **kwargs)
+        for text, delta, ttft in self._iter_stream(self._to_openai_messages(messages), **kwargs):
+            yield ChatResponse(
+                message=ChatMessage(role=MessageRole.ASSISTANT, content=text),
+                delta=delta,
+                additional_kwargs={"ttft": ttft},
+            )
 
-    async def astream_chat(self, messages: List[Any], **kwargs) -> Generator[ChatResponse, None, None]:
-        yield await self.achat(messages, **kwargs)
+    async def astream_chat(self, messages: List[Any], **kwargs) -> AsyncGenerator[ChatResponse, None]:
+        async def gen() -> AsyncGenerator[ChatResponse, None]:
+            async for text, delta, ttft in self._aiter_stream(self._to_openai_messages(messages), **kwargs):
+                yield ChatResponse(
+                    message=ChatMessage(role=MessageRole.ASSISTANT, content=text),
+                    delta=delta,
+                    additional_kwargs={"ttft": ttft},
+                )
+        return gen()
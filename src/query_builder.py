@@ -0,0 +1,272 @@
+"""
+本地词法检索 query 生成
+
+不调用 LLM，直接从病历中拼出检索 query：
+- 出院诊断术语（去重保序）与主诉原文；
+- 诊疗过程描述中的关键术语：领域词表（候选药物名 + 语料中出现过的出院诊断 + 内置临床词）
+  多模式匹配后按 TF-IDF 排序，词表未覆盖的部分以字符二元组 IDF 权重挑出高权重连续片段补充。
+语料统计（文档频次）预先计算并缓存为 JSON，语料文件与额外词表不变时直接加载。
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from drug_matcher import DrugMatcher
+from util import extract_diagnoses
+
+
+DEFAULT_STATS_PATH = "./cache/query_stats.json"
+STATS_VERSION = 1
+
+# 语料中未必以出院诊断形式出现、但对选药有提示作用的临床词
+BUILTIN_TERMS = (
+    "血糖", "空腹血糖", "餐后血糖", "糖化血红蛋白", "胰岛素", "胰岛功能", "C肽", "酮症", "低血糖",
+    "血压", "心率", "血脂", "胆固醇", "甘油三酯", "低密度脂蛋白", "尿酸", "肌酐", "肾功能", "肝功能",
+    "尿蛋白", "微量白蛋白", "甲状腺功能", "骨密度", "维生素D", "血钾", "血钙", "贫血", "感染",
+    "降糖", "降压", "调脂", "降尿酸", "抗血小板", "抗凝", "抗感染", "护胃", "营养神经", "改善循环",
+    "低盐饮食", "低脂饮食", "糖尿病饮食", "控制饮食",
+)
+
+KEY_TERM_FIELDS = ("诊疗过程描述",)
+
+_CJK_RUN_RE = re.compile(r"[一-鿿]+")
+
+
+def cjk_bigrams(text: str) -> List[Tuple[int, str]]:
+    """文本中各汉字连续段内的 (位置, 二元组)。"""
+    grams: List[Tuple[int, str]] = []
+    for m in _CJK_RUN_RE.finditer(text):
+        run, base = m.group(0), m.start()
+        grams.extend((base + i, run[i:i + 2]) for i in range(len(run) - 1))
+    return grams
+
+
+def _field(obj: dict, key: str) -> str:
+    v = obj.get(key)
+    if isinstance(v, list):
+        return "、".join(map(str, v))
+    return "" if v is None else str(v).strip()
+
+
+def _key_text(obj: dict, fields: Sequence[str] = KEY_TERM_FIELDS) -> str:
+    return "\n".join(t for t in (_field(obj, k) for k in fields) if t)
+
+
+def _parse(medical_text: str) -> dict:
+    try:
+        obj = json.loads(str(medical_text))
+    except Exception:
+        return {"诊疗过程描述": str(medical_text)}
+    return obj if isinstance(obj, dict) else {"诊疗过程描述": str(medical_text)}
+
+
+def _vocab_terms(extra_vocab: Iterable[str]) -> List[str]:
+    """额外词表中参与统计的术语（去空白、至少 2 字、去重排序）。"""
+    return sorted({str(t).strip() for t in extra_vocab if len(str(t).strip()) >= 2})
+
+
+def corpus_signature(paths: Iterable[str], extra_vocab: Iterable[str] = ()) -> List[List]:
+    """语料文件的 (绝对路径, 大小, 修改时间) 加额外词表的哈希，用于判断缓存的统计是否过期。"""
+    sig = []
+    for p in paths:
+        st = os.stat(p)
+        sig.append([os.path.abspath(p), st.st_size, int(st.st_mtime)])
+    digest = hashlib.sha1("\n".join(_vocab_terms(extra_vocab)).encode("utf-8")).hexdigest()
+    sig.append(["extra_vocab", digest])
+    return sig
+
+
+class CorpusStats:
+    """语料统计：文档数、词表、词表术语与字符二元组的文档频次"""
+
+    def __init__(self, docs: int = 0, vocab: Optional[List[str]] = None,
+                 term_df: Optional[Dict[str, int]] = None, gram_df: Optional[Dict[str, int]] = None,
+                 signature: Optional[List[List]] = None):
+        self.docs = docs
+        self.vocab = vocab or []
+        self.term_df = term_df or {}
+        self.gram_df = gram_df or {}
+        self.signature = signature or []
+
+    @classmethod
+    def build(cls, records: Iterable[dict], extra_vocab: Iterable[str] = (),
+              signature: Optional[List[List]] = None) -> "CorpusStats":
+        """两遍统计：先由出院诊断与额外词表组成领域词表，再统计术语与二元组的文档频次。"""
+        records = list(records)
+        vocab = set(BUILTIN_TERMS) | set(_vocab_terms(extra_vocab))
+        for obj in records:
+            vocab.update(t for t in extract_diagnoses(json.dumps(obj, ensure_ascii=False)) if len(t) <= 20)
+        matcher = DrugMatcher.from_candidates(vocab, stems=False)
+        term_df: Counter = Counter()
+        gram_df: Counter = Counter()
+        for obj in records:
+            text = _key_text(obj)
+            term_df.update(set(matcher.mentioned(text)))
+            gram_df.update({g for _, g in cjk_bigrams(text)})
+        return cls(docs=len(records), vocab=sorted(vocab), term_df=dict(term_df), gram_df=dict(gram_df),
+                   signature=signature)
+
+    @classmethod
+    def from_files(cls, paths: Sequence[str], extra_vocab: Iterable[str] = ()) -> "CorpusStats":
+        def records() -> Iterable[dict]:
+            for p in paths:
+                with open(p, "r", encoding="utf-8") as f:
+                    for line in f:
+                        line = line.strip()
+                        if line:
+                            obj = _parse(line)
+                            if isinstance(obj, dict):
+                                yield obj
+        extra_vocab = list(extra_vocab)
+        return cls.build(records(), extra_vocab, signature=corpus_signature(paths, extra_vocab))
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": STATS_VERSION, "signature": self.signature, "docs": self.docs,
+                       "vocab": self.vocab, "term_df": self.term_df, "gram_df": self.gram_df},
+                      f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["CorpusStats"]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != STATS_VERSION:
+            return None
+        return cls(docs=data["docs"], vocab=data["vocab"], term_df=data["term_df"], gram_df=data["gram_df"],
+                   signature=data.get("signature"))
+
+    def idf(self, df: int) -> float:
+        return math.log((self.docs + 1) / (df + 1)) + 1.0
+
+
+class LexicalQueryBuilder:
+    """基于词表、字符二元组权重与 TF-IDF 的检索 query 生成器（构建后只读，可在线程间共享）"""
+
+    def __init__(self, stats: CorpusStats,
+                 max_diagnoses: int = 8,
+                 chief_chars: int = 40,
+                 max_terms: int = 8,
+                 max_phrases: int = 2,
+                 max_phrase_chars: int = 8,
+                 max_gram_df: float = 0.3,
+                 min_gram_df: int = 3,
+                 max_chars: int = 200,
+                 fields: Sequence[str] = KEY_TERM_FIELDS):
+        self.stats = stats
+        self.max_diagnoses = max_diagnoses
+        self.chief_chars = chief_chars
+        self.max_terms = max_terms
+        self.max_phrases = max_phrases
+        self.max_phrase_chars = max_phrase_chars
+        self.max_gram_df = max_gram_df
+        self.min_gram_df = min_gram_df
+        self.max_chars = max_chars
+        self.fields = tuple(fields)
+        self.matcher = DrugMatcher.from_candidates(stats.vocab, stems=False)
+
+    def _term_scores(self, text: str, exclude: Iterable[str]
+                     ) -> Tuple[List[Tuple[str, float]], List[Tuple[int, int]]]:
+        """词表术语按 tf * idf 排序（跳过 exclude），同时返回全部命中区间（含被跳过的术语）。"""
+        skip = set(exclude)
+        counts: Counter = Counter()
+        covered: List[Tuple[int, int]] = []
+        for m in self.matcher.find(text):
+            counts[m.name] += 1
+            covered.append((m.start, m.end))
+        scored = [
+            (term, tf * self.stats.idf(self.stats.term_df.get(term, 0)))
+            for term, tf in counts.items() if term not in skip
+        ]
+        scored.sort(key=lambda x: (-x[1], x[0]))
+        return scored, covered
+
+    def _salient_phrases(self, text: str, covered: List[Tuple[int, int]]) -> List[Tuple[str, float]]:
+        """把文档频次适中（min_gram_df ≤ df ≤ max_gram_df·N）的相邻二元组合并为 3~max_phrase_chars 字的片段，
+        按二元组平均 IDF 排序。"""
+        max_df = max(self.min_gram_df, int(self.max_gram_df * self.stats.docs))
+        blocked = set()
+        for start, end in covered:
+            blocked.update(range(start, end))
+        phrases: Counter = Counter()
+        run_start, run_end, score = -1, -1, 0.0
+
+        def close() -> None:
+            if run_start >= 0 and 3 <= run_end - run_start <= self.max_phrase_chars:
+                phrase = text[run_start:run_end]
+                phrases[phrase] = max(phrases[phrase], score / (len(phrase) - 1))
+
+        for pos, gram in cjk_bigrams(text):
+            df = self.stats.gram_df.get(gram, 0)
+            salient = self.min_gram_df <= df <= max_df and pos not in blocked and pos + 1 not in blocked
+            if salient and pos == run_end - 1:
+                run_end, score = pos + 2, score + self.stats.idf(df)
+                continue
+            close()
+            run_start, run_end, score = (pos, pos + 2, self.stats.idf(df)) if salient else (-1, -1, 0.0)
+        close()
+        return sorted(phrases.items(), key=lambda x: (-x[1], x[0]))
+
+    def key_terms(self, text: str, exclude: Iterable[str] = ()) -> List[str]:
+        """诊疗过程描述中的关键术语：词表术语在前，二元组片段补充。"""
+        scored, covered = self._term_scores(text, exclude)
+        terms = [t for t, _ in scored[:self.max_terms]]
+        room = min(self.max_phrases, self.max_terms - len(terms))
+        if room > 0:
+            terms.extend(p for p, _ in self._salient_phrases(text, covered)[:room])
+        return terms
+
+    def build(self, medical_text: str) -> str:
+        """由一行病历 JSON（或原文）生成检索 query。"""
+        obj = _parse(medical_text)
+        diagnoses = extract_diagnoses(json.dumps(obj, ensure_ascii=False))[:self.max_diagnoses]
+        chief = _field(obj, "主诉")[:self.chief_chars]
+        terms = self.key_terms(_key_text(obj, self.fields), exclude=diagnoses)
+        parts = []
+        if diagnoses:
+            parts.append("出院诊断：" + "、".join(diagnoses))
+        if chief:
+            parts.append("主诉：" + chief)
+        if terms:
+            parts.append("诊疗要点：" + "、".join(terms))
+        return "；".join(parts)[:self.max_chars]
+
+
+def load_query_builder(corpus_paths: Sequence[str], extra_vocab: Iterable[str] = (),
+                       stats_path: Optional[str] = DEFAULT_STATS_PATH, **kwargs) -> LexicalQueryBuilder:
+    """加载（语料或额外词表有变化、缓存缺失时重新计算并保存）语料统计，返回 query 生成器；stats_path=None 时不落盘。"""
+    extra_vocab = list(extra_vocab)
+    stats = CorpusStats.load(stats_path) if stats_path else None
+    if stats is None or stats.signature != corpus_signature(corpus_paths, extra_vocab):
+        stats = CorpusStats.from_files(corpus_paths, extra_vocab)
+        print(f"🧮 已统计 {stats.docs} 条病历：词表 {len(stats.vocab)} 项，二元组 {len(stats.gram_df)} 个")
+        if stats_path:
+            stats.save(stats_path)
+    return LexicalQueryBuilder(stats, **kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="预计算语料统计并打印示例 query")
+    parser.add_argument("corpus", nargs="+", help="病历 JSONL")
+    parser.add_argument("--candidates", default=os.path.join(
+        os.path.abspath(os.path.join(os.path.dirname(__file__), "..")), "data", "候选药物列表.json"))
+    parser.add_argument("--stats", default=os.getenv("QUERY_STATS_PATH", DEFAULT_STATS_PATH))
+    parser.add_argument("--show", type=int, default=5, help="打印前 N 条病历的 query")
+    args = parser.parse_args()
+    with open(args.candidates, "r", encoding="utf-8") as f:
+        candidates = json.load(f)
+    builder = load_query_builder(args.corpus, candidates, stats_path=args.stats)
+    with open(args.corpus[0], "r", encoding="utf-8") as f:
+        for _, line in zip(range(args.show), f):
+            print(builder.build(line))
@@ -1,10 +1,33 @@
-from typing import List, Optional, Set
+from typing import List, Optional, Set, Tuple, Union
+import asyncio
 import os
+import re
 import json
-from qianwen_class import QianwenLLM
+from qianwen_class import QianwenEmbedding, QianwenLLM
+from embedding_cache import get_embedding_cache
+from llm_cache import get_llm_cache
 from prompt import recommend_prompt as PROMPT
-from util import remove_think_blocks as chunk_text
-from neo4j_manage import Neo4jManager
+from prompt import batch_recommend_prefix, batch_record_prompt, batch_recommend_suffix
+from util import LoopLocal, remove_think_blocks as chunk_text, estimate_tokens, extract_diagnoses
+from neo4j_manage import Neo4jManager, format_graph_candidates
+from neo4j_async import AsyncNeo4jManager
+from drug_matcher import DrugMatcher, DrugMention, load_aliases, record_text
+from drug_normalizer import DEFAULT_THRESHOLD, DrugNormalizer
+from query_builder import LexicalQueryBuilder
+from tracing import get_tracer
+
+# 一次合并推荐调用的病历数上限（另受上下文窗口约束）
+MAX_ADVICE_BATCH = 16
+# 合并调用中每条病历的输出 token 预估（编号加十余个药名的 JSON 数组，实测单条输出约 80 token）
+DEFAULT_ADVICE_OUTPUT_TOKENS = 192
+
+_PLACEHOLDER_RE = re.compile(r"\{\{(\w+)\}\}")
+
+
+def _fill(template: str, values: dict) -> str:
+    """一次性替换 {{key}} 占位符（填入的文本中即使含有占位符写法也不会被再次替换）。"""
+    return _PLACEHOLDER_RE.sub(lambda m: values.get(m.group(1), m.group(0)), str(template))
+
 
 class DrugGraph:
     def __init__(
@@ -18,11 +41,27 @@ class DrugGraph:
         self.url = url
         self.username = username
         self.password = password
-        self.llm = QianwenLLM()
+        # 确定性调用走响应缓存（LLM_CACHE=0 关闭，work.py --no-llm-cache 跳过读取）
+        self.llm = QianwenLLM(response_cache=get_llm_cache(),
+                              context_window=int(os.getenv("LLM_CONTEXT_WINDOW", "8192")))
         self.candidate_names = self._load_candidate_names()
+        # 候选药物多模式匹配器：扫描病历中提及的候选药物（DRUG_MENTIONS=0 关闭）
+        self.use_mentions = os.getenv("DRUG_MENTIONS", "1") != "0"
+        self.drug_matcher = DrugMatcher.from_candidates(self.candidate_names, aliases=load_aliases())
+        # 模型输出药名的模糊规范化（相似度阈值 DRUG_NAME_THRESHOLD，1 表示只接受精确/别名命中）
+        self.drug_normalizer = DrugNormalizer(
+            self.candidate_names, threshold=float(os.getenv("DRUG_NAME_THRESHOLD", DEFAULT_THRESHOLD))
+        )
+        # 检索来源：vector（向量库）、graph（按出院诊断查图谱关联药物）、both（两者拼接）
+        self.retrieval_mode = os.getenv("RETRIEVAL_MODE", "vector")
+        # 检索 query 来源：llm（query_prompt 调用模型）或 lexical（本地词法生成，需先设置 query_builder）
+        self.query_mode = os.getenv("QUERY_MODE", "llm")
+        self.query_builder: Optional[LexicalQueryBuilder] = None
+        # 异步图谱访问层：首次在事件循环中使用时创建（驱动绑定创建它的事件循环，按事件循环分别持有）
+        self._async_neo4j = LoopLocal(self._new_async_neo4j, lambda m: m.close(), name="Neo4j 异步驱动")
 
-    def ask_query_prompt(self, content: str) -> str:
-        """使用单一字符串 content 填充 query_prompt 中的全部占位符并询问 LLM，返回清洗后的回答。"""
+    def _build_query_prompt(self, content: str) -> str:
+        """使用单一字符串 content 填充 query_prompt 中的全部占位符。"""
         from prompt import query_prompt  # 按需导入
         tpl = str(query_prompt)
         val = "" if content is None else str(content)
@@ -33,50 +72,278 @@ class DrugGraph:
         for k in keys:
             tpl = tpl.replace(f"{{{k}}}", val)
             tpl = tpl.replace(f"{{{{{k}}}}}", val)
-        resp = self.llm.complete(tpl)
+        return tpl
+
+    def ask_query_prompt(self, content: str) -> str:
+        """使用单一字符串 content 填充 query_prompt 中的全部占位符并询问 LLM，返回清洗后的回答。"""
+        resp = self.llm.complete(self._build_query_prompt(content))
+        return chunk_text(str(resp))
+
+    async def aask_query_prompt(self, content: str) -> str:
+        """ask_query_prompt 的异步版本。"""
+        resp = await self.llm.acomplete(self._build_query_prompt(content))
         return chunk_text(str(resp))
 
+    def _lexical_query(self, content: str, json_text: Optional[str]) -> str:
+        if self.query_builder is None:
+            raise RuntimeError("query_mode=lexical 需要先设置 query_builder（见 query_builder.load_query_builder）")
+        return self.query_builder.build(json_text or content)
+
+    def build_query(self, content: str, json_text: Optional[str] = None) -> str:
+        """按 query_mode 生成检索 query：llm 使用 content 询问模型，lexical 从病历 JSON 本地生成。"""
+        if self.query_mode == "lexical":
+            return self._lexical_query(content, json_text)
+        return self.ask_query_prompt(content)
+
+    async def abuild_query(self, content: str, json_text: Optional[str] = None) -> str:
+        """build_query 的异步版本（lexical 模式为纯本地计算，直接返回）。"""
+        if self.query_mode == "lexical":
+            return self._lexical_query(content, json_text)
+        return await self.aask_query_prompt(content)
+
+    def find_drug_mentions(self, medical_text: str) -> List[DrugMention]:
+        """扫描病历文本字段，返回提及的候选药物及其位置（不调用 LLM）。"""
+        if not self.use_mentions or not self.candidate_names:
+            return []
+        return self.drug_matcher.find(record_text(medical_text))
+
+    @staticmethod
+    def _render_mentions(mentions: List[DrugMention]) -> str:
+        """渲染为提示词中的一行：名称（原文写法不同时附原文），按首次出现顺序去重。"""
+        items: List[str] = []
+        seen: Set[str] = set()
+        for m in mentions:
+            if m.name in seen:
+                continue
+            seen.add(m.name)
+            items.append(m.name if m.surface == m.name else f"{m.name}（原文：{m.surface}）")
+        return "、".join(items) if items else "无"
+
+    def _build_advice_prompt(self, medical_text: str, retrieved_info: Optional[str] = None,
+                             mentions: Optional[List[DrugMention]] = None) -> str:
+        """将 PROMPT 内嵌并用 text1/text2/text3 填充（text3 为病历中提及的候选药物）。"""
+        prompt_text = str(PROMPT)
+        t1 = "" if medical_text is None else str(medical_text)
+        t2 = "" if retrieved_info is None else str(retrieved_info)
+        t3 = self._render_mentions(mentions or [])
+        # 支持 {text1}/{text2} 与 {{text1}}/{{text2}}
+        for k, v in (("text1", t1), ("text2", t2), ("text3", t3)):
+            prompt_text = prompt_text.replace(f"{{{{{k}}}}}", v)
+            prompt_text = prompt_text.replace(f"{{{k}}}", v)
+        return prompt_text
+
+    def _canonical_name(self, name: str) -> Optional[str]:
+        """将模型输出的药名规范到候选集合：精确命中、整体恰为某候选的别名/通用名词干，
+        或与某候选的相似度达到阈值。"""
+        if name in self.candidate_names:
+            return name
+        found = self.drug_matcher.find(name)
+        if len(found) == 1 and found[0].start == 0 and found[0].end == len(name):
+            return found[0].name
+        return self.drug_normalizer.normalize(name)
+
+    def _parse_advice(self, response: str, mentions: Optional[List[DrugMention]] = None) -> str:
+        """解析模型输出为药物列表，并过滤至候选集合，返回 JSON 数组字符串；
+        输出无法解析时以病历中提及的候选药物兜底（模型明确给出的空列表或集合外药名按模型结果处理）。"""
+        text = chunk_text(str(response))
+        # 解析模型输出为列表
+        drugs: List[str] = []
+        parsed_ok = False
+        try:
+            parsed = json.loads(text)
+            if isinstance(parsed, dict) and "药物推荐" in parsed:
+                # 处理 {"药物推荐": ["药物1", "药物2"]} 格式
+                drug_list = parsed["药物推荐"]
+                if isinstance(drug_list, list):
+                    drugs = [str(x).strip() for x in drug_list if isinstance(x, (str, int, float))]
+                    parsed_ok = True
+            elif isinstance(parsed, list):
+                # 处理 ["药物1", "药物2"] 格式
+                drugs = [str(x).strip() for x in parsed if isinstance(x, (str, int, float))]
+                parsed_ok = True
+        except Exception:
+            drugs = []
+        # 过滤至候选集合（若候选集合可用）
+        if self.candidate_names:
+            filtered: List[str] = []
+            seen: Set[str] = set()
+            for name in drugs:
+                name = self._canonical_name(name)
+                if name and name not in seen:
+                    filtered.append(name)
+                    seen.add(name)
+            if not parsed_ok and mentions:
+                for m in mentions:
+                    if m.name not in seen:
+                        filtered.append(m.name)
+                        seen.add(m.name)
+            return json.dumps(filtered, ensure_ascii=False)
+        else:
+            return json.dumps(drugs, ensure_ascii=False)
+
     def query_medical_advice(self, medical_text: str, retrieved_info: Optional[str] = None) -> str:
         """基于病历文本生成医疗建议：将 PROMPT 内嵌并用 text1/text2 填充。"""
         try:
-            prompt_text = str(PROMPT)
-            t1 = "" if medical_text is None else str(medical_text)
-            t2 = "" if retrieved_info is None else str(retrieved_info)
-            # 支持 {text1}/{text2} 与 {{text1}}/{{text2}}
-            for k, v in (("text1", t1), ("text2", t2)):
-                prompt_text = prompt_text.replace(f"{{{k}}}", v)
-                prompt_text = prompt_text.replace(f"{{{{{k}}}}}", v)
-            response = self.llm.complete(prompt_text)
-            text = chunk_text(str(response))
-            # 解析模型输出为列表
-            drugs: List[str] = []
-            try:
-                parsed = json.loads(text)
-                if isinstance(parsed, dict) and "药物推荐" in parsed:
-                    # 处理 {"药物推荐": ["药物1", "药物2"]} 格式
-                    drug_list = parsed["药物推荐"]
-                    if isinstance(drug_list, list):
-                        drugs = [str(x).strip() for x in drug_list if isinstance(x, (str, int, float))]
-                elif isinstance(parsed, list):
-                    # 处理 ["药物1", "药物2"] 格式
-                    drugs = [str(x).strip() for x in parsed if isinstance(x, (str, int, float))]
-            except Exception:
-                drugs = []
-            # 过滤至候选集合（若候选集合可用）
-            if self.candidate_names:
-                filtered: List[str] = []
-                seen: Set[str] = set()
-                for name in drugs:
-                    if name in self.candidate_names and name not in seen:
-                        filtered.append(name)
-                        seen.add(name)
-                return json.dumps(filtered, ensure_ascii=False)
-            else:
-                return json.dumps(drugs, ensure_ascii=False)
+            mentions = self.find_drug_mentions(medical_text)
+            response = self.llm.complete(self._build_advice_prompt(medical_text, retrieved_info, mentions))
+            return self._parse_advice(str(response), mentions)
         except Exception as e:
             print(f"❌ 查询过程中出错: {e}")
             return f"抱歉，查询过程中出现错误: {e}"
 
+    async def aquery_medical_advice(self, medical_text: str, retrieved_info: Optional[str] = None) -> str:
+        """query_medical_advice 的异步版本；供批处理使用，出错时抛出异常（由调用方记为失败并在续跑时重试）。"""
+        mentions = self.find_drug_mentions(medical_text)
+        response = await self.llm.acomplete(self._build_advice_prompt(medical_text, retrieved_info, mentions))
+        return self._parse_advice(str(response), mentions)
+
+    def _render_batch_record(self, rid: str, medical_text: Optional[str], retrieved_info: Optional[str],
+                             mentions: List[DrugMention]) -> str:
+        return _fill(batch_record_prompt, {
+            "rid": rid,
+            "text1": "" if medical_text is None else str(medical_text),
+            "text2": "" if retrieved_info is None else str(retrieved_info),
+            "text3": self._render_mentions(mentions),
+        })
+
+    def _build_batch_advice_prompt(self, medical_texts: List[str], retrieved_infos: List[Optional[str]],
+                                   mentions_list: List[List[DrugMention]]) -> Tuple[str, List[str]]:
+        """多条病历合并为一个提示词：固定前缀 + 各病历块（编号 R1..RN）+ 编号清单；返回 (提示词, 编号列表)。"""
+        rids = [f"R{i}" for i in range(1, len(medical_texts) + 1)]
+        parts = [batch_recommend_prefix]
+        for rid, text, info, mentions in zip(rids, medical_texts, retrieved_infos, mentions_list):
+            parts.append(self._render_batch_record(rid, text, info, mentions))
+        parts.append(_fill(batch_recommend_suffix, {"rids": "、".join(rids)}))
+        return "".join(parts), rids
+
+    @property
+    def advice_output_tokens(self) -> int:
+        """合并调用中为每条病历预留的输出 token 数（ADVICE_OUTPUT_TOKENS，默认 DEFAULT_ADVICE_OUTPUT_TOKENS）；
+        分组时按它预留上下文窗口，合并调用的 max_tokens 也按它乘以条数设置。"""
+        return int(os.getenv("ADVICE_OUTPUT_TOKENS") or 0) or DEFAULT_ADVICE_OUTPUT_TOKENS
+
+    def plan_advice_batches(self, medical_texts: List[str], retrieved_infos: List[Optional[str]],
+                            mentions_list: List[List[DrugMention]], max_records: int) -> List[List[int]]:
+        """按输入顺序贪心分组：每组不超过 max_records 条（且不超过 MAX_ADVICE_BATCH），
+        估计的提示词 token 数加上每条预留的输出 token 数不超过模型上下文窗口；单条即超出时独占一组。"""
+        window = self.llm.metadata.context_window
+        per_output = self.advice_output_tokens
+        cap = max(1, min(max_records, MAX_ADVICE_BATCH))
+        fixed = estimate_tokens(batch_recommend_prefix) + estimate_tokens(batch_recommend_suffix) + 2 * cap
+        groups: List[List[int]] = []
+        current: List[int] = []
+        used = fixed
+        for i, (text, info, mentions) in enumerate(zip(medical_texts, retrieved_infos, mentions_list)):
+            need = estimate_tokens(self._render_batch_record(f"R{cap}", text, info, mentions)) + per_output
+            if current and (len(current) >= cap or used + need > window):
+                groups.append(current)
+                current, used = [], fixed
+            current.append(i)
+            used += need
+        if current:
+            groups.append(current)
+        return groups
+
+    @staticmethod
+    def _split_batch_response(response: str, rids: List[str]) -> List[Optional[str]]:
+        """把合并调用的输出拆回各病历：返回与 rids 对应的 JSON 字符串，缺失或格式不符的编号为 None。"""
+        text = chunk_text(str(response))
+        start, end = text.find("{"), text.rfind("}")
+        try:
+            parsed = json.loads(text[start:end + 1]) if 0 <= start < end else None
+        except Exception:
+            parsed = None
+        if not isinstance(parsed, dict):
+            return [None] * len(rids)
+        parts: List[Optional[str]] = []
+        for rid in rids:
+            value = parsed.get(rid)
+            if isinstance(value, dict) and isinstance(value.get("药物推荐"), list):
+                value = value["药物推荐"]
+            if isinstance(value, list) and all(isinstance(x, (str, int, float)) for x in value):
+                parts.append(json.dumps(value, ensure_ascii=False))
+            else:
+                parts.append(None)
+        return parts
+
+    async def _aadvice_batch(self, medical_texts: List[str], infos: List[Optional[str]],
+                             mentions_list: List[List[DrugMention]]) -> List[Union[str, BaseException]]:
+        """一组（已确认放得进上下文窗口的）病历的合并调用，缺失/无法解析的病历改为单条调用。"""
+        n = len(medical_texts)
+        if n == 1:
+            return list(await asyncio.gather(self.aquery_medical_advice(medical_texts[0], infos[0]),
+                                             return_exceptions=True))
+        prompt_text, rids = self._build_batch_advice_prompt(medical_texts, infos, mentions_list)
+        with get_tracer().span("advice.batch", inputs=n) as sp:
+            try:
+                response = await self.llm.acomplete(prompt_text, max_tokens=self.advice_output_tokens * n)
+                parts = self._split_batch_response(str(response), rids)
+            except Exception as e:
+                print(f"⚠️ 合并推荐调用失败，改为逐条调用: {e}")
+                parts = [None] * n
+            results: List[Union[str, BaseException, None]] = [
+                None if part is None else self._parse_advice(part, mentions)
+                for part, mentions in zip(parts, mentions_list)
+            ]
+            retry = [i for i, r in enumerate(results) if r is None]
+            if sp is not None:
+                sp.set(fallbacks=len(retry))
+        if retry:
+            outs = await asyncio.gather(*(self.aquery_medical_advice(medical_texts[i], infos[i]) for i in retry),
+                                        return_exceptions=True)
+            for i, out in zip(retry, outs):
+                results[i] = out
+        return results
+
+    async def aquery_medical_advice_many(self, medical_texts: List[str],
+                                         retrieved_infos: Optional[List[Optional[str]]] = None,
+                                         max_records: Optional[int] = None) -> List[Union[str, BaseException]]:
+        """多条病历合并为 LLM 调用（固定前缀，输出按编号的 JSON 对象），拆分后逐条过滤。
+        按上下文窗口分组（见 plan_advice_batches，每组至多 max_records 条，缺省为全部）；
+        合并调用失败或某条输出缺失/无法解析时，该条改为单条调用。返回与输入一一对应的 JSON 数组字符串，
+        单条调用也失败的位置为该异常对象（由调用方记为该条失败）。"""
+        n = len(medical_texts)
+        infos = list(retrieved_infos) if retrieved_infos is not None else [None] * n
+        mentions_list = [self.find_drug_mentions(t) for t in medical_texts]
+        groups = self.plan_advice_batches(medical_texts, infos, mentions_list, max_records or n)
+        outs = await asyncio.gather(*(
+            self._aadvice_batch([medical_texts[i] for i in g], [infos[i] for i in g], [mentions_list[i] for i in g])
+            for g in groups
+        ))
+        results: List[Union[str, BaseException]] = [""] * n
+        for group, out in zip(groups, outs):
+            for i, item in zip(group, out):
+                results[i] = item
+        return results
+
+    def query_medical_advice_many(self, medical_texts: List[str],
+                                  retrieved_infos: Optional[List[Optional[str]]] = None,
+                                  max_records: Optional[int] = None) -> List[str]:
+        """aquery_medical_advice_many 的同步版本（各组与回退的单条调用依次执行）。"""
+        n = len(medical_texts)
+        infos = list(retrieved_infos) if retrieved_infos is not None else [None] * n
+        mentions_list = [self.find_drug_mentions(t) for t in medical_texts]
+        results: List[str] = [""] * n
+        for group in self.plan_advice_batches(medical_texts, infos, mentions_list, max_records or n):
+            if len(group) == 1:
+                results[group[0]] = self.query_medical_advice(medical_texts[group[0]], infos[group[0]])
+                continue
+            prompt_text, rids = self._build_batch_advice_prompt(
+                [medical_texts[i] for i in group], [infos[i] for i in group], [mentions_list[i] for i in group])
+            with get_tracer().span("advice.batch", inputs=len(group)) as sp:
+                try:
+                    response = self.llm.complete(prompt_text, max_tokens=self.advice_output_tokens * len(group))
+                    parts = self._split_batch_response(str(response), rids)
+                except Exception as e:
+                    print(f"⚠️ 合并推荐调用失败，改为逐条调用: {e}")
+                    parts = [None] * len(group)
+                if sp is not None:
+                    sp.set(fallbacks=sum(p is None for p in parts))
+            for i, part in zip(group, parts):
+                results[i] = (self._parse_advice(part, mentions_list[i]) if part is not None
+                              else self.query_medical_advice(medical_texts[i], infos[i]))
+        return results
+
     def _load_candidate_names(self) -> Set[str]:
         """加载候选药物集合。"""
         candidates_path = os.getenv(
@@ -95,7 +362,7 @@ class DrugGraph:
         return names
 
     def filter_to_candidates(self, text: str) -> str:
-        """检测并过滤：将 text（应为JSON数组字符串）中的药物名限制在候选集合内，去重后返回JSON数组字符串。"""
+        """检测并过滤：将 text（应为JSON数组字符串）中的药物名规范到候选集合内，去重后返回JSON数组字符串。"""
         try:
             parsed = json.loads(text)
         except Exception:
@@ -108,7 +375,8 @@ class DrugGraph:
             name = str(x).strip()
             if not name:
                 continue
-            if self.candidate_names and name in self.candidate_names and name not in seen:
+            name = self._canonical_name(name) if self.candidate_names else None
+            if name and name not in seen:
                 filtered.append(name)
                 seen.add(name)
         return json.dumps(filtered, ensure_ascii=False)
@@ -116,3 +384,115 @@ class DrugGraph:
     def retrieve_medical_info(self, query_text: str) -> str:
         """调用 Neo4j 管理器的检索函数获取相关医疗信息。"""
         return self.neo4j_manager.retrieve_medical_info(query_text)
+
+    async def aretrieve_medical_info(self, query_text: str) -> str:
+        """retrieve_medical_info 的异步版本（向量检索在线程池中执行，不阻塞事件循环）；出错时抛出异常。"""
+        return await asyncio.to_thread(self.neo4j_manager.search_medical_info, query_text)
+
+    def retrieve_medical_info_many(self, query_texts: List[str]) -> List[str]:
+        """批量检索多条 query（一次嵌入、一次打分），返回与输入一一对应的检索文本。"""
+        return self.neo4j_manager.retrieve_medical_info_many(query_texts)
+
+    async def aretrieve_medical_info_many(self, query_texts: List[str]) -> List[str]:
+        """retrieve_medical_info_many 的异步版本；出错时抛出异常。"""
+        return await asyncio.to_thread(self.neo4j_manager.search_medical_info_many, query_texts)
+
+    @staticmethod
+    def _merge_context(graph_infos: Optional[List[str]], vector_infos: Optional[List[str]], n: int) -> List[str]:
+        """图谱结果在前、向量检索结果在后，逐条拼接。"""
+        merged = []
+        for i in range(n):
+            parts = [infos[i] for infos in (graph_infos, vector_infos) if infos is not None and infos[i]]
+            merged.append("\n".join(parts))
+        return merged
+
+    def retrieve_context_many(self, query_texts: List[str], json_texts: List[str]) -> List[str]:
+        """按 retrieval_mode 批量检索知识库文本：向量检索使用 query，图谱检索使用病历中的出院诊断。"""
+        graph_infos = vector_infos = None
+        if self.retrieval_mode in ("graph", "both"):
+            term_lists = [extract_diagnoses(t) for t in json_texts]
+            graph_infos = self.neo4j_manager.retrieve_graph_info_many(term_lists, list(self.candidate_names))
+        if self.retrieval_mode != "graph":
+            vector_infos = self.retrieve_medical_info_many(query_texts)
+        return self._merge_context(graph_infos, vector_infos, len(query_texts))
+
+    def retrieve_context(self, query_text: str, json_text: str) -> str:
+        """单条病历的 retrieve_context_many。"""
+        if self.retrieval_mode == "vector":
+            return self.retrieve_medical_info(query_text)
+        return self.retrieve_context_many([query_text], [json_text])[0]
+
+    def _new_async_neo4j(self) -> AsyncNeo4jManager:
+        return AsyncNeo4jManager(
+            self.url, self.username, self.password,
+            max_connection_pool_size=int(os.getenv("NEO4J_POOL_SIZE", "50")),
+            query_timeout=float(os.getenv("NEO4J_QUERY_TIMEOUT", "30")),
+        )
+
+    def _get_async_neo4j(self) -> AsyncNeo4jManager:
+        return self._async_neo4j.get()
+
+    async def aretrieve_context_many(self, query_texts: List[str], json_texts: List[str]) -> List[str]:
+        """retrieve_context_many 的异步版本：图谱查询走异步驱动，与线程池中的向量检索并发执行；出错时抛出异常。"""
+        if self.retrieval_mode == "vector":
+            return await self.aretrieve_medical_info_many(query_texts)
+        term_lists = [extract_diagnoses(t) for t in json_texts]
+
+        async def graph_infos_many() -> List[str]:
+            candidates = await self._get_async_neo4j().graph_candidates_many(term_lists, list(self.candidate_names))
+            return [format_graph_candidates(c) for c in candidates]
+
+        graph_task = graph_infos_many()
+        if self.retrieval_mode == "graph":
+            graph_infos, vector_infos = await graph_task, None
+        else:
+            graph_infos, vector_infos = await asyncio.gather(graph_task, self.aretrieve_medical_info_many(query_texts))
+        return self._merge_context(graph_infos, vector_infos, len(query_texts))
+
+    async def aretrieve_context(self, query_text: str, json_text: str) -> str:
+        if self.retrieval_mode == "vector":
+            return await self.aretrieve_medical_info(query_text)
+        return (await self.aretrieve_context_many([query_text], [json_text]))[0]
+
+    def add_embedding_for_graph(self, batch_size: int = 64, workers: int = 4,
+                                dimension: int = 1024, force: bool = False) -> dict:
+        """为图数据库节点批量生成并写回嵌入，创建 Neo4jVectorStore 所需的向量索引；可中断后重跑。"""
+        embed_model = QianwenEmbedding(embed_batch_size=batch_size, cache=get_embedding_cache())
+        try:
+            stats = self.neo4j_manager.backfill_embeddings(
+                embed_model, batch_size=batch_size, workers=workers, dimension=dimension, force=force
+            )
+        finally:
+            embed_model.close()
+        print(f"✅ 嵌入回填完成: {stats}")
+        return stats
+
+    async def aadd_embedding_for_graph(self, batch_size: int = 64, workers: int = 4,
+                                       dimension: int = 1024, force: bool = False) -> dict:
+        """add_embedding_for_graph 的异步版本（异步驱动 + 异步嵌入请求）。"""
+        embed_model = QianwenEmbedding(embed_batch_size=batch_size, cache=get_embedding_cache())
+        try:
+            stats = await self._get_async_neo4j().backfill_embeddings(
+                embed_model, batch_size=batch_size, workers=workers, dimension=dimension, force=force
+            )
+        finally:
+            await embed_model.aclose()
+            embed_model.close()
+        print(f"✅ 嵌入回填完成: {stats}")
+        return stats
+
+    def warm_up(self) -> None:
+        """预热共享向量检索器，避免首条病历承担初始化开销。"""
+        stats = self.neo4j_manager.warm_up_retriever()
+        print(f"🔥 检索器预热完成: {stats}")
+
+    def close(self) -> None:
+        """释放检索器与 Neo4j 连接。"""
+        self.neo4j_manager.close_retriever()
+        self.neo4j_manager.close()
+
+    async def aclose(self) -> None:
+        """关闭异步图谱访问层与 LLM 异步客户端的连接池（需在事件循环结束前调用）。"""
+        await self._async_neo4j.aclose()
+        if hasattr(self.llm, "aclose"):
+            await self.llm.aclose()
@@ -0,0 +1,219 @@
+"""
+相似病历分组与组内结果复用
+
+同一患者的多次就诊（患者序号相同、就诊标识 1-1、1-2 …）以及不同患者间的近重复病历，
+生成的检索 query 与检索结果往往几乎相同。按输入顺序在线分组：
+- 出院诊断、主诉、既往史拼接后取字符 k-shingle，计算 MinHash 签名（num_perm 个哈希函数）；
+  现病史与诊疗过程描述每次就诊差异大，不参与比较；
+- LSH 按 bands × rows 分桶取候选代表，同一患者此前的代表总是参与比较；
+- 与同一患者代表的估计 Jaccard 相似度达到 threshold、或与其他患者代表达到更严格的
+  cross_threshold 时并入该组，否则成为新组的代表。
+同组病历共享 query 与检索结果（先到者计算，其余等待复用），推荐仍逐条生成。
+"""
+
+import asyncio
+import json
+import zlib
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+
+# 参与相似度计算的病历字段（同一患者多次就诊间相对稳定、且决定检索 query 的部分）
+GROUP_FIELDS = ("出院诊断", "主诉", "既往史")
+PATIENT_FIELD = "患者序号"
+
+_PRIME = (1 << 31) - 1
+
+
+def record_shingles(text: str, k: int = 3) -> Set[str]:
+    """字符 k-shingle 集合；短于 k 的文本以整体作为唯一 shingle。"""
+    if len(text) <= k:
+        return {text} if text else set()
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+
+def _record_fields(medical_text: str, fields: Iterable[str]) -> Tuple[Optional[str], str]:
+    """返回 (患者序号, 关键字段拼接文本)；非 JSON 时无患者序号、以原文参与比较。"""
+    try:
+        obj = json.loads(str(medical_text))
+    except Exception:
+        return None, str(medical_text)
+    if not isinstance(obj, dict):
+        return None, str(medical_text)
+    parts = []
+    for k in fields:
+        v = obj.get(k)
+        if isinstance(v, list):
+            v = "、".join(map(str, v))
+        if v:
+            parts.append(str(v))
+    patient = obj.get(PATIENT_FIELD)
+    return (None if patient is None else str(patient)), "\n".join(parts)
+
+
+class MinHasher:
+    """MinHash 签名：shingle 先以 CRC32 映射为整数，再经 num_perm 个 (a·x + b) mod p 取最小值"""
+
+    def __init__(self, num_perm: int = 64, shingle: int = 3, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle = shingle
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _PRIME, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, _PRIME, size=num_perm).astype(np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        shingles = record_shingles(text, self.shingle)
+        if not shingles:
+            return np.full(self.num_perm, _PRIME, dtype=np.uint64)
+        x = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64,
+                        count=len(shingles)) % np.uint64(_PRIME)
+        # a、x < 2^31，乘积不超过 uint64 范围
+        return ((np.outer(self._a, x) + self._b[:, None]) % np.uint64(_PRIME)).min(axis=1)
+
+
+def estimate_similarity(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+    """两个签名相同位置取值一致的比例，即 Jaccard 相似度的估计。"""
+    return float(np.count_nonzero(sig_a == sig_b)) / max(1, len(sig_a))
+
+
+class LSHIndex:
+    """MinHash LSH：签名按 bands 段分桶，任一段完全相同即为候选"""
+
+    def __init__(self, bands: int = 16, rows: int = 4):
+        self.bands = bands
+        self.rows = rows
+        self._buckets: List[Dict[bytes, List[str]]] = [{} for _ in range(bands)]
+
+    def _band_keys(self, sig: np.ndarray) -> Iterable[Tuple[int, bytes]]:
+        for band in range(self.bands):
+            yield band, sig[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, key: str, sig: np.ndarray) -> None:
+        for band, bucket in self._band_keys(sig):
+            self._buckets[band].setdefault(bucket, []).append(key)
+
+    def candidates(self, sig: np.ndarray) -> Set[str]:
+        found: Set[str] = set()
+        for band, bucket in self._band_keys(sig):
+            found.update(self._buckets[band].get(bucket, ()))
+        return found
+
+
+class RecordGrouper:
+    """按输入顺序在线分组：每条病历指定一个代表（自身或此前的相似病历）"""
+
+    def __init__(self, threshold: float = 0.6, cross_threshold: Optional[float] = None, num_perm: int = 64,
+                 bands: int = 16, shingle: int = 3, fields: Iterable[str] = GROUP_FIELDS):
+        if num_perm % bands:
+            raise ValueError(f"num_perm={num_perm} 必须能被 bands={bands} 整除")
+        self.threshold = threshold
+        # 不同患者之间只合并近重复病历
+        self.cross_threshold = max(threshold, 0.85) if cross_threshold is None else cross_threshold
+        self.fields = tuple(fields)
+        self.hasher = MinHasher(num_perm=num_perm, shingle=shingle)
+        self.lsh = LSHIndex(bands=bands, rows=num_perm // bands)
+        self._signatures: Dict[str, np.ndarray] = {}
+        self._patient_reps: Dict[str, List[str]] = {}
+        self._patient_of: Dict[str, Optional[str]] = {}
+        self._group_of: Dict[str, str] = {}
+        self.counters: Counter = Counter()
+
+    def assign(self, key: str, medical_text: str) -> str:
+        """为病历 key 指定代表并返回代表的 key（新组的代表返回自身）。"""
+        if key in self._group_of:
+            return self._group_of[key]
+        patient, text = _record_fields(medical_text, self.fields)
+        sig = self.hasher.signature(text)
+        candidates = self.lsh.candidates(sig)
+        if patient is not None:
+            candidates.update(self._patient_reps.get(patient, ()))
+        best: Optional[Tuple[float, str]] = None
+        for rep in candidates:
+            score = estimate_similarity(sig, self._signatures[rep])
+            same = patient is not None and self._patient_of[rep] == patient
+            if score >= (self.threshold if same else self.cross_threshold) and (best is None or (score, rep) > best):
+                best = (score, rep)
+        self.counters["records"] += 1
+        if best is not None and self._patient_of[best[1]] != patient:
+            self.counters["cross_patient"] += 1
+        if best is None:
+            self._signatures[key] = sig
+            self._patient_of[key] = patient
+            self.lsh.add(key, sig)
+            if patient is not None:
+                self._patient_reps.setdefault(patient, []).append(key)
+            self._group_of[key] = key
+            self.counters["groups"] += 1
+        else:
+            self._group_of[key] = best[1]
+            self.counters["merged"] += 1
+        return self._group_of[key]
+
+    def group_of(self, key: str) -> str:
+        """已分组病历的代表 key；未分组时为空字符串（不参与复用）。"""
+        return self._group_of.get(key, "")
+
+
+class RecordReuse:
+    """组内共享的异步结果：同组同类结果只计算一次，其余病历等待复用"""
+
+    def __init__(self, grouper: RecordGrouper):
+        self.grouper = grouper
+        self._futures: Dict[Tuple[str, str], asyncio.Future] = {}
+        self.reused: Counter = Counter()
+
+    def assign(self, key: str, medical_text: str) -> str:
+        return self.grouper.assign(key, medical_text)
+
+    def group_of(self, key: str) -> str:
+        return self.grouper.group_of(key)
+
+    def claim(self, kind: str, group: str) -> Optional[asyncio.Future]:
+        """领取 (kind, group) 的计算：返回 None 表示由调用方计算（之后必须 resolve），否则返回待复用的结果。"""
+        if not group:
+            return None
+        fut = self._futures.get((kind, group))
+        if fut is not None:
+            return fut
+        self._futures[(kind, group)] = asyncio.get_running_loop().create_future()
+        return None
+
+    def resolve(self, kind: str, group: str, result: Any = None, error: Optional[BaseException] = None) -> None:
+        """写入计算结果；失败时移除记录，等待者与后续病历各自重新计算。"""
+        fut = self._futures.get((kind, group)) if group else None
+        if fut is None or fut.done():
+            return
+        if error is None:
+            fut.set_result(result)
+            return
+        del self._futures[(kind, group)]
+        # 取消等非 Exception 的中断不传给等待者，统一按计算失败处理
+        fut.set_exception(error if isinstance(error, Exception) else RuntimeError(f"组内共享计算中断: {error!r}"))
+        fut.exception()  # 标记异常已读取，无人等待时不产生告警
+
+    async def wait(self, kind: str, fut: asyncio.Future) -> Any:
+        result = await asyncio.shield(fut)
+        self.reused[kind] += 1
+        return result
+
+    async def get_or_compute(self, kind: str, group: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """同组已有（或正在计算的）结果时复用，否则计算并共享；复用的结果失败时自行计算。"""
+        fut = self.claim(kind, group)
+        if fut is not None:
+            try:
+                return await self.wait(kind, fut)
+            except Exception:
+                return await compute()
+        try:
+            result = await compute()
+        except BaseException as e:
+            self.resolve(kind, group, error=e)
+            raise
+        self.resolve(kind, group, result=result)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        return {**{k: self.grouper.counters.get(k, 0) for k in ("records", "groups", "merged", "cross_patient")},
+                **{f"reused_{k}": v for k, v in sorted(self.reused.items())}}
@@ -0,0 +1,132 @@
+"""
+检索器注册表
+
+在进程内按 (向量库路径, 集合名, 嵌入模型, 嵌入服务地址, 后端) 缓存已初始化的向量数据库实例
+（嵌入模型、Chroma 客户端、StorageContext 与 VectorStoreIndex），首次使用时构建，
+之后在所有线程间共享复用，避免每条病历都重新初始化一遍。
+"""
+
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Optional
+
+from langchain_ollama.embeddings import OllamaEmbeddings
+from embedding_cache import CachedEmbeddings, get_embedding_cache
+from wap.vector_retriver import VectorDatabase, VectorDatabaseFactory
+
+
+DEFAULT_VECTOR_DB_PATH = "./chroma_store"
+DEFAULT_COLLECTION_NAME = "drug_info"
+DEFAULT_EMBEDDING_MODEL = "bge-m3"
+DEFAULT_OLLAMA_BASE_URL = "http://localhost:11434"
+DEFAULT_VECTOR_BACKEND = "chroma"
+
+
+class RetrieverKey(NamedTuple):
+    """检索器标识：同一个 key 在进程内只构建一次。"""
+    vector_db_path: str
+    collection_name: str
+    embedding_model: str
+    base_url: str
+    backend: str = DEFAULT_VECTOR_BACKEND
+
+    @classmethod
+    def create(cls,
+               vector_db_path: Optional[str] = None,
+               collection_name: Optional[str] = None,
+               embedding_model: Optional[str] = None,
+               base_url: Optional[str] = None,
+               backend: Optional[str] = None) -> "RetrieverKey":
+        """未显式指定的字段依次取环境变量与默认值；路径统一转为绝对路径，保证不同工作目录下 key 一致。"""
+        path = vector_db_path or os.getenv("VECTOR_DB_PATH", DEFAULT_VECTOR_DB_PATH)
+        return cls(
+            vector_db_path=os.path.abspath(path),
+            collection_name=collection_name or os.getenv("VECTOR_COLLECTION_NAME", DEFAULT_COLLECTION_NAME),
+            embedding_model=embedding_model or os.getenv("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL),
+            base_url=base_url or os.getenv("OLLAMA_BASE_URL", DEFAULT_OLLAMA_BASE_URL),
+            backend=backend or os.getenv("VECTOR_BACKEND", DEFAULT_VECTOR_BACKEND),
+        )
+
+
+def default_embeddings_factory(key: RetrieverKey):
+    """默认使用 Ollama 提供的 bge-m3 嵌入（需与入库时配置一致），并套上持久化嵌入缓存。"""
+    embeddings = OllamaEmbeddings(model=key.embedding_model, base_url=key.base_url)
+    cache = get_embedding_cache()
+    if cache is None:
+        return embeddings
+    return CachedEmbeddings(embeddings, cache, model_name=key.embedding_model)
+
+
+class RetrieverRegistry:
+    """进程级向量检索器注册表（线程安全）"""
+
+    def __init__(self, embeddings_factory: Optional[Callable[[RetrieverKey], Any]] = None):
+        self.embeddings_factory = embeddings_factory or default_embeddings_factory
+        self._lock = threading.Lock()
+        self._build_locks: Dict[RetrieverKey, threading.Lock] = {}
+        self._databases: Dict[RetrieverKey, VectorDatabase] = {}
+        self._stats: Dict[RetrieverKey, Dict[str, Any]] = {}
+
+    def get(self, key: Optional[RetrieverKey] = None) -> VectorDatabase:
+        """获取 key 对应的向量数据库实例，不存在时构建；并发调用同一 key 时只会构建一次。"""
+        key = key or RetrieverKey.create()
+        vector_db = self._databases.get(key)
+        if vector_db is not None:
+            return vector_db
+        with self._lock:
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+        with build_lock:
+            vector_db = self._databases.get(key)
+            if vector_db is None:
+                vector_db = VectorDatabaseFactory.create(
+                    embeddings=self.embeddings_factory(key),
+                    vector_db_path=key.vector_db_path,
+                    collection_name=key.collection_name,
+                    backend=key.backend,
+                )
+                # 统计信息只在构建时读取一次，检索路径上不再调用 collection.count()
+                self._stats[key] = vector_db.get_stats()
+                self._databases[key] = vector_db
+        return vector_db
+
+    def stats(self, key: Optional[RetrieverKey] = None) -> Dict[str, Any]:
+        """返回构建时缓存的统计信息（必要时先构建实例）。"""
+        key = key or RetrieverKey.create()
+        self.get(key)
+        return self._stats.get(key, {"status": "not_initialized"})
+
+    def is_ready(self, key: Optional[RetrieverKey] = None) -> bool:
+        """向量库已初始化且非空。"""
+        stats = self.stats(key)
+        return stats.get("status") == "initialized" and stats.get("documents_count", 0) > 0
+
+    def refresh_stats(self, key: Optional[RetrieverKey] = None) -> Dict[str, Any]:
+        """重新读取统计信息（例如入库后）。"""
+        key = key or RetrieverKey.create()
+        stats = self.get(key).get_stats()
+        self._stats[key] = stats
+        return stats
+
+    def warm_up(self, keys: Optional[Iterable[RetrieverKey]] = None) -> Dict[RetrieverKey, Dict[str, Any]]:
+        """预先构建检索器，返回各 key 的统计信息。"""
+        keys = list(keys) if keys is not None else [RetrieverKey.create()]
+        return {key: self.stats(key) for key in keys}
+
+    def close(self, key: Optional[RetrieverKey] = None) -> None:
+        """释放指定 key（或全部）检索器；之后再次使用会重新构建。"""
+        with self._lock:
+            keys = [key] if key is not None else list(self._databases.keys())
+            for k in keys:
+                vector_db = self._databases.pop(k, None)
+                self._stats.pop(k, None)
+                self._build_locks.pop(k, None)
+                if vector_db is not None:
+                    vector_db.close()
+
+
+_default_registry = RetrieverRegistry()
+
+
+def get_registry() -> RetrieverRegistry:
+    """获取进程级默认注册表。"""
+    return _default_registry
@@ -0,0 +1,204 @@
+"""
+轻量级链路追踪与指标
+
+为流程节点与对外调用（LLM、嵌入、检索）记录 span：耗时、prompt/completion token 数、
+提示词字符数、检索文档数、缓存命中等；可导出为 JSON Lines 与 Prometheus 文本格式。
+父子关系通过 contextvars 传递，asyncio 任务与 asyncio.to_thread 中同样适用。
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+
+# 参与汇总的数值属性（Prometheus 中导出为计数器）
+SUMMED_ATTRS = ("prompt_tokens", "completion_tokens", "prompt_chars", "retrieved_docs", "context_tokens", "cache_hits",
+                "inputs", "fallbacks", "coalesced")
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """一次被追踪的操作"""
+
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_id", "start", "duration", "status", "attrs")
+
+    def __init__(self, name: str, kind: str, parent: Optional["Span"], attrs: Dict[str, Any]):
+        self.name = name
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start = time.time()
+        self.duration = 0.0
+        self.status = "ok"
+        self.attrs = dict(attrs)
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def add(self, **deltas: float) -> None:
+        """数值属性累加（同一 span 内多次调用时使用）。"""
+        for k, v in deltas.items():
+            self.attrs[k] = self.attrs.get(k, 0) + v
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start": round(self.start, 6),
+            "duration_ms": round(self.duration * 1000, 3),
+            "status": self.status,
+            "attrs": self.attrs,
+        }
+
+
+class Tracer:
+    """收集 span 并维护按名称聚合的指标（线程安全）"""
+
+    def __init__(self, enabled: bool = True, max_spans: int = 100000):
+        self.enabled = enabled
+        self._spans: Deque[Span] = deque(maxlen=max_spans)
+        self._metrics: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, kind: str = "internal", **attrs: Any) -> Iterator[Optional[Span]]:
+        """记录一个 span；未启用时产出 None。"""
+        if not self.enabled:
+            yield None
+            return
+        sp = Span(name, kind, _current_span.get(), attrs)
+        token = _current_span.set(sp)
+        begin = time.perf_counter()
+        try:
+            yield sp
+        except BaseException as e:
+            sp.status = "error"
+            sp.attrs["error"] = f"{type(e).__name__}: {e}"[:300]
+            raise
+        finally:
+            sp.duration = time.perf_counter() - begin
+            _current_span.reset(token)
+            self._record(sp)
+
+    def annotate(self, **attrs: Any) -> None:
+        """给当前 span 设置属性（无当前 span 时忽略）。"""
+        sp = _current_span.get()
+        if sp is not None:
+            sp.set(**attrs)
+
+    def accumulate(self, **deltas: float) -> None:
+        """给当前 span 累加数值属性（无当前 span 时忽略）。"""
+        sp = _current_span.get()
+        if sp is not None:
+            sp.add(**deltas)
+
+    def _record(self, sp: Span) -> None:
+        with self._lock:
+            self._spans.append(sp)
+            m = self._metrics.setdefault(sp.name, {
+                "kind": sp.kind, "count": 0, "errors": 0, "duration_sum": 0.0,
+                "buckets": [0] * len(DURATION_BUCKETS), "sums": {},
+            })
+            m["count"] += 1
+            m["errors"] += 1 if sp.status == "error" else 0
+            m["duration_sum"] += sp.duration
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if sp.duration <= bound:
+                    m["buckets"][i] += 1
+            for key in SUMMED_ATTRS:
+                val = sp.attrs.get(key)
+                if isinstance(val, bool):
+                    val = int(val)
+                if isinstance(val, (int, float)):
+                    m["sums"][key] = m["sums"].get(key, 0) + val
+
+    # ---- 导出 ----
+    def spans(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [sp.to_dict() for sp in self._spans]
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """按 span 名称汇总：次数、错误数、总耗时与均值、数值属性合计。"""
+        with self._lock:
+            return {
+                name: {
+                    "kind": m["kind"],
+                    "count": m["count"],
+                    "errors": m["errors"],
+                    "total_s": round(m["duration_sum"], 4),
+                    "mean_ms": round(1000 * m["duration_sum"] / m["count"], 3) if m["count"] else 0.0,
+                    **{k: round(v, 3) for k, v in m["sums"].items()},
+                }
+                for name, m in self._metrics.items()
+            }
+
+    def export_jsonl(self, path: str) -> int:
+        """将已记录的 span 写为 JSON Lines，返回条数。"""
+        spans = self.spans()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for sp in spans:
+                f.write(json.dumps(sp, ensure_ascii=False) + "\n")
+        return len(spans)
+
+    def prometheus_text(self, prefix: str = "drug_rag") -> str:
+        """Prometheus 文本格式：耗时直方图、错误计数与各数值属性计数器。"""
+        lines: List[str] = []
+        with self._lock:
+            metrics = {name: dict(m, sums=dict(m["sums"]), buckets=list(m["buckets"]))
+                       for name, m in self._metrics.items()}
+        hist = f"{prefix}_span_duration_seconds"
+        lines.append(f"# HELP {hist} Span duration in seconds.")
+        lines.append(f"# TYPE {hist} histogram")
+        for name, m in sorted(metrics.items()):
+            labels = f'span="{name}",kind="{m["kind"]}"'
+            for bound, cnt in zip(DURATION_BUCKETS, m["buckets"]):
+                lines.append(f'{hist}_bucket{{{labels},le="{bound}"}} {cnt}')
+            lines.append(f'{hist}_bucket{{{labels},le="+Inf"}} {m["count"]}')
+            lines.append(f"{hist}_sum{{{labels}}} {m['duration_sum']:.6f}")
+            lines.append(f"{hist}_count{{{labels}}} {m['count']}")
+        err = f"{prefix}_span_errors_total"
+        lines.append(f"# HELP {err} Spans that raised an exception.")
+        lines.append(f"# TYPE {err} counter")
+        for name, m in sorted(metrics.items()):
+            lines.append(f'{err}{{span="{name}"}} {m["errors"]}')
+        for key in SUMMED_ATTRS:
+            metric = f"{prefix}_{key}_total"
+            rows = [(name, m["sums"][key]) for name, m in sorted(metrics.items()) if key in m["sums"]]
+            if not rows:
+                continue
+            lines.append(f"# HELP {metric} Sum of span attribute {key}.")
+            lines.append(f"# TYPE {metric} counter")
+            for name, val in rows:
+                lines.append(f'{metric}{{span="{name}"}} {val}')
+        return "\n".join(lines) + "\n"
+
+    def export_prometheus(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+
+    def reset(self) -> None:
+        with self._lock:
+            self._spans.clear()
+            self._metrics.clear()
+
+
+_tracer = Tracer(enabled=os.getenv("TRACING", "1") != "0")
+
+
+def get_tracer() -> Tracer:
+    """获取进程级追踪器（环境变量 TRACING=0 关闭）。"""
+    return _tracer
@@ -1,4 +1,9 @@
+import asyncio
 import re
+import threading
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Iterator, List, Optional
 from prompt import query_prompt
 
 
@@ -11,6 +16,177 @@ def remove_think_blocks(text: str) -> str:
     return cleaned.strip()
 
 
+class ThinkBlockFilter:
+    """流式版 remove_think_blocks：逐段喂入模型输出，返回已确定不在 <think>...</think> 内的文本。"""
+
+    OPEN = "<think>"
+    CLOSE = "</think>"
+
+    def __init__(self):
+        self._buf = ""
+        self._in_think = False
+
+    def feed(self, chunk: str) -> str:
+        self._buf += chunk or ""
+        out = []
+        while self._buf:
+            lower = self._buf.lower()
+            if self._in_think:
+                idx = lower.find(self.CLOSE)
+                if idx < 0:
+                    # 只保留可能构成结束标签前缀的尾部
+                    self._buf = self._buf[-(len(self.CLOSE) - 1):]
+                    break
+                self._buf = self._buf[idx + len(self.CLOSE):]
+                self._in_think = False
+            else:
+                idx = lower.find(self.OPEN)
+                if idx >= 0:
+                    out.append(self._buf[:idx])
+                    self._buf = self._buf[idx + len(self.OPEN):]
+                    self._in_think = True
+                    continue
+                keep = 0
+                for k in range(min(len(self.OPEN) - 1, len(lower)), 0, -1):
+                    if lower.endswith(self.OPEN[:k]):
+                        keep = k
+                        break
+                out.append(self._buf[:len(self._buf) - keep])
+                self._buf = self._buf[len(self._buf) - keep:]
+                break
+        return "".join(out)
+
+    def flush(self) -> str:
+        """流结束时调用：未闭合的 think 块整体丢弃，其余缓冲原样输出。"""
+        tail = "" if self._in_think else self._buf
+        self._buf = ""
+        self._in_think = False
+        return tail
+
+
+_CJK_RE = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]")
+
+
+def batched(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """按 size 条一组切分任意可迭代对象（惰性，不预先展开）。"""
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, max(1, size)))
+        if not chunk:
+            return
+        yield chunk
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计 token 数：中日韩字符按 1 个 token 计，其余字符按约 4 个字符 1 个 token 计。"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class LRUCache:
+    """线程安全的内存 LRU 缓存（超出容量时淘汰最久未访问的条目）。"""
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class LoopLocal:
+    """按事件循环分别持有的异步资源（驱动、连接池只能在创建它的事件循环中使用）。
+
+    get() 返回当前事件循环的实例，必要时以 factory 创建；换用新的事件循环不会替换旧实例，
+    aclose() 关闭当前循环以及仍在其他线程运行的循环上的实例。已结束的循环无法再执行异步关闭，
+    其实例在下次 get() 时移除并告警（应在事件循环结束前调用 aclose()）。
+    """
+
+    def __init__(self, factory: Callable[[], Any], closer: Callable[[Any], Awaitable[Any]], name: str = "异步资源"):
+        self._factory = factory
+        self._closer = closer
+        self._name = name
+        self._items: Dict[asyncio.AbstractEventLoop, Any] = {}
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            item = self._items.get(loop)
+            if item is None:
+                stale = [old for old in self._items if old.is_closed()]
+                for old in stale:
+                    del self._items[old]
+                if stale:
+                    print(f"⚠️ {len(stale)} 个{self._name}所在的事件循环已结束且未调用 aclose()，连接未能关闭")
+                item = self._items[loop] = self._factory()
+        return item
+
+    async def aclose(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            items = list(self._items.items())
+        for owner, item in items:
+            if owner is loop:
+                await self._closer(item)
+            elif owner.is_running():
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._closer(item), owner))
+            elif not owner.is_closed():
+                continue  # 空闲的事件循环：留待其再次运行时关闭
+            with self._lock:
+                self._items.pop(owner, None)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+def extract_diagnoses(medical_text: str) -> List[str]:
+    """从一行病历 JSON 中取出 出院诊断 术语（去重保序，忽略单字）；无法解析时返回空列表。"""
+    import json
+    try:
+        obj = json.loads(str(medical_text))
+    except Exception:
+        return []
+    diag = obj.get("出院诊断") if isinstance(obj, dict) else None
+    if isinstance(diag, str):
+        diag = re.split(r"[，,；;、]", diag)
+    terms: List[str] = []
+    for d in diag or []:
+        d = str(d).strip()
+        if len(d) >= 2 and d not in terms:
+            terms.append(d)
+    return terms
+
+
 def preprocess_medical_text(medical_text: str) -> str:
     """将 medical_text(一行JSON或原文) 解析并填充到 query_prompt 模板，返回完整提示词。"""
     import json
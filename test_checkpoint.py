@@ -0,0 +1,63 @@
+#测试用：检查点续跑只跳过成功的记录（LLM / 检索失败的记录在下次运行时重试）
+
+import os
+import sys
+import json
+import asyncio
+import tempfile
+
+PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
+for p in (os.path.join(PROJECT_ROOT, "scripts"), os.path.join(PROJECT_ROOT, "src"), PROJECT_ROOT):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+os.environ.setdefault("LLM_CACHE", "0")
+os.environ.setdefault("EMBEDDING_CACHE", "0")
+
+from checkpoint import CheckpointWriter, load_completed_ids  # noqa: E402
+
+RECORD = json.dumps({"患者序号": 1, "就诊标识": "1-1", "主诉": "口干多饮1年", "出院诊断": ["2型糖尿病"]},
+                    ensure_ascii=False)
+
+
+class FailingLLM:
+    """推荐调用抛出异常的 LLM（模拟上游服务不可用）"""
+    max_tokens = 1024
+
+    async def acomplete(self, prompt: str, **kwargs):
+        raise ConnectionError("upstream unavailable")
+
+
+def test_failed_record_not_completed():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "ckpt.jsonl")
+        with CheckpointWriter(path) as writer:
+            writer.write({"ID": "1-1", "prediction": ["二甲双胍片"], "error": None})
+            writer.write({"ID": "1-2", "prediction": [], "error": "ConnectionError: upstream unavailable"})
+        assert load_completed_ids(path) == {"1-1"}
+
+
+def test_llm_outage_is_checkpointed_as_failure():
+    import work
+
+    async def retrieve(query_text, json_text):
+        return "知识库内容"
+
+    work.dg.llm = FailingLLM()
+    work.dg.query_mode = "lexical"
+    work.dg.query_builder = work.load_query_builder([], work.dg.candidate_names, stats_path=None)
+    work.dg.aretrieve_context = retrieve
+
+    res = asyncio.run(work.process_record(work.build_graph(), 1, RECORD, RECORD))
+    assert res["error"] and res["prediction"] == []
+
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "ckpt.jsonl")
+        with CheckpointWriter(path) as writer:
+            writer.write({"ID": res["ID"], "prediction": res["prediction"], "error": res["error"]})
+        assert str(res["ID"]) not in load_completed_ids(path)
+
+
+if __name__ == "__main__":
+    test_failed_record_not_completed()
+    test_llm_outage_is_checkpointed_as_failure()
+    print("✅ 检查点测试通过")
@@ -0,0 +1,40 @@
+#测试用：上下文打包不因其他药物的相同字段而丢弃本药物的字段
+
+import os
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
+for p in (os.path.join(PROJECT_ROOT, "src"), PROJECT_ROOT):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+from context_packer import ContextPacker  # noqa: E402
+
+
+def drug_text(name: str, indication: str, contraindication: str) -> str:
+    return f"药物名称为“{name}”；治疗病症为“{indication}”；禁忌症为“{contraindication}”。"
+
+
+def test_same_contraindication_kept_for_each_drug():
+    docs = [
+        (drug_text("二甲双胍", "2型糖尿病", "对本品成分过敏者禁用"), 0.9),
+        (drug_text("盐酸二甲双胍缓释片", "2型糖尿病", "对本品成分过敏者禁用"), 0.85),
+        (drug_text("依卡倍特钠", "胃溃疡", "对本品成分过敏者禁用"), 0.8),
+    ]
+    lines = ContextPacker().pack(docs).split("\n")
+    assert len(lines) == 3
+    for line in lines:
+        assert "禁忌症：对本品成分过敏者禁用" in line
+    assert "治疗病症：2型糖尿病" in lines[1]
+
+
+def test_duplicate_fields_within_one_drug_dropped():
+    text = "药物名称为“阿卡波糖片”；治疗病症为“2型糖尿病”；适用人群为“2型糖尿病”。"
+    packed = ContextPacker().pack([(text, 0.9)])
+    assert packed == "【阿卡波糖片】治疗病症：2型糖尿病"
+
+
+if __name__ == "__main__":
+    test_same_contraindication_kept_for_each_drug()
+    test_duplicate_fields_within_one_drug_dropped()
+    print("✅ 上下文打包测试通过")
@@ -0,0 +1,181 @@
+"""
+BM25 稀疏索引
+
+与向量库同一批文档上的进程内 BM25 检索：
+- 中文按字符二元组切分（单字片段保留单字），英文/数字按连续串切分；
+- 倒排表为压缩的数组结构（CSR）：offsets[词项] 指向 doc_ids / tfs 中的一段，
+  与文档长度一起保存为 <collection>.bm25.npz，词项表与行信息保存为 <collection>.bm25.json；
+- 查询不需要嵌入请求，可在嵌入服务变慢或不可用时兜底，也可与稠密检索以 RRF 融合。
+"""
+
+import json
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+_TOKEN_RE = re.compile(r"[一-鿿]+|[a-z0-9]+(?:\.[0-9]+)?")
+
+
+def tokenize(text: str) -> List[str]:
+    """NFKC + 小写后切分：汉字连续段取字符二元组（单字段取单字），字母数字串整体作为一个词项。"""
+    tokens: List[str] = []
+    for m in _TOKEN_RE.finditer(unicodedata.normalize("NFKC", str(text)).lower()):
+        run = m.group(0)
+        if run.isascii() or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def rrf_fuse(rankings: Sequence[Sequence[Any]], key, top_k: int, k: int = 60) -> List[Tuple[Any, float]]:
+    """Reciprocal Rank Fusion：各路排名 r 贡献 1/(k + r)，按 key(item) 合并，返回 [(item, 融合分)]。"""
+    scores: Dict[Any, float] = {}
+    items: Dict[Any, Any] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            item_key = key(item)
+            scores[item_key] = scores.get(item_key, 0.0) + 1.0 / (k + rank)
+            items.setdefault(item_key, item)
+    ordered = sorted(scores.items(), key=lambda kv: -kv[1])[:top_k]
+    return [(items[item_key], score) for item_key, score in ordered]
+
+
+class BM25Index:
+    """字符二元组 BM25 索引（整体替换快照，检索无需加锁）"""
+
+    def __init__(self, index_dir: str, name: str, k1: float = 1.2, b: float = 0.75):
+        self.index_dir = index_dir
+        self.name = name
+        self.k1 = k1
+        self.b = b
+        self.arrays_path = os.path.join(index_dir, f"{name}.bm25.npz")
+        self.meta_path = os.path.join(index_dir, f"{name}.bm25.json")
+        self._lock = threading.Lock()
+        self._data: Optional[Dict[str, Any]] = None
+
+    # ---- 构建与持久化 ----
+    def build(self, rows: List[Dict[str, Any]]) -> None:
+        """由行信息 [{id, text, ...}] 构建索引并持久化。"""
+        vocab: Dict[str, int] = {}
+        postings: List[List[Tuple[int, int]]] = []
+        doc_len = np.zeros(len(rows), dtype=np.int32)
+        for doc, row in enumerate(rows):
+            counts = Counter(tokenize(row.get("text") or ""))
+            doc_len[doc] = sum(counts.values())
+            for term, tf in counts.items():
+                tid = vocab.setdefault(term, len(vocab))
+                if tid == len(postings):
+                    postings.append([])
+                postings[tid].append((doc, tf))
+        offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(p) for p in postings])
+        doc_ids = np.fromiter((d for p in postings for d, _ in p), dtype=np.int32, count=int(offsets[-1]))
+        tfs = np.fromiter((min(tf, 65535) for p in postings for _, tf in p), dtype=np.uint16,
+                          count=int(offsets[-1]))
+        data = {
+            "terms": vocab, "rows": rows, "offsets": offsets, "doc_ids": doc_ids, "tfs": tfs,
+            "doc_len": doc_len, "avgdl": float(doc_len.mean()) if len(rows) else 0.0,
+        }
+        with self._lock:
+            self._save(data)
+            self._data = data
+
+    def _save(self, data: Dict[str, Any]) -> None:
+        """先写临时文件再原子替换。"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        tmp_arrays = self.arrays_path + ".tmp.npz"
+        tmp_meta = self.meta_path + ".tmp"
+        np.savez(tmp_arrays, offsets=data["offsets"], doc_ids=data["doc_ids"], tfs=data["tfs"],
+                 doc_len=data["doc_len"])
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "terms": list(data["terms"]), "rows": data["rows"]},
+                      f, ensure_ascii=False)
+        os.replace(tmp_arrays, self.arrays_path)
+        os.replace(tmp_meta, self.meta_path)
+
+    def load(self) -> bool:
+        """加载已持久化的索引；文件不存在或损坏时返回 False。"""
+        if not (os.path.isfile(self.arrays_path) and os.path.isfile(self.meta_path)):
+            return False
+        try:
+            with np.load(self.arrays_path) as arrays:
+                offsets, doc_ids, tfs, doc_len = (arrays[k] for k in ("offsets", "doc_ids", "tfs", "doc_len"))
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except Exception as e:
+            print(f"⚠️ 读取 BM25 索引失败，将重建: {e}")
+            return False
+        rows = meta["rows"]
+        if len(rows) != len(doc_len) or len(meta["terms"]) + 1 != len(offsets):
+            print("⚠️ BM25 索引文件不一致，将重建")
+            return False
+        self._data = {
+            "terms": {t: i for i, t in enumerate(meta["terms"])}, "rows": rows, "offsets": offsets,
+            "doc_ids": doc_ids, "tfs": tfs, "doc_len": doc_len,
+            "avgdl": float(doc_len.mean()) if len(rows) else 0.0,
+        }
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            for path in (self.arrays_path, self.meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._data = None
+
+    @property
+    def ready(self) -> bool:
+        return self._data is not None
+
+    def __len__(self) -> int:
+        return len(self._data["rows"]) if self._data else 0
+
+    # ---- 检索 ----
+    def scores(self, query: str) -> np.ndarray:
+        """查询对全部文档的 BM25 得分（一次遍历查询词项的倒排段）。"""
+        return self._scores(self._data, query)
+
+    def _scores(self, data: Optional[Dict[str, Any]], query: str) -> np.ndarray:
+        if not data or not data["rows"]:
+            return np.zeros(0, dtype=np.float32)
+        n = len(data["rows"])
+        norm = self.k1 * (1.0 - self.b + self.b * data["doc_len"] / max(data["avgdl"], 1e-9))
+        scores = np.zeros(n, dtype=np.float32)
+        offsets, doc_ids, tfs = data["offsets"], data["doc_ids"], data["tfs"]
+        for term, qtf in Counter(tokenize(query)).items():
+            tid = data["terms"].get(term)
+            if tid is None:
+                continue
+            lo, hi = offsets[tid], offsets[tid + 1]
+            docs = doc_ids[lo:hi]
+            tf = tfs[lo:hi].astype(np.float32)
+            df = hi - lo
+            idf = np.log1p((n - df + 0.5) / (df + 0.5))
+            # 同一词项的倒排段内文档互不重复，可直接按下标累加
+            scores[docs] += qtf * idf * tf * (self.k1 + 1.0) / (tf + norm[docs])
+        return scores
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[Dict[str, Any], float]]:
+        """返回得分大于 0 的前 top_k 个 (行信息, 得分)。"""
+        data = self._data
+        scores = self._scores(data, query)
+        hits = int(np.count_nonzero(scores))
+        if not hits:
+            return []
+        k = min(top_k or hits, hits)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(data["rows"][int(i)], float(scores[i])) for i in top]
+
+
+def rows_from_texts(ids: Iterable[str], texts: Iterable[Optional[str]],
+                    metadatas: Iterable[Optional[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """把向量库中的 (id, 文本, 元数据) 整理为索引行。"""
+    return [{"id": i, "text": t or "", "metadata": dict(m or {})} for i, t, m in zip(ids, texts, metadatas)]
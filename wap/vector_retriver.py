@@ -7,37 +7,155 @@
 from pathlib import Path
 import sys
 import os
-from typing import List, Optional, Dict, Any, Union
+import json
+import math
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional, Dict, Any, Set, Tuple, Union
 import asyncio
 
+import numpy as np
+
 current_dir = Path(__file__).parent
 project_root = current_dir.parent.parent
 sys.path.insert(0, str(project_root))
 
 
 from llama_index.core import Document
-from llama_index.core.schema import NodeWithScore
-from llama_index.core import VectorStoreIndex, StorageContext
+from llama_index.core.schema import NodeWithScore, TextNode
+from llama_index.core.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+from llama_index.core import VectorStoreIndex, StorageContext, Settings
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.schema import BaseNode, MetadataMode
 from llama_index.vector_stores.chroma import ChromaVectorStore
 import chromadb
 
+sys.path.insert(0, str(current_dir.parent))
+from wap.bm25_index import BM25Index, rows_from_texts, rrf_fuse
+
+
+SEARCH_MODES = ("dense", "bm25", "hybrid")
+# 混合检索时每一路取回的候选数（再由 RRF 融合到 top_k）
+HYBRID_DEPTH = 30
+
+_dense_pool: Optional[ThreadPoolExecutor] = None
+_dense_pool_lock = threading.Lock()
+
+
+def _get_dense_pool() -> ThreadPoolExecutor:
+    global _dense_pool
+    with _dense_pool_lock:
+        if _dense_pool is None:
+            _dense_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="dense-search")
+        return _dense_pool
+
+
+class SparseSearchMixin:
+    """在稠密检索之上提供 BM25 检索、RRF 混合检索与嵌入超时/故障时的 BM25 兜底。
+
+    子类实现 _dense_search / _dense_search_many（失败时抛异常）、_bm25_rows（全部行）、
+    _bm25_node（行 -> NodeWithScore）与 _count，并在初始化后调用 _init_bm25。
+    search_mode：dense（默认）/ bm25 / hybrid，取自环境变量 SEARCH_MODE；
+    dense_timeout：稠密检索（含查询嵌入）超过该秒数即改用 BM25 结果，取自 DENSE_TIMEOUT，默认不限。
+    """
+
+    # 不同后端的行信息格式不同，各自使用独立的索引文件
+    bm25_suffix = ""
+
+    def _init_bm25(self) -> None:
+        self.search_mode = os.getenv("SEARCH_MODE", "dense")
+        if self.search_mode not in SEARCH_MODES:
+            raise ValueError(f"未知的检索模式: {self.search_mode}，可选 {SEARCH_MODES}")
+        timeout = os.getenv("DENSE_TIMEOUT")
+        self.dense_timeout: Optional[float] = float(timeout) if timeout else None
+        self.bm25 = BM25Index(self.vector_db_path, self.collection_name + self.bm25_suffix)
+        count = self._count()
+        if (not self.bm25.load() or len(self.bm25) != count) and count:
+            self.refresh_bm25()
+            print(f"✅ 已构建 BM25 索引: {len(self.bm25)} 条")
+
+    def refresh_bm25(self) -> None:
+        """按当前库内全部行重建 BM25 索引（写入、删除后调用）。"""
+        self.bm25.build(self._bm25_rows())
+
+    def _bm25_search(self, query: str, top_k: Optional[int]) -> List[NodeWithScore]:
+        return [self._bm25_node(row, score) for row, score in self.bm25.search(query, top_k or 10)]
+
+    def _call_dense(self, fn: Callable, *args):
+        """执行稠密检索；设置了 dense_timeout 时在线程池中执行并限时等待。"""
+        if not self.dense_timeout:
+            return fn(*args)
+        return _get_dense_pool().submit(fn, *args).result(timeout=self.dense_timeout)
+
+    @staticmethod
+    def _fuse(rankings: List[List[NodeWithScore]], top_k: int) -> List[NodeWithScore]:
+        fused = rrf_fuse(rankings, key=lambda n: n.node.node_id, top_k=top_k)
+        return [NodeWithScore(node=item.node, score=score) for item, score in fused]
+
+    def _fallback_reason(self, e: Exception) -> str:
+        return "稠密检索超时" if isinstance(e, TimeoutError) else f"稠密检索失败（{type(e).__name__}: {e}）"
+
+    def search(self, query: str, top_k: int = None) -> List[NodeWithScore]:
+        """按 search_mode 检索；稠密检索失败或超时时返回 BM25 结果"""
+        if self.search_mode == "bm25":
+            return self._bm25_search(query, top_k)
+        depth = max(top_k or 10, HYBRID_DEPTH) if self.search_mode == "hybrid" else top_k
+        try:
+            dense = self._call_dense(self._dense_search, query, depth)
+        except Exception as e:
+            if not self.bm25.ready:
+                print(f"❌ 向量数据库搜索失败: {e}")
+                return []
+            print(f"⚠️ {self._fallback_reason(e)}，改用 BM25 检索")
+            return self._bm25_search(query, top_k)
+        if self.search_mode == "hybrid":
+            return self._fuse([dense, self._bm25_search(query, depth)], top_k or 10)
+        return dense
+
+    def search_many(self, queries: List[str], top_k: int = None) -> List[List[NodeWithScore]]:
+        """批量检索（稠密部分一次嵌入全部查询）；稠密检索失败或超时时整批返回 BM25 结果"""
+        queries = list(queries)
+        if not queries:
+            return []
+        if self.search_mode == "bm25":
+            return [self._bm25_search(q, top_k) for q in queries]
+        depth = max(top_k or 10, HYBRID_DEPTH) if self.search_mode == "hybrid" else top_k
+        try:
+            dense = self._call_dense(self._dense_search_many, queries, depth)
+        except Exception as e:
+            if not self.bm25.ready:
+                print(f"❌ 向量数据库批量搜索失败: {e}")
+                return [[] for _ in queries]
+            print(f"⚠️ {self._fallback_reason(e)}，本批 {len(queries)} 条改用 BM25 检索")
+            return [self._bm25_search(q, top_k) for q in queries]
+        if self.search_mode == "hybrid":
+            return [self._fuse([d, self._bm25_search(q, depth)], top_k or 10) for q, d in zip(queries, dense)]
+        return dense
+
 
-class VectorDatabase:
+class VectorDatabase(SparseSearchMixin):
     """向量数据库管理类"""
     
     def __init__(self, 
                  embeddings=None,
                  vector_db_path: str = None,
-                 collection_name: str = None):
+                 collection_name: str = None,
+                 embed_batch_size: int = 64,
+                 write_batch_size: int = 1000):
         self.embeddings = embeddings 
         self.vector_db_path = vector_db_path 
         self.collection_name = collection_name 
+        # 批量写入时每次嵌入请求的文本数、每次写入 Chroma 的条数
+        self.embed_batch_size = embed_batch_size
+        self.write_batch_size = write_batch_size
         self.client = None
         self.vector_store = None
         self.index = None
         
         # 初始化向量数据库
         self._init_vector_database()
+        self._init_bm25()
     
     def _init_vector_database(self):
         """初始化向量数据库"""
@@ -83,41 +201,112 @@ class VectorDatabase:
             self.vector_store = None
             self.index = None
     
+    def _to_nodes(self, documents: List[Document]) -> List[BaseNode]:
+        """按索引的切分规则把文档切成节点，节点ID为 <文档ID>::<序号>，相同输入得到相同ID。"""
+        transformations = getattr(self.index, "_transformations", None) or Settings.transformations
+        # 逐个文档切分：切分器按文档ID回填父文档元数据，重名文档放在一起切分会串用元数据
+        nodes = [node for doc in documents for node in run_transformations([doc], transformations)]
+        seq: Dict[str, int] = {}
+        for node in nodes:
+            ref = node.ref_doc_id or node.node_id
+            node.id_ = f"{ref}::{seq.get(ref, 0)}"
+            seq[ref] = seq.get(ref, 0) + 1
+        return nodes
+
+    def _write_nodes(self, nodes: List[BaseNode], upsert: bool) -> None:
+        """分批嵌入并分块写入 Chroma，边写边报告进度。"""
+        write = self.collection.upsert if upsert else self.collection.add
+        chunk_size = max(1, min(self.write_batch_size, self.client.get_max_batch_size()))
+        total = len(nodes)
+        for start in range(0, total, chunk_size):
+            chunk = nodes[start:start + chunk_size]
+            texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in chunk]
+            embeddings = []
+            for i in range(0, len(texts), max(1, self.embed_batch_size)):
+                embeddings.extend(embed_texts(self.embeddings, texts[i:i + self.embed_batch_size]))
+            metadatas = []
+            for node in chunk:
+                meta = node_to_metadata_dict(node, remove_text=True, flat_metadata=True)
+                metadatas.append({k: ("" if v is None else v) for k, v in meta.items()})
+            write(
+                ids=[node.node_id for node in chunk],
+                embeddings=embeddings,
+                metadatas=metadatas,
+                documents=[node.get_content(metadata_mode=MetadataMode.NONE) for node in chunk],
+            )
+            print(f"   ⏳ 已写入 {min(start + chunk_size, total)}/{total} 个分块")
+
+    def _ids_of_documents(self, doc_ids: List[str]) -> List[str]:
+        """查询属于给定文档ID的全部分块ID（分块查询，避免过长的 $in 条件）"""
+        ids: List[str] = []
+        for i in range(0, len(doc_ids), self.write_batch_size):
+            got = self.collection.get(where={"document_id": {"$in": doc_ids[i:i + self.write_batch_size]}},
+                                      include=[])
+            ids.extend(got["ids"])
+        return ids
+
     def add_documents(self, documents: List[Document]) -> bool:
-        """添加文档到向量数据库"""
+        """批量添加文档：切分后分批嵌入，分块写入 Chroma，最后持久化一次"""
         if not self.index:
             print("❌ 向量数据库未初始化")
             return False
         
         try:
-            # 将文档添加到索引
-            for doc in documents:
-                self.index.insert(doc)
+            nodes = self._to_nodes(documents)
+            self._write_nodes(nodes, upsert=False)
             
             # 持久化存储
             self.storage_context.persist(persist_dir=self.vector_db_path)
             
-            print(f"✅ 成功添加 {len(documents)} 个文档到向量数据库")
+            self.refresh_bm25()
+            print(f"✅ 成功添加 {len(documents)} 个文档（{len(nodes)} 个分块）到向量数据库")
             return True
             
         except Exception as e:
             print(f"❌ 添加文档失败: {e}")
             return False
+
+    def upsert_documents(self, documents: List[Document]) -> bool:
+        """批量写入或覆盖文档：同ID分块原地更新，文档变短后多余的旧分块被删除"""
+        if not self.index:
+            print("❌ 向量数据库未初始化")
+            return False
+
+        try:
+            nodes = self._to_nodes(documents)
+            self._write_nodes(nodes, upsert=True)
+            doc_ids = list(dict.fromkeys(doc.doc_id for doc in documents))
+            fresh = {node.node_id for node in nodes}
+            stale = [i for i in self._ids_of_documents(doc_ids) if i not in fresh]
+            for i in range(0, len(stale), self.write_batch_size):
+                self.collection.delete(ids=stale[i:i + self.write_batch_size])
+
+            # 持久化存储
+            self.storage_context.persist(persist_dir=self.vector_db_path)
+
+            self.refresh_bm25()
+            print(f"✅ 成功写入 {len(doc_ids)} 个文档（{len(nodes)} 个分块，清理旧分块 {len(stale)} 个）")
+            return True
+
+        except Exception as e:
+            print(f"❌ 写入文档失败: {e}")
+            return False
     
     def delete_documents(self, doc_ids: List[str]) -> bool:
-        """从向量数据库删除文档"""
+        """按文档ID批量删除其全部分块，最后持久化一次"""
         if not self.index:
             print("❌ 向量数据库未初始化")
             return False
         
         try:
-            # 删除文档
-            for doc_id in doc_ids:
-                self.index.delete_ref_doc(doc_id)
+            doc_ids = list(doc_ids)
+            for i in range(0, len(doc_ids), self.write_batch_size):
+                self.collection.delete(where={"document_id": {"$in": doc_ids[i:i + self.write_batch_size]}})
             
             # 持久化存储
             self.storage_context.persist(persist_dir=self.vector_db_path)
             
+            self.refresh_bm25()
             print(f"✅ 成功删除 {len(doc_ids)} 个文档")
             return True
             
@@ -125,27 +314,58 @@ class VectorDatabase:
             print(f"❌ 删除文档失败: {e}")
             return False
     
-    def search(self, query: str, top_k: int = None) -> List[NodeWithScore]:
+    def _dense_search(self, query: str, top_k: int = None) -> List[NodeWithScore]:
         """在向量数据库中搜索"""
         if not self.index:
-            print("❌ 向量数据库未初始化")
-            return []
-        
-        top_k = top_k 
-        
+            raise RuntimeError("向量数据库未初始化")
+        # 创建检索器并执行检索
+        retriever = self.index.as_retriever(similarity_top_k=top_k)
+        return retriever.retrieve(query)
+
+    def _dense_search_many(self, queries: List[str], top_k: int = None) -> List[List[NodeWithScore]]:
+        """批量检索：一次嵌入全部查询，再以一次 collection.query 取回各查询的 top-k"""
+        if not self.index:
+            raise RuntimeError("向量数据库未初始化")
+        query_embeddings = embed_texts(self.embeddings, list(queries))
+        results = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=top_k or 10,
+            include=["documents", "metadatas", "distances"],
+        )
+        return [
+            # 与 ChromaVectorStore 的打分方式保持一致
+            [self._chroma_node(node_id, text, meta, math.exp(-dist))
+             for node_id, text, meta, dist in zip(ids, texts, metas, dists)]
+            for ids, texts, metas, dists in zip(results["ids"], results["documents"],
+                                                results["metadatas"], results["distances"])
+        ]
+
+    @staticmethod
+    def _chroma_node(node_id: str, text: Optional[str], meta: Optional[Dict[str, Any]],
+                     score: float) -> NodeWithScore:
         try:
-            # 创建检索器
-            retriever = self.index.as_retriever(similarity_top_k=top_k)
-            
-            # 执行检索
-            nodes = retriever.retrieve(query)
-            
-            return nodes
-            
-        except Exception as e:
-            print(f"❌ 向量数据库搜索失败: {e}")
-            return []
+            node = metadata_dict_to_node(meta, text=text)
+        except Exception:
+            node = TextNode(id_=node_id, text=text or "", metadata=meta or {})
+        return NodeWithScore(node=node, score=score)
+
+    def _count(self) -> int:
+        return self.collection.count() if self.client else 0
+
+    def _bm25_rows(self) -> List[Dict[str, Any]]:
+        got = self.collection.get(include=["documents", "metadatas"])
+        return rows_from_texts(got["ids"], got["documents"], got["metadatas"])
+
+    def _bm25_node(self, row: Dict[str, Any], score: float) -> NodeWithScore:
+        return self._chroma_node(row["id"], row["text"], row["metadata"], score)
     
+    def content_hashes(self) -> Dict[str, Set[str]]:
+        """已入库文档的内容哈希：{文档ID: {content_hash, ...}}（文档被切成多块时各块哈希相同）"""
+        if not self.index:
+            return {}
+        got = self.collection.get(include=["metadatas"])
+        return _collect_hashes(got.get("metadatas") or [])
+
     def get_stats(self) -> Dict[str, Any]:
         """获取向量数据库统计信息"""
         if not self.client:
@@ -183,6 +403,7 @@ class VectorDatabase:
             
             # 重新初始化索引
             self._init_vector_database()
+            self.bm25.clear()
             
             print("✅ 成功清空向量数据库")
             return True
@@ -191,6 +412,14 @@ class VectorDatabase:
             print(f"❌ 清空数据库失败: {e}")
             return False
     
+    def close(self) -> None:
+        """释放客户端、索引等资源引用"""
+        self.index = None
+        self.vector_store = None
+        self.storage_context = None
+        self.collection = None
+        self.client = None
+
     def backup_database(self, backup_path: str) -> bool:
         """备份向量数据库"""
         if not self.client:
@@ -229,26 +458,406 @@ class VectorDatabase:
             return False
 
 
+def _collect_hashes(metadatas) -> Dict[str, Set[str]]:
+    hashes: Dict[str, Set[str]] = {}
+    for meta in metadatas:
+        meta = meta or {}
+        doc_id = meta.get("ref_doc_id") or meta.get("document_id") or meta.get("doc_id")
+        if doc_id is not None:
+            hashes.setdefault(doc_id, set()).add(meta.get("content_hash", ""))
+    return hashes
+
+
+def embed_texts(embeddings, texts: List[str]) -> List[List[float]]:
+    """批量嵌入文本，兼容 LangChain Embeddings 与 LlamaIndex BaseEmbedding。"""
+    if hasattr(embeddings, "embed_documents"):
+        return embeddings.embed_documents(texts)
+    return embeddings.get_text_embedding_batch(texts)
+
+
+def embed_query(embeddings, query: str) -> List[float]:
+    """嵌入单条查询，兼容 LangChain Embeddings 与 LlamaIndex BaseEmbedding。"""
+    if hasattr(embeddings, "embed_query"):
+        return embeddings.embed_query(query)
+    return embeddings.get_query_embedding(query)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """按行 L2 归一化（零向量保持为零），之后余弦相似度即为点积。"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+class NumpyVectorDatabase(SparseSearchMixin):
+    """精确检索的进程内向量库
+
+    所有文档向量（已归一化）保存在一个连续的 float32 矩阵中，持久化为
+    <vector_db_path>/<collection_name>.npy，加载时以只读内存映射打开（零拷贝）；
+    文档 ID、文本与元数据保存在同目录的 <collection_name>.rows.json 中。
+    检索为一次矩阵-向量乘积加 argpartition 取 top-k，适合千条量级的药物知识库。
+    接口与 VectorDatabase 保持一致。
+    """
+
+    bm25_suffix = ".numpy"
+
+    def __init__(self,
+                 embeddings=None,
+                 vector_db_path: str = None,
+                 collection_name: str = None):
+        self.embeddings = embeddings
+        self.vector_db_path = vector_db_path
+        self.collection_name = collection_name
+        self.matrix_path = os.path.join(vector_db_path, f"{collection_name}.npy")
+        self.rows_path = os.path.join(vector_db_path, f"{collection_name}.rows.json")
+        self._lock = threading.Lock()
+        # (矩阵, 行信息) 整体替换，检索时读取快照，无需加锁
+        self._data: Tuple[np.ndarray, List[Dict[str, Any]]] = (np.zeros((0, 0), dtype=np.float32), [])
+        self._load()
+        self._init_bm25()
+
+    def _load(self) -> None:
+        """加载持久化的矩阵与行信息；文件不存在时为空库。"""
+        if os.path.isfile(self.matrix_path) and os.path.isfile(self.rows_path):
+            matrix = np.load(self.matrix_path, mmap_mode="r")
+            with open(self.rows_path, "r", encoding="utf-8") as f:
+                rows = json.load(f)["rows"]
+            if len(rows) != matrix.shape[0]:
+                print(f"❌ 向量矩阵与行信息条数不一致: {matrix.shape[0]} vs {len(rows)}，按空库处理")
+                matrix, rows = np.zeros((0, 0), dtype=np.float32), []
+            # 旧版以文档ID作为行ID，加载时改为 <文档ID>::<序号>（下次写入时持久化）
+            seq: Dict[str, int] = {}
+            for row in rows:
+                if "::" not in row["id"]:
+                    ref = row.get("ref_doc_id") or row["id"]
+                    row["id"] = f"{ref}::{seq.get(ref, 0)}"
+                    seq[ref] = seq.get(ref, 0) + 1
+            self._data = (matrix, rows)
+        print(f"✅ 成功加载 NumPy 向量库: {self.matrix_path}")
+        print(f"📊 集合 '{self.collection_name}' 包含 {len(self._data[1])} 个条目")
+
+    def _save(self, matrix: np.ndarray, rows: List[Dict[str, Any]]) -> None:
+        """先写临时文件再原子替换，随后以内存映射重新打开。"""
+        os.makedirs(self.vector_db_path, exist_ok=True)
+        tmp_matrix = self.matrix_path + ".tmp.npy"
+        tmp_rows = self.rows_path + ".tmp"
+        np.save(tmp_matrix, np.ascontiguousarray(matrix, dtype=np.float32))
+        with open(tmp_rows, "w", encoding="utf-8") as f:
+            json.dump({"dim": int(matrix.shape[1]) if matrix.size else 0, "rows": rows}, f, ensure_ascii=False)
+        os.replace(tmp_matrix, self.matrix_path)
+        os.replace(tmp_rows, self.rows_path)
+        mapped = np.load(self.matrix_path, mmap_mode="r") if rows else np.zeros((0, 0), dtype=np.float32)
+        self._data = (mapped, rows)
+        self.refresh_bm25()
+
+    def _write_rows(self, vectors: np.ndarray, new_rows: List[Dict[str, Any]],
+                    replace_docs: Iterable[str] = ()) -> None:
+        """追加（或按 id 覆盖）行，同时移除 replace_docs 中文档的旧行，一次持久化。调用方需持有锁。"""
+        matrix, rows = self._data
+        if matrix.size and vectors.shape[1] != matrix.shape[1]:
+            raise ValueError(f"嵌入维度不一致: {vectors.shape[1]} vs {matrix.shape[1]}")
+        replaced = {r["id"] for r in new_rows}
+        replaced_docs = set(replace_docs)
+        keep = [i for i, r in enumerate(rows) if r["id"] not in replaced and r.get("ref_doc_id") not in replaced_docs]
+        kept = np.asarray(matrix[keep]) if matrix.size else np.zeros((0, vectors.shape[1]), dtype=np.float32)
+        self._save(np.vstack([kept, _normalize_rows(vectors)]), [rows[i] for i in keep] + new_rows)
+
+    def _embed_rows(self, documents: List[Document]) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
+        """嵌入文档并构造对应的行（每个文档一行）；不持有锁，嵌入请求不阻塞检索与其他写入。
+        行ID与 VectorDatabase._to_nodes 一致为 <文档ID>::<序号>，重名文档各占一行，融合检索与 BM25 不会合并它们。"""
+        texts = [doc.get_content() for doc in documents]
+        vectors = np.asarray(embed_texts(self.embeddings, texts), dtype=np.float32)
+        seq: Dict[str, int] = {}
+        new_rows = []
+        for doc, text in zip(documents, texts):
+            n = seq.get(doc.doc_id, 0)
+            seq[doc.doc_id] = n + 1
+            new_rows.append({"id": f"{doc.doc_id}::{n}", "ref_doc_id": doc.doc_id, "text": text,
+                             "metadata": dict(doc.metadata or {})})
+        return vectors, new_rows
+
+    def add_documents(self, documents: List[Document]) -> bool:
+        """添加文档（每个文档一行，同 ID 的已有行会被覆盖）"""
+        if not documents:
+            return True
+        try:
+            vectors, new_rows = self._embed_rows(documents)
+            with self._lock:
+                self._write_rows(vectors, new_rows)
+            print(f"✅ 成功添加 {len(documents)} 个文档到向量数据库")
+            return True
+        except Exception as e:
+            print(f"❌ 添加文档失败: {e}")
+            return False
+
+    def upsert_documents(self, documents: List[Document]) -> bool:
+        """写入或覆盖文档：先完成嵌入，再在一次持久化中替换同一文档ID的旧行（嵌入失败时旧行保持不变）"""
+        if not documents:
+            return True
+        try:
+            doc_ids = list(dict.fromkeys(doc.doc_id for doc in documents))
+            vectors, new_rows = self._embed_rows(documents)
+            with self._lock:
+                self._write_rows(vectors, new_rows, replace_docs=doc_ids)
+            print(f"✅ 成功写入 {len(doc_ids)} 个文档")
+            return True
+        except Exception as e:
+            print(f"❌ 写入文档失败: {e}")
+            return False
+
+    def delete_documents(self, doc_ids: List[str]) -> bool:
+        """按文档 ID 删除对应的全部行"""
+        try:
+            targets = set(doc_ids)
+            with self._lock:
+                matrix, rows = self._data
+                keep = [i for i, r in enumerate(rows) if r.get("ref_doc_id") not in targets]
+                if len(keep) != len(rows):
+                    kept = np.asarray(matrix[keep]) if keep else np.zeros((0, matrix.shape[1]), dtype=np.float32)
+                    self._save(kept, [rows[i] for i in keep])
+            print(f"✅ 成功删除 {len(doc_ids)} 个文档")
+            return True
+        except Exception as e:
+            print(f"❌ 删除文档失败: {e}")
+            return False
+
+    def _dense_search(self, query: str, top_k: int = None) -> List[NodeWithScore]:
+        """精确余弦检索：一次矩阵-向量乘积 + argpartition"""
+        matrix, rows = self._data
+        if not rows:
+            return []
+        q = np.asarray(embed_query(self.embeddings, query), dtype=np.float32)
+        norm = float(np.linalg.norm(q))
+        if norm > 0:
+            q /= norm
+        scores = matrix @ q
+        k = min(top_k or len(rows), len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [self._node_at(rows, int(i), float(scores[i])) for i in top]
+
+    def _dense_search_many(self, queries: List[str], top_k: int = None) -> List[List[NodeWithScore]]:
+        """批量精确检索：一次嵌入全部查询，查询矩阵 × 语料矩阵后逐行取 top-k"""
+        matrix, rows = self._data
+        if not rows:
+            return [[] for _ in queries]
+        q = _normalize_rows(np.asarray(embed_texts(self.embeddings, list(queries)), dtype=np.float32))
+        scores = q @ matrix.T
+        k = min(top_k or len(rows), len(rows))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        return [[self._node_at(rows, int(i), float(scores[r, i])) for i in top[r]] for r in range(len(queries))]
+
+    def _count(self) -> int:
+        return len(self._data[1])
+
+    def _bm25_rows(self) -> List[Dict[str, Any]]:
+        return self._data[1]
+
+    def _bm25_node(self, row: Dict[str, Any], score: float) -> NodeWithScore:
+        return self._node_at([row], 0, score)
+
+    def content_hashes(self) -> Dict[str, Set[str]]:
+        """已入库文档的内容哈希：{文档ID: {content_hash, ...}}"""
+        _, rows = self._data
+        return _collect_hashes({**(r.get("metadata") or {}), "ref_doc_id": r.get("ref_doc_id")} for r in rows)
+
+    @staticmethod
+    def _node_at(rows: List[Dict[str, Any]], i: int, score: float) -> NodeWithScore:
+        row = rows[i]
+        return NodeWithScore(node=TextNode(id_=row["id"], text=row["text"], metadata=row.get("metadata") or {}),
+                             score=score)
+
+    def import_from_chroma(self) -> bool:
+        """从同一路径、同名的 Chroma 集合导入已有嵌入（无需重新请求嵌入服务）"""
+        try:
+            client = chromadb.PersistentClient(path=self.vector_db_path)
+            collection = client.get_collection(name=self.collection_name)
+            got = collection.get(include=["embeddings", "documents", "metadatas"])
+            embeddings = got.get("embeddings")
+            if embeddings is None or len(embeddings) == 0:
+                print("⚠️ Chroma 集合为空，未导入任何向量")
+                return False
+            rows = []
+            for node_id, text, meta in zip(got["ids"], got["documents"], got["metadatas"]):
+                meta = dict(meta or {})
+                ref_doc_id = meta.get("ref_doc_id") or meta.get("document_id") or meta.get("doc_id") or node_id
+                meta = {k: v for k, v in meta.items()
+                        if not k.startswith("_node") and k not in ("ref_doc_id", "document_id", "doc_id")}
+                rows.append({"id": node_id, "ref_doc_id": ref_doc_id, "text": text or "", "metadata": meta})
+            with self._lock:
+                self._save(_normalize_rows(np.asarray(embeddings, dtype=np.float32)), rows)
+            print(f"✅ 已从 Chroma 集合 '{self.collection_name}' 导入 {len(rows)} 条向量")
+            return True
+        except Exception as e:
+            print(f"❌ 从 Chroma 导入失败: {e}")
+            return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取向量数据库统计信息"""
+        matrix, rows = self._data
+        return {
+            "status": "initialized",
+            "backend": "numpy",
+            "vector_db_path": self.vector_db_path,
+            "collection_name": self.collection_name,
+            "documents_count": len(rows),
+            "dimension": int(matrix.shape[1]) if matrix.size else 0,
+            "embeddings_model": self.embeddings.__class__.__name__
+        }
+
+    def clear_database(self) -> bool:
+        """清空向量数据库"""
+        try:
+            with self._lock:
+                for path in (self.matrix_path, self.rows_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self._data = (np.zeros((0, 0), dtype=np.float32), [])
+                self.bm25.clear()
+            print("✅ 成功清空向量数据库")
+            return True
+        except Exception as e:
+            print(f"❌ 清空数据库失败: {e}")
+            return False
+
+    def close(self) -> None:
+        """释放内存映射"""
+        self._data = (np.zeros((0, 0), dtype=np.float32), [])
+
+
+VECTOR_BACKENDS = {
+    "chroma": VectorDatabase,
+    "numpy": NumpyVectorDatabase,
+}
+
+
 class VectorDatabaseFactory:
     """向量数据库工厂"""
     
     @staticmethod
     def create(embeddings=None,
                vector_db_path: str = None,
-               collection_name: str = None) -> VectorDatabase:
-        """创建向量数据库实例"""
-        return VectorDatabase(
+               collection_name: str = None,
+               backend: str = "chroma") -> Union[VectorDatabase, NumpyVectorDatabase]:
+        """创建向量数据库实例；backend 可选 "chroma"（默认）或 "numpy"（精确检索）"""
+        if backend not in VECTOR_BACKENDS:
+            raise ValueError(f"未知的向量库后端: {backend}，可选 {sorted(VECTOR_BACKENDS)}")
+        return VECTOR_BACKENDS[backend](
             embeddings=embeddings,
             vector_db_path=vector_db_path,
             collection_name=collection_name
         )
 
+# 扩展后的字段中文名称映射
+DRUG_FIELD_MAP = {
+    "drug_name": "药物名称",
+    "suitable_for": "适用人群",
+    "contraindications": "禁忌症",
+    "treats": "治疗病症",
+    "symptoms": "相关症状",
+    "common_adverse_reactions": "常见不良反应",
+    "serious_adverse_reactions": "严重不良反应",
+    "side_effects": "副作用",
+    "drug_interactions": "药物相互作用",
+    "interactions": "相互作用",
+    "precautions": "注意事项",
+    "pharmacological_effects": "药理作用",
+    "dosage_and_administration": "用法用量",
+    "dosage": "剂量",
+    "special_populations": "特殊人群",
+    "storage": "储存方法"
+}
+
+
+def render_drug_text(item: Dict[str, Any]) -> str:
+    """按 DRUG_FIELD_MAP 的顺序将一条药物记录渲染为描述性段落"""
+    text_parts = []
+    for key, readable_name in DRUG_FIELD_MAP.items():
+        value = item.get(key)
+        if value:
+            # 如果值是列表，用顿号连接
+            if isinstance(value, list):
+                value_str = "、".join(map(str, value))
+            else:
+                value_str = str(value)
+            
+            if value_str:
+                text_parts.append(f"{readable_name}为“{value_str}”")
+    return "；".join(text_parts) + "。"
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def build_drug_documents(data: List[Dict[str, Any]]) -> List[Document]:
+    """将药物 JSON 列表转换为 Document（使用 drug_name 作为文档ID）
+
+    渲染文本的哈希写入 metadata["content_hash"] 供增量同步比对，不参与嵌入和 LLM 文本。
+    """
+    documents = []
+    for item in data:
+        text = render_drug_text(item)
+        documents.append(Document(
+            text=text,
+            doc_id=item.get("drug_name"),
+            metadata={"content_hash": content_hash(text)},
+            excluded_embed_metadata_keys=["content_hash"],
+            excluded_llm_metadata_keys=["content_hash"],
+        ))
+    return documents
+
+
+def sync_documents(vector_db, documents: List[Document]) -> Dict[str, Any]:
+    """按内容哈希增量同步：只嵌入并写入新增或变化的文档，只删除已移除的文档。
+
+    同一文档ID出现多次时（例如重名药物）按整组比较，任一条变化则整组重写。
+    返回 {"added": [...], "updated": [...], "deleted": [...], "unchanged": 数量}。
+    """
+    groups: Dict[str, List[Document]] = {}
+    for doc in documents:
+        groups.setdefault(doc.doc_id, []).append(doc)
+    existing = vector_db.content_hashes()
+
+    added, updated, unchanged = [], [], 0
+    for doc_id, docs in groups.items():
+        hashes = {doc.metadata.get("content_hash", "") for doc in docs}
+        if doc_id not in existing:
+            added.append(doc_id)
+        elif existing[doc_id] != hashes:
+            updated.append(doc_id)
+        else:
+            unchanged += 1
+    deleted = [doc_id for doc_id in existing if doc_id not in groups]
+
+    if deleted:
+        vector_db.delete_documents(deleted)
+    to_write = [doc for doc_id in added + updated for doc in groups[doc_id]]
+    if to_write:
+        vector_db.upsert_documents(to_write)
+    return {"added": added, "updated": updated, "deleted": deleted, "unchanged": unchanged}
+
 
 # 使用示例
 if __name__ == "__main__":
     import json
+    import argparse
     from llama_index.core import Document
     from langchain_ollama.embeddings import OllamaEmbeddings
+    sys.path.insert(0, str(current_dir.parent / "src"))
+    from embedding_cache import CachedEmbeddings, get_embedding_cache
+
+    parser = argparse.ArgumentParser(description="构建药物知识向量库")
+    parser.add_argument("--backend", choices=sorted(VECTOR_BACKENDS), default="chroma",
+                        help="chroma：Chroma + LlamaIndex；numpy：内存映射矩阵上的精确检索")
+    parser.add_argument("--from-chroma", action="store_true",
+                        help="仅 numpy 后端：直接导入同路径 Chroma 集合中已有的嵌入，不重新请求嵌入服务")
+    parser.add_argument("--full", action="store_true",
+                        help="清空后全量重建（默认按内容哈希增量同步，只处理变化的药物）")
+    args = parser.parse_args()
 
     # 1. 设置参数
     JSON_FILE_PATH = "/home/lx/drug-ragLLM/merged_20250923_195353.json"
@@ -257,87 +866,65 @@ if __name__ == "__main__":
     EMBEDDING_MODEL = "bge-m3"
     OLLAMA_BASE_URL = "http://localhost:11434"
 
-    # 2. 创建向量数据库实例
+    # 2. 创建向量数据库实例（嵌入结果写入持久化缓存，重复运行时相同文本不再请求嵌入服务）
     print("初始化嵌入模型...")
     embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL, base_url=OLLAMA_BASE_URL)
+    embedding_cache = get_embedding_cache()
+    if embedding_cache is not None:
+        embeddings = CachedEmbeddings(embeddings, embedding_cache, model_name=EMBEDDING_MODEL)
     
-    print(f"创建或连接到向量数据库 at {VECTOR_DB_PATH} with collection {COLLECTION_NAME}...")
+    print(f"创建或连接到向量数据库 at {VECTOR_DB_PATH} with collection {COLLECTION_NAME} ({args.backend})...")
     vector_db = VectorDatabaseFactory.create(
         embeddings=embeddings,
         vector_db_path=VECTOR_DB_PATH,
-        collection_name=COLLECTION_NAME
+        collection_name=COLLECTION_NAME,
+        backend=args.backend
     )
 
-    # 3. 清空数据库 (可选, 确保从一个干净的状态开始)
-    print("清空数据库...")
-    vector_db.clear_database()
-
-    # 4. 加载并处理JSON数据
-    print(f"从 {JSON_FILE_PATH} 加载数据...")
-    try:
-        with open(JSON_FILE_PATH, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        print(f"成功加载 {len(data)} 条记录。")
-    except Exception as e:
-        print(f"❌ 加载JSON文件失败: {e}")
-        sys.exit(1)
-
-    # 5. 将JSON数据转换为Document对象
-    print("正在将数据转换为Document对象...")
-    documents = []
-    # 扩展后的字段中文名称映射
-    field_map = {
-        "drug_name": "药物名称",
-        "suitable_for": "适用人群",
-        "contraindications": "禁忌症",
-        "treats": "治疗病症",
-        "symptoms": "相关症状",
-        "common_adverse_reactions": "常见不良反应",
-        "serious_adverse_reactions": "严重不良反应",
-        "side_effects": "副作用",
-        "drug_interactions": "药物相互作用",
-        "interactions": "相互作用",
-        "precautions": "注意事项",
-        "pharmacological_effects": "药理作用",
-        "dosage_and_administration": "用法用量",
-        "dosage": "剂量",
-        "special_populations": "特殊人群",
-        "storage": "储存方法"
-    }
+    if args.from_chroma and args.backend == "numpy":
+        print("从 Chroma 集合导入已有嵌入...")
+        vector_db.import_from_chroma()
+    else:
+        # 3. 加载并处理JSON数据
+        print(f"从 {JSON_FILE_PATH} 加载数据...")
+        try:
+            with open(JSON_FILE_PATH, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            print(f"成功加载 {len(data)} 条记录。")
+        except Exception as e:
+            print(f"❌ 加载JSON文件失败: {e}")
+            sys.exit(1)
 
-    for item in data:
-        # 构建描述性段落
-        text_parts = []
-        # 使用 field_map 的顺序来构建文本，以获得更一致的输出
-        for key, readable_name in field_map.items():
-            value = item.get(key)
-            if value:
-                # 如果值是列表，用逗号连接
-                if isinstance(value, list):
-                    value_str = "、".join(map(str, value))
-                else:
-                    value_str = str(value)
-                
-                if value_str:
-                    text_parts.append(f"{readable_name}为“{value_str}”")
-
-        text_content = "；".join(text_parts) + "。"
-        
-        # 使用 drug_name 作为文档ID
-        doc_id = item.get("drug_name")
+        # 4. 将JSON数据转换为Document对象
+        print("正在将数据转换为Document对象...")
+        documents = build_drug_documents(data)
         
-        # 创建Document时不再传递metadata
-        documents.append(Document(text=text_content, doc_id=doc_id))
-    
-    print(f"成功创建 {len(documents)} 个Document对象。")
+        print(f"成功创建 {len(documents)} 个Document对象。")
+
+        if args.full:
+            # 5. 清空数据库，确保从一个干净的状态开始
+            print("清空数据库...")
+            vector_db.clear_database()
 
-    # 6. 添加文档到向量数据库
-    print("添加文档到向量数据库...")
-    vector_db.add_documents(documents)
+            # 6. 添加文档到向量数据库
+            print("添加文档到向量数据库...")
+            vector_db.add_documents(documents)
+        else:
+            # 5. 按内容哈希增量同步
+            print("增量同步到向量数据库...")
+            diff = sync_documents(vector_db, documents)
+            print(f"新增 {len(diff['added'])}，更新 {len(diff['updated'])}，"
+                  f"删除 {len(diff['deleted'])}，未变化 {diff['unchanged']}")
+            for label in ("added", "updated", "deleted"):
+                if diff[label]:
+                    print(f"  {label}: {'、'.join(map(str, diff[label][:20]))}"
+                          + (" ..." if len(diff[label]) > 20 else ""))
     
     # 7. 获取统计信息并验证
     stats = vector_db.get_stats()
     print(f"向量数据库统计: {stats}")
+    if embedding_cache is not None:
+        print(f"嵌入缓存统计: {embedding_cache.stats()}")
     
     # 8. 测试搜索
     if stats.get("documents_count", 0) > 0: